@@ -0,0 +1,42 @@
+import os
+import sys
+import timeit
+import argparse
+
+from pycaption import WebVTTReader as PycaptionWebVTTReader, WebVTTWriter as PycaptionWebVTTWriter
+
+# the modules of easy-ott-subtitles import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'easy-ott-subtitles'))
+
+from WebVtt import WebVttReader, WebVttWriter
+
+
+####################################################
+#
+#  __main__
+#  WebVtt against pycaption on 6 second segments
+#
+####################################################
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="WebVTT benchmark")
+    parser.add_argument('-n', '--number', help="number of segments", type=int, default=2000)
+    args = parser.parse_args()
+
+    segment = ('WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:900000,LOCAL:00:00:00.000\n\n'
+               '1\n00:10:00.000 --> 00:10:01.800 line:85% align:center\nWe need to talk about the budget,\nbefore the meeting.\n\n'
+               '2\n00:10:02.000 --> 00:10:03.900 line:85% align:center\n<i>Not now.</i>\n\n'
+               '3\n00:10:04.100 --> 00:10:05.960 line:85% align:center\nThen when? The numbers\ndon\'t add up.\n\n').encode('utf-8')
+
+    def pycaption_round_trip():
+        PycaptionWebVTTWriter().write(PycaptionWebVTTReader().read(segment.decode('utf-8'))).encode('utf-8')
+
+    def native_round_trip():
+        WebVttWriter().write(WebVttReader().read(segment))
+
+    pycaption_seconds = timeit.timeit(pycaption_round_trip, number=args.number)
+    native_seconds = timeit.timeit(native_round_trip, number=args.number)
+
+    print("pycaption: {:.1f} us per segment".format(pycaption_seconds / args.number * 1000000))
+    print("native:    {:.1f} us per segment".format(native_seconds / args.number * 1000000))
+    print("speedup:   {:.1f}x".format(pycaption_seconds / native_seconds))
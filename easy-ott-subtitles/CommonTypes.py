@@ -1,6 +1,9 @@
 from typing import Any, Callable, Dict, Optional, Iterable, List
 import threading
 import math
+import time
+import random
+from collections import deque
 from enum import Enum
 from urllib.parse import urlparse, urlunparse
 import base64
@@ -23,6 +26,8 @@ class EosNames:
     fragment_hls_prefix = 'eos_hls_fragment'
     fragment_dash_prefix = 'eos_dash_fragment'
     live_manifest_prefix = 'eos_live'
+    stats_path = 'stats'
+    admin_path = 'admin'
 
 
 ####################################################
@@ -63,8 +68,9 @@ class Context:
     ####################################################
     #  put_job
     ####################################################
-    def put_job(self, tag: int, class_instance, function: Callable, args: Iterable) -> None:
+    def put_job(self, tag: int, class_instance, function: Callable, args: Iterable, lane: str = 'default', may_reject: bool = True) -> bool:
         Utils.logger_.error('Context', "Context::put_job virtual function called")
+        return False
 
 
 ####################################################
@@ -120,6 +126,7 @@ class FutureResult:
     __class_instance: Any
     __function: Callable
     __args: Optional[Dict[str, Any]]
+    __lane: str
 
     ####################################################
     #  __init__
@@ -129,13 +136,15 @@ class FutureResult:
                  tag: int,
                  class_instance,
                  function: Callable,
-                 args: Optional[Dict[str, Any]]) -> None:
+                 args: Optional[Dict[str, Any]],
+                 lane: str = 'default') -> None:
 
         self.__context = context
         self.__tag = tag
         self.__class_instance = class_instance
         self.__function = function
         self.__args = args
+        self.__lane = lane
 
     ####################################################
     #  set_result
@@ -147,15 +156,183 @@ class FutureResult:
         if self.__context is None:
             self.__function(self.__class_instance, _result, self.__args)
         else:
-            self.__context.put_job(self.__tag, self.__class_instance, self.__function, args=(_result, self.__args))
+            # the async operation is done, its continuation must not be dropped by a full lane
+            self.__context.put_job(self.__tag, self.__class_instance, self.__function, args=(_result, self.__args), lane=self.__lane, may_reject=False)
+
+
+####################################################
+#
+#  LatencyHistogram
+#
+#  Log scale buckets (8 per power of 2, ~9% resolution) from
+#  LOWEST_SECONDS up to ~100 seconds.
+#  Counts are striped by thread id over NUM_STRIPES arrays, each with its
+#  own lock, so request threads rarely wait on each other and memory does
+#  not grow with the number of threads.
+#
+####################################################
+class LatencyHistogram:
+
+    LOWEST_SECONDS: float = 0.0001
+    BUCKETS_PER_OCTAVE: int = 8
+    NUM_BUCKETS: int = 8 * 20 + 1
+    NUM_STRIPES: int = 8
+
+    __stripes: List[List[Any]]   # [lock, counts, sum]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__stripes = [[threading.Lock(), [0] * LatencyHistogram.NUM_BUCKETS, 0.0]
+                          for _ in range(LatencyHistogram.NUM_STRIPES)]
+
+    ####################################################
+    #  bucket_index
+    ####################################################
+    @staticmethod
+    def bucket_index(seconds: float) -> int:
+
+        if seconds <= LatencyHistogram.LOWEST_SECONDS:
+            return 0
+
+        index = int(math.log2(seconds / LatencyHistogram.LOWEST_SECONDS) * LatencyHistogram.BUCKETS_PER_OCTAVE) + 1
+
+        return min(index, LatencyHistogram.NUM_BUCKETS - 1)
+
+    ####################################################
+    #  bucket_upper_bound
+    ####################################################
+    @staticmethod
+    def bucket_upper_bound(index: int) -> float:
+        return LatencyHistogram.LOWEST_SECONDS * 2 ** (index / LatencyHistogram.BUCKETS_PER_OCTAVE)
+
+    ####################################################
+    #  record
+    ####################################################
+    def record(self, seconds: float) -> None:
+
+        index = LatencyHistogram.bucket_index(seconds)
+
+        stripe = self.__stripes[threading.get_native_id() % LatencyHistogram.NUM_STRIPES]
+        with stripe[0]:
+            stripe[1][index] += 1
+            stripe[2] += seconds
+
+    ####################################################
+    #  snapshot
+    #  returns (bucket counts, sum of seconds)
+    ####################################################
+    def snapshot(self):  # -> List[int], float
+
+        counts = [0] * LatencyHistogram.NUM_BUCKETS
+        total = 0.0
+
+        for stripe in self.__stripes:
+            with stripe[0]:
+                counts = [a + b for a, b in zip(counts, stripe[1])]
+                total += stripe[2]
+
+        return counts, total
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[str, Any]:
+
+        counts, total = self.snapshot()
+
+        count = sum(counts)
+
+        stats: Dict[str, Any] = {'count': count,
+                                 'average': total / count if count > 0 else 0.0}
+
+        for percentile in percentiles:
+            stats['p{}'.format(percentile).replace('.', '')] = LatencyHistogram.percentile(counts, percentile)
+
+        return stats
+
+    ####################################################
+    #  percentile
+    #  upper bound of the bucket holding the percentile
+    ####################################################
+    @staticmethod
+    def percentile(counts: List[int], percentile: float) -> float:
+
+        count = sum(counts)
+        if count == 0:
+            return 0.0
+
+        rank = math.ceil(count * percentile / 100)
+
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return LatencyHistogram.bucket_upper_bound(index)
+
+        return LatencyHistogram.bucket_upper_bound(len(counts) - 1)
+
+
+####################################################
+#
+#  ExecutionTimerSlot
+#
+#  Timings reported during one slot of time. Count and sums are exact,
+#  the (wall, cpu) samples are a fixed size reservoir (algorithm R).
+#
+####################################################
+class ExecutionTimerSlot:
+    start_time: float
+    count: int
+    wall_sum: float
+    cpu_sum: float
+    samples: List[Any]  # (wall, cpu)
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, start_time: float):
+
+        self.start_time = start_time
+        self.count = 0
+        self.wall_sum = 0.0
+        self.cpu_sum = 0.0
+        self.samples = []
+
+    ####################################################
+    #  add
+    ####################################################
+    def add(self, wall_time: float, cpu_time: float, reservoir_size: int) -> None:
+
+        self.count += 1
+        self.wall_sum += wall_time
+        self.cpu_sum += cpu_time
+
+        if len(self.samples) < reservoir_size:
+            self.samples.append((wall_time, cpu_time))
+        else:
+            index = random.randrange(self.count)
+            if index < reservoir_size:
+                self.samples[index] = (wall_time, cpu_time)
 
 
 ####################################################
 #
 #  ExecutionTimerManager
 #
+#  Keeps the timings of the last hour in slots of SLOT_SECONDS, so the
+#  memory used per timer is bounded by the reservoir size.
+#
 ####################################################
 class ExecutionTimerManager(metaclass=Singleton):
+
+    SLOT_SECONDS = 10
+    RESERVOIR_SIZE = 64
+    WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}
+    PERCENTILES = (50, 90, 99)
+
     __lock: threading.Lock
     __timers: Dict[str, Dict[str, Any]]
 
@@ -170,16 +347,108 @@ class ExecutionTimerManager(metaclass=Singleton):
     ####################################################
     #  report_timer
     ####################################################
-    def report_timer(self, _name: str, _time: float):
+    def report_timer(self, _name: str, _wall_time: float, _cpu_time: float):
+
+        now = time.monotonic()
+        slot_start_time = now - now % ExecutionTimerManager.SLOT_SECONDS
 
         with self.__lock:
-            if _name in self.__timers.keys():
-                self.__timers[_name]['sum'] += _time
-                self.__timers[_name]['count'] += 1
-            else:
-                self.__timers[_name] = {}
-                self.__timers[_name]['sum'] = _time
-                self.__timers[_name]['count'] = 1
+            timer = self.__timers.get(_name)
+            if timer is None:
+                timer = self.__timers[_name] = {'count': 0, 'wall_sum': 0.0, 'cpu_sum': 0.0, 'slots': deque()}
+
+            timer['count'] += 1
+            timer['wall_sum'] += _wall_time
+            timer['cpu_sum'] += _cpu_time
+
+            slots = timer['slots']
+            if len(slots) == 0 or slots[-1].start_time != slot_start_time:
+                slots.append(ExecutionTimerSlot(slot_start_time))
+                self.__expire_slots(slots, now)
+
+            slots[-1].add(_wall_time, _cpu_time, ExecutionTimerManager.RESERVOIR_SIZE)
+
+    ####################################################
+    #  __expire_slots
+    ####################################################
+    @staticmethod
+    def __expire_slots(slots, now: float) -> None:
+
+        oldest_start_time = now - max(ExecutionTimerManager.WINDOWS.values()) - ExecutionTimerManager.SLOT_SECONDS
+        while len(slots) > 0 and slots[0].start_time < oldest_start_time:
+            slots.popleft()
+
+    ####################################################
+    #  __percentile
+    #  samples are (value, weight), sorted by value
+    ####################################################
+    @staticmethod
+    def __percentile(samples: List[Any], percentile: float) -> float:
+
+        if len(samples) == 0:
+            return 0.0
+
+        rank = sum(weight for _, weight in samples) * percentile / 100
+
+        cumulative = 0.0
+        for value, weight in samples:
+            cumulative += weight
+            if cumulative >= rank:
+                return value
+
+        return samples[-1][0]
+
+    ####################################################
+    #  __window_stats
+    ####################################################
+    @staticmethod
+    def __window_stats(slots: List[ExecutionTimerSlot]) -> Dict[str, Any]:
+
+        count = sum(slot.count for slot in slots)
+
+        stats: Dict[str, Any] = {'count': count}
+
+        for kind, kind_index, sum_name in (('wall', 0, 'wall_sum'), ('cpu', 1, 'cpu_sum')):
+
+            # each sample stands for count / len(samples) timings of its slot
+            samples = sorted((sample[kind_index], slot.count / len(slot.samples)) for slot in slots for sample in slot.samples)
+
+            kind_stats = {'average': sum(getattr(slot, sum_name) for slot in slots) / count if count > 0 else 0.0}
+            for percentile in ExecutionTimerManager.PERCENTILES:
+                kind_stats['p{}'.format(percentile)] = ExecutionTimerManager.__percentile(samples, percentile)
+
+            stats[kind] = kind_stats
+
+        return stats
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+
+        now = time.monotonic()
+
+        with self.__lock:
+            timers = {}
+            for _name, timer in self.__timers.items():
+                self.__expire_slots(timer['slots'], now)
+                timers[_name] = (timer['count'], timer['wall_sum'], timer['cpu_sum'], list(timer['slots']))
+
+        timers_stats = {}
+
+        for _name, (count, wall_sum, cpu_sum, slots) in timers.items():
+
+            timer_stats: Dict[str, Any] = {'count': count,
+                                           'wall_average': wall_sum / count,
+                                           'cpu_average': cpu_sum / count}
+
+            for window_name, window_seconds in ExecutionTimerManager.WINDOWS.items():
+                window_slots = [slot for slot in slots if slot.start_time > now - window_seconds - ExecutionTimerManager.SLOT_SECONDS]
+                timer_stats[window_name] = self.__window_stats(window_slots)
+
+            timers_stats[_name] = timer_stats
+
+        return timers_stats
 
     ####################################################
     #  get_averages
@@ -190,7 +459,7 @@ class ExecutionTimerManager(metaclass=Singleton):
 
         with self.__lock:
             for _name in self.__timers.keys():
-                timers_averages[_name] = self.__timers[_name]['sum'] / self.__timers[_name]['count']
+                timers_averages[_name] = self.__timers[_name]['cpu_sum'] / self.__timers[_name]['count']
 
         return timers_averages
 
@@ -207,25 +476,26 @@ class ExecutionTimer():
     ####################################################
     def __init__(self, name: str):
         self.__name = name
-        self.__start = None
+        self.__start_wall_time = None
+        self.__start_cpu_time = None
 
     ####################################################
     #  __enter__
     ####################################################
     def __enter__(self):
-        import time
-        self.__start = time.process_time()
+        self.__start_wall_time = time.monotonic()
+        self.__start_cpu_time = time.thread_time()
 
     ####################################################
     #  __exit__
     ####################################################
     def __exit__(self, *args):
-        import time
 
-        time_diff = time.process_time() - self.__start
+        cpu_time_diff = time.thread_time() - self.__start_cpu_time
+        wall_time_diff = time.monotonic() - self.__start_wall_time
 
-        ExecutionTimerManager().report_timer(self.__name, time_diff)
-        # Utils.logger_.debug_color('ExecutionTimer', "timer {}: execution time: {}".format(self.__name, time_diff))
+        ExecutionTimerManager().report_timer(self.__name, wall_time_diff, cpu_time_diff)
+        # Utils.logger_.debug_color('ExecutionTimer', "timer {}: execution time: {}".format(self.__name, wall_time_diff))
 
 
 ####################################################
@@ -353,6 +623,9 @@ class EosManifest:
     url: EosUrl
     manifest_params: Dict[str, str]
     fragments: List[EosFragment]
+    fragments_by_url: Dict[str, EosFragment]             # fragment.url.base64_urlsafe -> fragment
+    fragments_by_media_sequence: Dict[int, EosFragment]  # fragment.media_sequence -> fragment (HLS)
+    fragments_duration: float
     eos: bool
 
     ####################################################
@@ -365,9 +638,58 @@ class EosManifest:
         self.manifest_params = {}
 
         self.fragments = []
+        self.fragments_by_url = {}
+        self.fragments_by_media_sequence = {}
+        self.fragments_duration = 0.0
 
         self.eos = False
 
+    ####################################################
+    #  add_fragment
+    #  returns False if the fragment is already in the manifest
+    ####################################################
+    def add_fragment(self, fragment: EosFragment) -> bool:
+
+        if fragment.url.base64_urlsafe in self.fragments_by_url:
+            return False
+
+        self.fragments.append(fragment)
+        self.fragments_by_url[fragment.url.base64_urlsafe] = fragment
+        self.fragments_by_media_sequence.setdefault(fragment.media_sequence, fragment)
+        self.fragments_duration += fragment.duration
+
+        return True
+
+    ####################################################
+    #  trim
+    #  removes the oldest fragments which are out of the retention time,
+    #  returns the number of removed fragments
+    ####################################################
+    def trim(self, retention_seconds: float) -> int:
+
+        removed = 0
+        while removed < len(self.fragments) - 1 and self.fragments_duration - self.fragments[removed].duration >= retention_seconds:
+            fragment = self.fragments[removed]
+            self.fragments_duration -= fragment.duration
+
+            if self.fragments_by_url.get(fragment.url.base64_urlsafe) is fragment:
+                del self.fragments_by_url[fragment.url.base64_urlsafe]
+            if self.fragments_by_media_sequence.get(fragment.media_sequence) is fragment:
+                del self.fragments_by_media_sequence[fragment.media_sequence]
+
+            removed += 1
+
+        if removed > 0:
+            del self.fragments[:removed]
+
+        return removed
+
+    ####################################################
+    #  find_fragment
+    ####################################################
+    def find_fragment(self, fragment_base64_url: str) -> Optional[EosFragment]:
+        return self.fragments_by_url.get(fragment_base64_url)
+
     ####################################################
     #  __repr__
     ####################################################
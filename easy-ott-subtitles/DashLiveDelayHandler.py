@@ -1,9 +1,11 @@
 import base64
 import time
 import threading
+import itertools
+from collections import deque
 from datetime import datetime, timedelta
 import xml.etree.ElementTree as ET
-from typing import List, Tuple, Dict, Optional, Any
+from typing import List, Tuple, Dict, Optional, Any, Deque, Iterator
 
 import mpegdash.parser
 import isodate
@@ -13,6 +15,10 @@ from CommonTypes import EosNames, EosHttpConfig, EosFragment, EosUrl, LiveDelayL
 from Languages import EosLanguage
 from DashUtils import DashInitDecoder
 from RequestWrapper import RequestWrapper
+from Metrics import MetricsRegistry
+
+# metrics
+METRIC__LIVE_POLLERS = MetricsRegistry().gauge('eos_live_pollers', 'Running live origin manifest pollers', ('protocol',))
 
 
 ####################################################
@@ -21,13 +27,18 @@ from RequestWrapper import RequestWrapper
 class DashLiveDelayStream:
     time_in_current_manifest: float
     current_time: float
-    fragments: List[EosFragment]
+    fragments: Deque[EosFragment]
     time_in_fragments: float
     max_timestamp: int
     time_scale: float
     media: str
     presentation_time_offset: int
     audio_sampling_rate: int
+    delay_count: int        # number of newest fragments held back by the delay
+    delay_ticks: int        # duration (in time_scale units) of the newest fragments held back by the delay
+    head_count: int         # number of oldest fragments before the delayed window
+    head_ticks: int         # duration (in time_scale units) of the oldest fragments before the delayed window
+    total_ticks: int        # duration (in time_scale units) of all the fragments
 
     ####################################################
     #  __init__
@@ -36,12 +47,96 @@ class DashLiveDelayStream:
         self.max_timestamp = -1
         self.time_in_current_manifest = 0
         self.current_time = 0
-        self.fragments = []
+        self.fragments = deque()
         self.time_in_fragments = 0
         self.time_scale = 1
         self.media = ''
         self.presentation_time_offset = 0
         self.audio_sampling_rate = 0
+        self.delay_count = 0
+        self.delay_ticks = 0
+        self.head_count = 0
+        self.head_ticks = 0
+        self.total_ticks = 0
+
+    ####################################################
+    #  __ticks
+    #  window sums are kept in time_scale units so they don't drift on long running streams
+    ####################################################
+    def __ticks(self, fragment: EosFragment) -> int:
+        return int(round(fragment.duration * self.time_scale))
+
+    ####################################################
+    #  add_fragment
+    ####################################################
+    def add_fragment(self, fragment: EosFragment, delay_seconds: float) -> None:
+
+        self.fragments.append(fragment)
+        self.total_ticks += self.__ticks(fragment)
+        self.time_in_fragments = self.total_ticks / self.time_scale
+
+        # keep the smallest tail of fragments which covers the delay
+        delay_ticks = delay_seconds * self.time_scale
+        self.delay_count += 1
+        self.delay_ticks += self.__ticks(fragment)
+        while self.delay_count > 1 and self.delay_ticks - self.__ticks(self.fragments[-self.delay_count]) >= delay_ticks:
+            self.delay_ticks -= self.__ticks(self.fragments[-self.delay_count])
+            self.delay_count -= 1
+
+    ####################################################
+    #  delayed_window
+    #  returns (start_index, end_index) of the delayed window, end_index is -1 if there is no window yet
+    ####################################################
+    def delayed_window(self, delay_seconds: float) -> Tuple[int, int]:
+
+        if self.time_in_fragments < delay_seconds + self.time_in_current_manifest:
+            return 0, -1
+
+        manifest_ticks = self.time_in_current_manifest * self.time_scale
+
+        # move the head of the window, it only moves by the fragments added or removed since the last call
+        while self.head_count < len(self.fragments) and self.total_ticks - self.head_ticks - self.delay_ticks > manifest_ticks:
+            self.head_ticks += self.__ticks(self.fragments[self.head_count])
+            self.head_count += 1
+
+        while self.head_count > 0 and self.total_ticks - self.head_ticks + self.__ticks(self.fragments[self.head_count - 1]) - self.delay_ticks <= manifest_ticks:
+            self.head_count -= 1
+            self.head_ticks -= self.__ticks(self.fragments[self.head_count])
+
+        return self.head_count, len(self.fragments) - 1 - self.delay_count
+
+    ####################################################
+    #  window_fragments
+    #  returns the fragments of the delayed window
+    ####################################################
+    def window_fragments(self, start_index: int, end_index: int) -> Iterator[EosFragment]:
+
+        # the window starts one fragment before start_index
+        start, stop, step = slice(start_index - 1, end_index).indices(len(self.fragments))
+        if start >= stop:
+            return iter(())
+
+        return itertools.islice(self.fragments, start, stop)
+
+    ####################################################
+    #  trim
+    #  removes old fragments which are out of the retention time and not used by the delayed window
+    ####################################################
+    def trim(self, retention_seconds: float) -> int:
+
+        retention_ticks = retention_seconds * self.time_scale
+
+        removed = 0
+        while self.head_count > 1 and self.total_ticks - self.__ticks(self.fragments[0]) >= retention_ticks:
+            fragment_ticks = self.__ticks(self.fragments.popleft())
+            self.total_ticks -= fragment_ticks
+            self.head_ticks -= fragment_ticks
+            self.head_count -= 1
+            removed += 1
+
+        self.time_in_fragments = self.total_ticks / self.time_scale
+
+        return removed
 
 
 ####################################################
@@ -53,12 +148,14 @@ class DashLiveDelayHandler(threading.Thread):
     __session_id: str
     __live_origin_manifest_url: str
     __delay_seconds: float
+    __time_shift_buffer_depth_seconds: float
     __first_manifest_read: bool
     __mpd_buffer_time_set: bool
     __reference_adaptation_set_id: Optional[str]
     __streams: Dict[Any, DashLiveDelayStream]  # (content_type, adaptation_set_id) -> DashLiveDelayStream
     __eos_streams: List[int]  # adaptation_set_id
     __listeners: List[Tuple[LiveDelayListener, str]]   # (LiveDelayListener, param)
+    __snapshot: Tuple[bytes, Tuple[EosFragment, ...]]   # (serialized delayed mpd, delayed fragments), replaced by the poller
     __mpd: Optional[mpegdash.nodes.MPEGDASH]
     __base_urls: List[str]
     __lock: threading.RLock
@@ -77,9 +174,12 @@ class DashLiveDelayHandler(threading.Thread):
 
         Utils.logger_.info(self.__session_id, "DashLiveDelayHandler::__init__ live_origin_manifest_url={}".format(self.__live_origin_manifest_url))
 
-        self.__request_wrapper = RequestWrapper(self.__session_id, 'DashLiveDelayHandler ' + self.__live_origin_manifest_url)
+        self.__request_wrapper = RequestWrapper(self.__session_id, 'DashLiveDelayHandler ' + self.__live_origin_manifest_url, 'DashLiveDelayHandler manifest')
+        # a failing origin keeps the last manifest, the delayed window stops moving until it recovers
+        self.__request_wrapper.fall_back_to_last_good_response()
 
         self.__delay_seconds = delay_seconds
+        self.__time_shift_buffer_depth_seconds = 0
 
         self.__first_manifest_read = True
         self.__mpd_buffer_time_set = False
@@ -91,6 +191,8 @@ class DashLiveDelayHandler(threading.Thread):
 
         self.__listeners = []
 
+        self.__snapshot = (b'', ())
+
         self.__mpd = None
 
         self.__base_urls = []
@@ -189,6 +291,8 @@ class DashLiveDelayHandler(threading.Thread):
 
         Utils.logger_.system('DashLiveDelayHandler', "DashLiveDelayHandler::run thread started name={}".format(self.getName()))
 
+        METRIC__LIVE_POLLERS.labels('dash').inc()
+
         while True:
 
             original_manifest = None
@@ -202,6 +306,8 @@ class DashLiveDelayHandler(threading.Thread):
 
             # print(original_manifest)
 
+            new_fragments_found = False
+
             self.__lock.acquire()
 
             mpd = mpegdash.parser.MPEGDASHParser.parse(original_manifest)
@@ -209,6 +315,10 @@ class DashLiveDelayHandler(threading.Thread):
             if self.__mpd is None:
                 self.__mpd = mpd
 
+                # keep the origin time shift buffer depth, the delayed mpd adds the delay to it
+                if mpd.time_shift_buffer_depth is not None:
+                    self.__time_shift_buffer_depth_seconds = isodate.parse_duration(mpd.time_shift_buffer_depth).total_seconds()
+
             if mpd.base_urls is not None:
                 self.__base_urls.append(mpd.base_urls[0].base_url_value)
                 mpd.base_urls = None
@@ -291,7 +401,7 @@ class DashLiveDelayHandler(threading.Thread):
                 self.__streams[stream_key].media = segment_template.media
 
                 if self.__first_manifest_read is True:
-                    Utils.logger_.debug('DashLiveDelayHandler', "DashLiveDelayHandler::run adaptation_set_id={}, content_type={}, time_scale={}, media={}".format(adaptation_set_id, content_type, self.__streams[stream_key].time_scale, self.__streams[stream_key].media))
+                    Utils.logger_.debug('DashLiveDelayHandler', "DashLiveDelayHandler::run adaptation_set_id={}, content_type={}, time_scale={}, media={}", adaptation_set_id, content_type, self.__streams[stream_key].time_scale, self.__streams[stream_key].media)
 
                 segment_time_line = segment_template.segment_timelines[0]
 
@@ -332,13 +442,14 @@ class DashLiveDelayHandler(threading.Thread):
                             #if line_index == len(lines):
                             #    new_fragment.first_read = False
 
-                            self.__streams[stream_key].fragments.append(new_fragment)
-                            self.__streams[stream_key].time_in_fragments += (duration / self.__streams[stream_key].time_scale)
+                            self.__streams[stream_key].add_fragment(new_fragment, self.__delay_seconds)
                             self.__streams[stream_key].max_timestamp = current_timestamp
                             self.__streams[stream_key].current_time += (duration / self.__streams[stream_key].time_scale)
                             if self.__streams[stream_key].presentation_time_offset == 0:
                                 self.__streams[stream_key].presentation_time_offset = new_fragment.timestamp / self.__streams[stream_key].time_scale
 
+                            new_fragments_found = True
+
                             if content_type == "audio" and self.__reference_adaptation_set_id is not None and self.__reference_adaptation_set_id == adaptation_set_id:
                                 self.__notify_listeners(new_fragment)
 
@@ -355,22 +466,36 @@ class DashLiveDelayHandler(threading.Thread):
                 # Utils.logger_.debug_color(self.__session_id, "DashLiveDelayHandler::run media_sequence={}".format(self.__base_media_sequence))
                 self.__first_manifest_read = False
 
+            # the delayed mpd only changes when new fragments arrive,
+            # so build and serialize it here once per tick instead of on every player request
+            if new_fragments_found is True:
+                self.__snapshot = self.__render_delayed_manifest()
+
             self.__lock.release()
 
             self.__ready.set()
 
             time.sleep(1)
 
+        METRIC__LIVE_POLLERS.labels('dash').dec()
+
         Utils.logger_.system('DashLiveDelayHandler', "DashLiveDelayHandler::run thread ending name={}".format(self.getName()))
 
     ####################################################
     #  delay
+    #  returns the last snapshot rendered by the poller
     ####################################################
-    def delay(self) -> Tuple[str, List[EosFragment]]:
+    def delay(self) -> Tuple[bytes, Tuple[EosFragment, ...]]:
 
-        fragment_list: List[EosFragment] = []
+        return self.__snapshot
 
-        self.__lock.acquire()
+    ####################################################
+    #  __render_delayed_manifest
+    #  called from the poller with the lock taken
+    ####################################################
+    def __render_delayed_manifest(self) -> Tuple[bytes, Tuple[EosFragment, ...]]:
+
+        fragment_list: List[EosFragment] = []
 
         #copy_segment_time_line = None
         reference_timescale = 0
@@ -381,43 +506,7 @@ class DashLiveDelayHandler(threading.Thread):
 
             #print("++++++++++++++++++++++ stream: ", stream)
 
-            start_index = 0
-            end_index = -1
-
-            #print("++++++++++++++++++++++ self.__streams[stream].time_in_fragments: ", self.__streams[stream].time_in_fragments)
-            #print("++++++++++++++++++++++ self.__delay_seconds: ", self.__delay_seconds)
-            #print("++++++++++++++++++++++ self.__streams[stream].time_in_current_manifest: ", self.__streams[stream].time_in_current_manifest)
-
-            if self.__streams[stream].time_in_fragments >= self.__delay_seconds + self.__streams[stream].time_in_current_manifest:
-
-                # create delay
-                end_index = len(self.__streams[stream].fragments) - 1
-
-                delay_time = 0
-                for fragment in reversed(self.__streams[stream].fragments):
-
-                    delay_time += fragment.duration
-                    end_index -= 1
-
-                    if delay_time >= self.__delay_seconds:
-                        break
-
-                # remove fragment from head
-                time_in_fragment = self.__streams[stream].time_in_fragments
-
-                for fragment in self.__streams[stream].fragments:
-
-                    if time_in_fragment - delay_time > self.__streams[stream].time_in_current_manifest:
-
-                        time_in_fragment -= fragment.duration
-                        start_index += 1
-
-                    else:
-                        break
-
-                #for i in range(start_index):
-                #    self.__fragments.pop(0)
-                #    self.__time_in_fragments -= fragment.duration
+            start_index, end_index = self.__streams[stream].delayed_window(self.__delay_seconds)
 
             #print("******************** start_index={}, end_index={}".format(start_index, end_index))
 
@@ -448,7 +537,7 @@ class DashLiveDelayHandler(threading.Thread):
                         first = True
                         last_s = None
                         next_timestamp = 0
-                        for fragment in self.__streams[stream].fragments[start_index - 1:end_index]:
+                        for fragment in self.__streams[stream].window_fragments(start_index, end_index):
 
                             #print("&&&&&&&&&&&&&&&&&&&& fragment={}".format(fragment))
 
@@ -494,6 +583,12 @@ class DashLiveDelayHandler(threading.Thread):
 
                     #print("******************** 2 segment_time_line={}".format(segment_time_line))
 
+            # listeners already got every fragment, keep only what the delay and the time shift buffer need
+            retention_seconds = self.__delay_seconds + max(self.__time_shift_buffer_depth_seconds, 2 * self.__streams[stream].time_in_current_manifest)
+            removed = self.__streams[stream].trim(retention_seconds)
+            if removed > 0:
+                Utils.logger_.debug('DashLiveDelayHandler', "DashLiveDelayHandler::__render_delayed_manifest stream={} removed {} fragments, fragments={}", stream, removed, len(self.__streams[stream].fragments))
+
         for eos_stream in self.__eos_streams:
             eos_period = self.__mpd.periods[0]
             for eos_adaptation_set in eos_period.adaptation_sets:
@@ -544,20 +639,18 @@ class DashLiveDelayHandler(threading.Thread):
 
             self.__mpd_buffer_time_set = True
 
-        manifest = mpegdash.parser.MPEGDASHParser.get_as_doc(self.__mpd).toxml()
+        manifest = mpegdash.parser.MPEGDASHParser.get_as_doc(self.__mpd).toxml(encoding='utf-8')
 
         #print("manifest=", manifest)
 
-        self.__lock.release()
-
-        return manifest, fragment_list
+        return manifest, tuple(fragment_list)
 
     ####################################################
     #  _read_audio_init
     ####################################################
     def _read_audio_init(self, audio_init_url: str) -> int:
 
-        audio_init_request_wrapper = RequestWrapper(self.__session_id, 'DashLiveDelayHandler ' + audio_init_url)
+        audio_init_request_wrapper = RequestWrapper(self.__session_id, 'DashLiveDelayHandler ' + audio_init_url, 'DashLiveDelayHandler init')
 
         audio_init = None
         response = audio_init_request_wrapper.get(audio_init_url)
@@ -1,26 +1,79 @@
 import requests
 from io import BufferedReader, BytesIO
 from collections import deque
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Union
 import binascii
+import struct
 import ctypes
 
 from Crypto.Cipher import AES
 from Crypto.Util import Counter
-from construct import Container
 from pymp4.parser import Box
 from pymp4.util import BoxUtil
 
 import Utils as Utils
 
 
+####################################################
+#  _box
+####################################################
+def _box(box_type: bytes, *payloads: bytes) -> bytes:
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+####################################################
+#  _full_box
+####################################################
+def _full_box(box_type: bytes, version: int, flags: int, *payloads: bytes) -> bytes:
+    return _box(box_type, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+####################################################
+#  _pack_language
+#  ISO-639-2/T code as the 3 x 5 bits of mdhd
+####################################################
+def _pack_language(language: str) -> int:
+
+    if len(language) != 3 or language.isalpha() is False or language.islower() is False:
+        language = 'und'
+
+    return ((ord(language[0]) - 0x60) << 10) | ((ord(language[1]) - 0x60) << 5) | (ord(language[2]) - 0x60)
+
+
 ####################################################
 #
 #  DashFragmentEncoder
 #
+#  Fragments are built from a precompiled moof + mdat header template with
+#  only baseMediaDecodeTime and the sizes patched in, init segments are
+#  built once per (timescale, language).
+#
 ####################################################
 class DashFragmentEncoder:
 
+    __SAMPLE_DURATION = 4000
+
+    # mfhd, traf(tfhd, tfdt, trun) with one sample, mdat header
+    __FRAGMENT_TEMPLATE = _box(b'moof',
+                               _full_box(b'mfhd', 0, 0, struct.pack('>I', 1)),
+                               _box(b'traf',
+                                    # default_base_is_moof | default_sample_size | default_sample_duration | sample_description_index
+                                    _full_box(b'tfhd', 0, 0x02001a, struct.pack('>IIII', 1, 1, __SAMPLE_DURATION, 0)),
+                                    _full_box(b'tfdt', 1, 0, struct.pack('>Q', 0)),
+                                    # composition_time_offsets | flags | size | duration | data_offset
+                                    _full_box(b'trun', 1, 0x000f01, struct.pack('>IiIIIi', 1, 0, __SAMPLE_DURATION, 0, 0, 0)))) \
+        + struct.pack('>I4s', 8, b'mdat')
+
+    __TFHD_DEFAULT_SAMPLE_SIZE_OFFSET = 56
+    __TFDT_BASE_MEDIA_DECODE_TIME_OFFSET = 72
+    __TRUN_DATA_OFFSET_OFFSET = 96
+    __TRUN_SAMPLE_SIZE_OFFSET = 104
+    __MDAT_SIZE_OFFSET = 116
+
+    # (timescale, language) -> init segment, racing builders produce the same bytes
+    __init_segments: Dict[Tuple[int, str], bytes] = {}
+
     ####################################################
     #  __init__
     ####################################################
@@ -28,93 +81,91 @@ class DashFragmentEncoder:
         pass
 
     ####################################################
-    #  build_subtitles_initialization
+    #  build_subtitles_fragment
     ####################################################
-    def build_subtitles_fragment(self, timescale_val: int, start_time: int, end_time: int, subtitle_ttml: str) -> bytes:
+    def build_subtitles_fragment(self, timescale_val: int, start_time: int, end_time: int, subtitle_ttml: bytes) -> bytes:
+
+        sample_size = len(subtitle_ttml)
 
-        subtitle_ttml_encoded = subtitle_ttml.encode('utf-8')
+        header = bytearray(self.__FRAGMENT_TEMPLATE)
+        struct.pack_into('>I', header, self.__TFHD_DEFAULT_SAMPLE_SIZE_OFFSET, sample_size)
+        struct.pack_into('>Q', header, self.__TFDT_BASE_MEDIA_DECODE_TIME_OFFSET, start_time)
+        struct.pack_into('>i', header, self.__TRUN_DATA_OFFSET_OFFSET, len(header))
+        struct.pack_into('>I', header, self.__TRUN_SAMPLE_SIZE_OFFSET, sample_size)
+        struct.pack_into('>I', header, self.__MDAT_SIZE_OFFSET, 8 + sample_size)
 
-        moof = \
-            Container(type=b"moof")(children=[
-                Container(type=b"mfhd")(sequence_number=1),
-                Container(type=b"traf")(children=[
-                    Container(type=b"tfhd")(version=0)
-                    (flags=Container(default_base_is_moof=True)(duration_is_empty=False)
-                    (default_sample_flags_present=False)(default_sample_size_present=True)
-                    (default_sample_duration_present=True)(sample_description_index_present=True)(base_data_offset_present=False))
-                    (track_ID=1)(sample_description_index=1)(default_sample_size=len(subtitle_ttml_encoded))
-                    (default_sample_duration=4000)(base_data_offset=0)(default_sample_flags=None),
-                    Container(type=b"tfdt")(version=1)(baseMediaDecodeTime=start_time),
-                    Container(type=b"trun")(version=1)(flags=Container(sample_composition_time_offsets_present=True)
-                    (sample_flags_present=True)(sample_size_present=True)(sample_duration_present=True)
-                    (first_sample_flags_present=False)(data_offset_present=True))
-                    (sample_count=1)(data_offset=124)(first_sample_flags=None)
-                    (sample_info=[Container(sample_duration=4000)(sample_size=len(subtitle_ttml_encoded))
-                    (sample_flags=Container(is_leading=0)(sample_depends_on=0)(sample_is_depended_on=0)
-                    (sample_has_redundancy=0)(sample_padding_value=0)(sample_is_non_sync_sample=False)(sample_degradation_priority=0))
-                    (sample_composition_time_offsets=0)])
-                ])
-            ])
+        return b''.join((header, subtitle_ttml))
 
-        mdat = Container(type=b"mdat")(data=subtitle_ttml_encoded)
+    ####################################################
+    #  build_subtitles_initialization
+    #  language: ISO-639-2/T code of the mdhd
+    ####################################################
+    def build_subtitles_initialization(self, timescale_val: int, language: str = 'und') -> bytes:
 
-        moof_data = Box.build(moof)
-        mdat_data = Box.build(mdat)
+        init_segment = self.__init_segments.get((timescale_val, language))
+        if init_segment is None:
+            init_segment = self.__build_subtitles_initialization(timescale_val, language)
+            self.__init_segments[(timescale_val, language)] = init_segment
 
-        return moof_data + mdat_data
+        return init_segment
 
     ####################################################
-    #  build_subtitles_initialization
+    #  __build_subtitles_initialization
     ####################################################
-    def build_subtitles_initialization(self, timescale_val: int) -> bytes:
+    @staticmethod
+    def __build_subtitles_initialization(timescale_val: int, language: str) -> bytes:
 
-        ftyp = Box.build(dict(type=b"ftyp",
-                              major_brand=b"iso6",
-                              minor_version=0,
-                              compatible_brands=[b"iso6", b"dash"]))
+        matrix = struct.pack('>9i', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+        ftyp = _box(b'ftyp', b'iso6', struct.pack('>I', 0), b'iso6', b'dash')
 
         moov = \
-            Container(type=b"moov")(children=[
-                Container(type=b"mvhd")(version=0)(flags=0)(duration=0)(next_track_ID=2)(timescale=timescale_val),
-                Container(type=b"mvex")(children=[
-                    Container(type=b"mehd")(version=0)(flags=0)(fragment_duration=0),
-                    Container(type=b"trex")(track_ID=1)
-                ]),
-                Container(type=b"trak")(children=[
-                    Container(type=b"tkhd")(flags=3),
-                    Container(type=b"mdia")(children=[
-                        Container(type=b"mdhd")(creation_time=0)(modification_time=0)(timescale=timescale_val)(duration=0)(language='deu'),
-                        Container(type=b"hdlr")(handler_type=b"subt")(name=b"Subtitle"),
-                        Container(type=b"minf")(children=[
-                            Container(type=b"dinf")(children=[
-                                Container(type=b"dref")(data_entries=[Container(type=b'url ')(version=0)(flags=Container(self_contained=True))(location=None)])
-                            ]),
-                            Container(type=b"stbl")(children=[
-                                Container(type=b"stsd")(version=1)(entries=[Container(format=b'stpp')(data_reference_index=1)(data=b'xmlns\x00\x00\x00')]),
-                                Container(type=b"stts")(entries=[]),
-                                Container(type=b"stsc")(entries=[]),
-                                Container(type=b"stsz")(version=0)(sample_size=0)(sample_count=0)(entry_sizes=[]),
-                                Container(type=b"stco")(entries=[]),
-                            ]),
-                            Container(type=b"sthd")(data=b'\x00\x00\x00\x00')
-                        ])
-                    ])
-                ])
-            ])
-
-        moov_data = Box.build(moov)
-
-        return ftyp + moov_data
+            _box(b'moov',
+                 # creation_time, modification_time, timescale, duration, rate, volume, reserved, matrix, pre_defined, next_track_ID
+                 _full_box(b'mvhd', 0, 0, struct.pack('>IIIIiH10x', 0, 0, timescale_val, 0, 0x00010000, 0x0100), matrix, struct.pack('>24xI', 2)),
+                 _box(b'mvex',
+                      _full_box(b'mehd', 0, 0, struct.pack('>I', 0)),
+                      _full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0))),
+                 _box(b'trak',
+                      # track_enabled | track_in_movie; creation_time, modification_time, track_ID, duration, layer, alternate_group, volume
+                      _full_box(b'tkhd', 0, 3, struct.pack('>III4xI8xhhh2x', 0, 0, 1, 0, 0, 0, 0), matrix, struct.pack('>II', 0, 0)),
+                      _box(b'mdia',
+                           _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale_val, 0, _pack_language(language), 0)),
+                           _full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'subt'), b'Subtitle\x00'),
+                           _box(b'minf',
+                                _box(b'dinf',
+                                     _full_box(b'dref', 0, 0, struct.pack('>I', 1),
+                                               # self_contained
+                                               _full_box(b'url ', 0, 1))),
+                                _box(b'stbl',
+                                     _full_box(b'stsd', 1, 0, struct.pack('>I', 1),
+                                               _box(b'stpp', struct.pack('>6xH', 1), b'xmlns\x00\x00\x00')),
+                                     _full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+                                     _full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+                                     _full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+                                     _full_box(b'stco', 0, 0, struct.pack('>I', 0))),
+                                _box(b'sthd', struct.pack('>I', 0))))))
+
+        return ftyp + moov
 
 
 ####################################################
 #
 #  DashFragmentParser
 #
+#  Works on the box headers only: the ttml is sliced out of the mdat and
+#  update_ttml patches the sample size fields of tfhd / trun in a copy of
+#  the moof, so the moof is never parsed nor rebuilt.
+#
 ####################################################
 class DashFragmentParser:
 
     __fragment: bytes
+    __moof_offset: int
+    __moof_end: int
+    __mdat_offset: int
+    __mdat_header_size: int
+    __mdat_end: int
 
     ####################################################
     #  __init__
@@ -122,49 +173,131 @@ class DashFragmentParser:
     def __init__(self, fragment: bytes):
 
         self.__fragment = fragment
-        self.__moof_box = None
+        self.__moof_offset = -1
+        self.__moof_end = -1
+        self.__mdat_offset = -1
+        self.__mdat_header_size = 0
+        self.__mdat_end = -1
+
+        self.__locate_boxes()
 
     ####################################################
-    #  read_ttml
+    #  __read_box_header
+    #  returns (type, header size, box end)
     ####################################################
-    def read_ttml(self) -> bytes:
+    @staticmethod
+    def __read_box_header(data: Union[bytes, bytearray], offset: int, end: int) -> Tuple[bytes, int, int]:
 
-        #box = Box.parse(self.__fragment)
-        #print(box)
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
 
-        with BufferedReader(BytesIO(self.__fragment)) as reader:
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
 
-            while reader.peek(1):
-                box = Box.parse_stream(reader)
-                # print(box)
+        if size < header_size or offset + size > end:
+            raise ValueError('invalid {} box size {} at offset {}'.format(box_type, size, offset))
+
+        return box_type, header_size, offset + size
+
+    ####################################################
+    #  __locate_boxes
+    #  first moof and the mdat following it
+    ####################################################
+    def __locate_boxes(self) -> None:
 
-                if box.type == b'moof':
-                    self.__moof_box = box
+        fragment = self.__fragment
+        end = len(fragment)
+
+        offset = 0
+        while offset + 8 <= end:
+            box_type, header_size, box_end = self.__read_box_header(fragment, offset, end)
+
+            if box_type == b'moof' and self.__moof_offset < 0:
+                self.__moof_offset = offset
+                self.__moof_end = box_end
+
+            if box_type == b'mdat':
+                self.__mdat_offset = offset
+                self.__mdat_header_size = header_size
+                self.__mdat_end = box_end
+                return
+
+            offset = box_end
+
+    ####################################################
+    #  __patch_sample_size
+    #  sets the sample sizes of every tfhd / trun under the moof to sample_size
+    ####################################################
+    def __patch_sample_size(self, moof: bytearray, sample_size: int) -> None:
+
+        moof_type, moof_header_size, moof_end = self.__read_box_header(moof, 0, len(moof))
+
+        offset = moof_header_size
+        while offset + 8 <= moof_end:
+            box_type, header_size, box_end = self.__read_box_header(moof, offset, moof_end)
+
+            if box_type == b'traf':
+                child_offset = offset + header_size
+                while child_offset + 8 <= box_end:
+                    child_type, child_header_size, child_end = self.__read_box_header(moof, child_offset, box_end)
+                    full_box_offset = child_offset + child_header_size
+                    flags = struct.unpack_from('>I', moof, full_box_offset)[0] & 0xFFFFFF
+
+                    if child_type == b'tfhd' and flags & 0x10:
+                        # version/flags, track_ID, [base_data_offset], [sample_description_index], [default_sample_duration]
+                        field_offset = full_box_offset + 8
+                        field_offset += 8 if flags & 0x01 else 0
+                        field_offset += 4 if flags & 0x02 else 0
+                        field_offset += 4 if flags & 0x08 else 0
+                        struct.pack_into('>I', moof, field_offset, sample_size)
+
+                    if child_type == b'trun' and flags & 0x200:
+                        # version/flags, sample_count, [data_offset], [first_sample_flags], samples
+                        sample_count = struct.unpack_from('>I', moof, full_box_offset + 4)[0]
+                        field_offset = full_box_offset + 8
+                        field_offset += 4 if flags & 0x01 else 0
+                        field_offset += 4 if flags & 0x04 else 0
+                        field_offset += 4 if flags & 0x100 else 0
+                        sample_info_size = 4 * bin(flags & 0xF00).count('1')
+                        for sample_index in range(sample_count):
+                            struct.pack_into('>I', moof, field_offset + sample_index * sample_info_size, sample_size)
+
+                    child_offset = child_end
+
+            offset = box_end
+
+    ####################################################
+    #  read_ttml
+    ####################################################
+    def read_ttml(self) -> bytes:
 
-                if box.type == b'mdat':
-                    # print(box.data)
-                    return box.data
+        if self.__mdat_offset < 0:
+            return b''
 
-        return b''
+        return self.__fragment[self.__mdat_offset + self.__mdat_header_size:self.__mdat_end]
 
     ####################################################
     #  update_ttml
+    #  moof + mdat with ttml as the only sample
     ####################################################
     def update_ttml(self, ttml: bytes) -> bytes:
 
-        for traf in BoxUtil.find(self.__moof_box, b'traf'):
-            for tfhd in BoxUtil.find(traf, b'tfhd'):
-                tfhd.default_sample_size = len(ttml)
-            for trun in BoxUtil.find(traf, b'trun'):
-                for sample_info in trun.sample_info:
-                    sample_info.sample_size = len(ttml)
+        if self.__moof_offset < 0 or self.__mdat_offset < 0:
+            raise ValueError('fragment has no moof / mdat')
 
-        mdat = Container(type=b"mdat")(data=ttml)
+        moof = bytearray(self.__fragment[self.__moof_offset:self.__moof_end])
+        self.__patch_sample_size(moof, len(ttml))
 
-        moof_data = Box.build(self.__moof_box)
-        mdat_data = Box.build(mdat)
+        # same header size, so trun data_offset stays valid
+        if self.__mdat_header_size == 16:
+            mdat_header = struct.pack('>I4sQ', 1, b'mdat', 16 + len(ttml))
+        else:
+            mdat_header = struct.pack('>I4s', 8 + len(ttml), b'mdat')
 
-        return moof_data + mdat_data
+        return b''.join((moof, mdat_header, ttml))
 
 
 ####################################################
@@ -65,13 +65,13 @@ class EosSessionRequest:
         self.__parsed_path = urlparse(self.__path)
         self.__parsed_query = parse_qs(self.__parsed_path.query)
 
-        Utils.logger_.info("EosSessionRequest", "EosSessionRequest::__init__ path={}".format(self.__parsed_path.path))
+        Utils.logger_.info("EosSessionRequest", "EosSessionRequest::__init__ path={}", self.__parsed_path.path)
 
         self.__tokens = self.__parsed_path.path.split("/")
 
         i = 0
         for token in self.__tokens:
-            Utils.logger_.dump("EosSessionRequest", 'Token {}: {}'.format(i, token))
+            Utils.logger_.dump("EosSessionRequest", 'Token {}: {}', i, token)
             i += 1
 
         self.__valid = False
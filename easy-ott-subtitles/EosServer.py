@@ -1,11 +1,27 @@
 import threading
 import re
+import json
+import time
+import hmac
+from urllib.parse import urlparse, parse_qs
 
 import Utils as Utils
+from CommonTypes import EosNames
+from RequestWrapper import RequestsStats, OriginHostsHealth, FragmentCache
+from Metrics import MetricsRegistry, StageTimers
+from Profiler import Profiler, ADMIN__TOKEN
 from SessionManager import SessionManager
 from HttpMultiServer import HttpMultiServerBaseHandler
 from EosRequestResponse import EosSessionRequest, EosSessionResponse
 
+# config variables
+METRICS__ENABLED = Utils.ConfigVariable('METRICS', 'ENABLED', type=bool, default_value=True, description='Serve Prometheus metrics at /metrics', mandatory=False)
+METRICS__TOKEN = Utils.ConfigVariable('METRICS', 'TOKEN', type=str, default_value='', description='Bearer token of /metrics, not checked when empty. The HTTP server listens on all interfaces, set a token or block /metrics in front of the server when the port is public', mandatory=False)
+
+# metrics
+METRIC__HTTP_REQUESTS = MetricsRegistry().counter('eos_http_requests_total', 'Player requests', ('route', 'status'))
+METRIC__HTTP_REQUEST_SECONDS = MetricsRegistry().histogram('eos_http_request_duration_seconds', 'Player requests latency', ('route',))
+
 
 ####################################################
 #
@@ -78,6 +94,24 @@ class EosHttpHandler(HttpMultiServerBaseHandler):
                 Utils.logger_.error(self._get_id_str(), "EosHttpHandler::_handle_get_request error parsing byte range header")
                 self.send_error(400, 'Invalid byte range')
 
+        # admin routes send their own status codes
+        admin_prefix = '/{}/v1/{}/'.format(EosNames.service_name, EosNames.admin_path)
+        if urlparse(self.path).path.startswith(admin_prefix):
+            self.__handle_admin_request(urlparse(self.path).path[len(admin_prefix):])
+            return
+
+        # stats hold origin urls, they need the admin token too
+        if urlparse(self.path).path == '/{}/v1/{}'.format(EosNames.service_name, EosNames.stats_path):
+            if self.__check_admin_token('stats') is True:
+                self.__handle_stats_request()
+            return
+
+        # metrics have their own token, scrapers don't get the admin routes
+        if urlparse(self.path).path == '/metrics':
+            if self.__check_metrics_token() is True:
+                self.__handle_metrics_request()
+            return
+
         self._set_headers()
 
         request = EosSessionRequest(path=self.path)
@@ -87,6 +121,7 @@ class EosHttpHandler(HttpMultiServerBaseHandler):
         if request.is_valid() is False:
             Utils.logger_.error(self.__get_id_str(), "EosHttpHandler::_handle_get_request request not valid. path: {}".format(self.path))
             self.send_error("Bad Request")
+            METRIC__HTTP_REQUESTS.labels('invalid', 'error').inc()
             return
 
         # get session using rest parameters
@@ -102,8 +137,14 @@ class EosHttpHandler(HttpMultiServerBaseHandler):
             response.error = "session not found"
             return response
 
+        start_time = time.monotonic()
+
         response = session.on_request(request)
 
+        route = self.__route_name(request)
+        METRIC__HTTP_REQUEST_SECONDS.labels(route).record(time.monotonic() - start_time)
+        METRIC__HTTP_REQUESTS.labels(route, 'ok' if response.response is not None else 'error').inc()
+
         if response.response is not None:
 
             if range is not None:
@@ -138,6 +179,181 @@ class EosHttpHandler(HttpMultiServerBaseHandler):
             self.send_error("unknown error")
         return
     
+    ####################################################
+    #  __route_name
+    ####################################################
+    def __route_name(self, request: EosSessionRequest) -> str:
+
+        if request.is_eos_manifest_request() is True:
+            if request.is_fragment_request() is True or request.manifest_type() == EosNames.fragment_dash_prefix:
+                return 'fragment'
+            return 'subtitle_manifest'
+
+        if request.is_live_manifest_request() is True:
+            return 'live_manifest'
+
+        if request.is_variant_manifest_request() is True:
+            return 'variant_manifest'
+
+        return 'unknown'
+
+    ####################################################
+    #  __send_admin_response
+    ####################################################
+    def __send_admin_response(self, code: int, body, content_type: str = 'text/plain; charset=utf-8') -> None:
+
+        if isinstance(body, str) is False:
+            body = json.dumps(body)
+            content_type = 'application/json'
+
+        response_bytes = body.encode('utf-8')
+
+        self.send_response(code)
+        self._set_nocache_headers()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
+    ####################################################
+    #  __request_token
+    #  the token of the header, a bearer token takes precedence
+    ####################################################
+    def __request_token(self, header: str) -> str:
+
+        request_token = self.headers.get(header, '')
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            request_token = authorization[len('Bearer '):]
+
+        return request_token
+
+    ####################################################
+    #  __check_metrics_token
+    #  sends the error response and returns False if the request is not allowed
+    ####################################################
+    def __check_metrics_token(self) -> bool:
+
+        if METRICS__ENABLED.value() is False:
+            self.__send_admin_response(404, 'metrics are disabled\n')
+            return False
+
+        token = METRICS__TOKEN.value()
+        if token == '':
+            return True
+
+        if hmac.compare_digest(self.__request_token('X-Eos-Metrics-Token').encode('utf-8'), token.encode('utf-8')) is False:
+            Utils.logger_.warning(self.__get_id_str(), "EosHttpHandler::__check_metrics_token unauthorized request from {}".format(self.client_address[0]))
+            self.__send_admin_response(401, 'unauthorized\n')
+            return False
+
+        return True
+
+    ####################################################
+    #  __check_admin_token
+    #  the token is sent in the X-Eos-Admin-Token header or as a bearer token
+    #  sends the error response and returns False if the request is not allowed
+    ####################################################
+    def __check_admin_token(self, command: str) -> bool:
+
+        token = ADMIN__TOKEN.value()
+        if token == '':
+            self.__send_admin_response(404, 'admin routes are disabled\n')
+            return False
+
+        if hmac.compare_digest(self.__request_token('X-Eos-Admin-Token').encode('utf-8'), token.encode('utf-8')) is False:
+            Utils.logger_.warning(self.__get_id_str(), "EosHttpHandler::__check_admin_token unauthorized request from {}, command={}".format(self.client_address[0], command))
+            self.__send_admin_response(401, 'unauthorized\n')
+            return False
+
+        return True
+
+    ####################################################
+    #  __handle_admin_request
+    ####################################################
+    def __handle_admin_request(self, command: str) -> None:
+
+        if self.__check_admin_token(command) is False:
+            return
+
+        Utils.logger_.info(self.__get_id_str(), "EosHttpHandler::__handle_admin_request command={}".format(command))
+
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            limit = int(query.get('limit', ['30'])[0])
+            seconds = float(query.get('seconds', ['30'])[0])
+            interval = float(query.get('interval', ['0.01'])[0])
+        except ValueError:
+            self.__send_admin_response(400, 'invalid parameters\n')
+            return
+
+        if command == 'profile/start':
+            started, status = Profiler().start_profile(seconds, interval)
+            self.__send_admin_response(200 if started is True else 409, status)
+
+        elif command == 'profile/stop':
+            status = Profiler().stop_profile()
+            self.__send_admin_response(200 if status is not None else 404, status if status is not None else 'no profile\n')
+
+        elif command == 'profile':
+            report = Profiler().get_profile(query.get('format', ['top'])[0], limit)
+            self.__send_admin_response(200 if report is not None else 404, report if report is not None else 'no profile\n')
+
+        elif command == 'profile/status':
+            status = Profiler().get_profile_status()
+            self.__send_admin_response(200 if status is not None else 404, status if status is not None else 'no profile\n')
+
+        elif command == 'tracemalloc/snapshot':
+            self.__send_admin_response(200, Profiler().take_snapshot(limit))
+
+        elif command == 'tracemalloc/diff':
+            report = Profiler().diff_snapshots(limit)
+            self.__send_admin_response(200 if report is not None else 404, report if report is not None else 'take two snapshots first\n')
+
+        elif command == 'tracemalloc/stop':
+            Profiler().stop_tracing()
+            self.__send_admin_response(200, 'tracemalloc stopped\n')
+
+        elif command == 'threads':
+            self.__send_admin_response(200, Profiler.dump_threads())
+
+        else:
+            self.__send_admin_response(404, 'unknown admin command\n')
+
+    ####################################################
+    #  __handle_metrics_request
+    ####################################################
+    def __handle_metrics_request(self) -> None:
+
+        response_bytes = MetricsRegistry().render().encode('utf-8')
+
+        self.send_response(200)
+        self._set_nocache_headers()
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
+    ####################################################
+    #  __handle_stats_request
+    ####################################################
+    def __handle_stats_request(self) -> None:
+
+        stats = {'origin_latency': RequestsStats().get_latency_stats(),
+                 'origin_hosts': OriginHostsHealth().get_stats(),
+                 'fragment_cache': FragmentCache().get_stats(),
+                 'transcribe_stages': StageTimers().get_stats(),
+                 'requests': RequestsStats().get_stats()}
+
+        response_bytes = json.dumps(stats).encode('utf-8')
+
+        self.send_response(200)
+        self._set_nocache_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
     ####################################################
     #  parse_byte_range
     ####################################################
@@ -1,15 +1,25 @@
 import base64
-import requests
 import uuid
 import datetime
+import threading
+import concurrent.futures
 from typing import Optional, List, Dict, Any
 
+import cachetools
+
 import Utils as Utils
 from OttHandler import OttProtocols, OttHandler, HlsHandler, DashHandler
 from EosRequestResponse import EosSessionRequest, EosManagementRequest, EosSessionResponse
 from EosTranscribeStream import EosTranscribeStream, EosTranscribeLiveStream
-from CommonTypes import EosHttpConfig, EosNames
+from EosTranslatePrefetch import EosTranslatePrefetcher, TRANSLATE__PREFETCH_LIVE_FRAGMENTS
+from CommonTypes import EosNames
 from Languages import EosLanguages, EosLanguage
+from RequestWrapper import RequestWrapper, METRIC__CACHE_REQUESTS
+from Metrics import StageTimers
+from SubtitleStore import SubtitleSnapshot
+
+TRANSLATE__FRAGMENTS_CACHE_SIZE = Utils.ConfigVariable('TRANSLATE', 'FRAGMENTS_CACHE_SIZE', type=int, default_value=16, description='Max number of source fragments kept for the next fragment request', mandatory=False)
+TRANSLATE__FRAGMENTS_CACHE_TTL = Utils.ConfigVariable('TRANSLATE', 'FRAGMENTS_CACHE_TTL', type=int, default_value=30, description='Seconds to keep a source fragment for the next fragment request', mandatory=False)
 
 STREAMING_SERVER__USE_HTTPS = Utils.ConfigVariable('STREAMING_SERVER', 'USE_HTTPS', type=bool, default_value=False, description='Use HTTPS fo streaming', mandatory=False)
 STREAMING_SERVER__HOST_NAME = Utils.ConfigVariable('STREAMING_SERVER', 'HOST_NAME', type=str, default_value='127.0.0.1', description='Host name', mandatory=False)
@@ -39,6 +49,8 @@ class EosSession:
     _subtitles_manifest: Dict[str, str]  # map dst_lang->cahched subtitle manifest
     _subtitles_manifest_content_type: Optional[str]  # cached subtitle manifest content type
     _requests_counter: int
+    _manifest_request_wrapper: RequestWrapper
+    _fragment_request_wrapper: RequestWrapper
 
     #################################
     # __init__
@@ -91,6 +103,9 @@ class EosSession:
 
         self._requests_counter = 0
 
+        self._manifest_request_wrapper = RequestWrapper(self._session_id, 'EosSession manifest')
+        self._fragment_request_wrapper = RequestWrapper(self._session_id, 'EosSession fragment')
+
     #################################
     # set_default_lang
     #################################
@@ -141,6 +156,12 @@ class EosSession:
     def is_live(self) -> bool:
         return self._live
 
+    #################################
+    # get_session_type
+    #################################
+    def get_session_type(self) -> str:
+        return self._get_session_type()
+
     #################################
     # get_session_url_base64
     #################################
@@ -267,7 +288,7 @@ class EosSession:
                 # if it is dash live, we need to update the manifest with the updated framgents
                 elif self._ott_protocol is OttProtocols.DASH_PROTOCOL and self._live is True:
                     response = EosSessionResponse()
-                    response.response = str.encode(self._ott_handler.build_manifest())
+                    response.response = self._ott_handler.build_live_manifest()
                     response.content_type = self._variant_manifest_content_type
                     response.cache = False  # TODO: change to 1 fragment interval
                     return response
@@ -280,29 +301,17 @@ class EosSession:
                 self._variant_manifest[default_lang_code] = response.response
                 return response
 
-        try:
-            headers = {'User-Agent': EosHttpConfig.user_agent}
-            responses = requests.get(self._variant_manifest_url, headers=headers)
-
-            if responses.status_code == requests.codes.ok:
-
-                original_manifest = responses.text
-                # Utils.logger_.dump(str(self._session_id), 'EosSession::on_manifest_request original_manifest={}'.format(original_manifest))
-
-            else:
-                Utils.logger_.error(str(self._session_id), "EosSession::on_manifest_request error getting manifest from server ({})".format(responses.status_code))
-                print(responses)
-                response = EosSessionResponse()
-                response.error = str(responses.status_code)
-                return response
-
-        except requests.ConnectionError:
-            error_str = "EosSession::on_manifest_request Error connecting to server {}".format(self._variant_manifest_url)
+        responses = self._manifest_request_wrapper.get(self._variant_manifest_url)
+        if responses is None:
+            error_str = "EosSession::on_manifest_request error getting manifest from server {}".format(self._variant_manifest_url)
             Utils.logger_.error(str(self._session_id), error_str)
             response = EosSessionResponse()
-            response.error = "Error connecting to server {}".format(self._variant_manifest_url)
+            response.error = error_str
             return response
 
+        original_manifest = responses.text
+        # Utils.logger_.dump(str(self._session_id), 'EosSession::on_manifest_request original_manifest={}'.format(original_manifest))
+
         if(responses.url != self._variant_manifest_url):
             self._variant_manifest_url = responses.url
             Utils.logger_.debug_color(str(self._session_id), "EosSession::on_manifest_request ---redirected--- self._variant_manifest_url={}".format(self._variant_manifest_url))
@@ -430,6 +439,10 @@ class EosSession:
 #
 ####################################################
 class EosTranslateSession(EosSession):
+    _prefetcher: Optional[EosTranslatePrefetcher]
+    _next_fragment_request_wrapper: RequestWrapper
+    _source_fragments: cachetools.TTLCache   # fragment url -> Future of the source FragmentResponse
+    _source_fragments_lock: threading.Lock
 
     #################################
     # __init__
@@ -439,6 +452,13 @@ class EosTranslateSession(EosSession):
 
         EosSession.__init__(self, session_url, ott_protocol, live, dst_languages, src_language, variants)
 
+        self._prefetcher = None
+
+        self._next_fragment_request_wrapper = RequestWrapper(self._session_id, 'EosSession next fragment')
+
+        self._source_fragments = cachetools.TTLCache(maxsize=TRANSLATE__FRAGMENTS_CACHE_SIZE.value(), ttl=TRANSLATE__FRAGMENTS_CACHE_TTL.value())
+        self._source_fragments_lock = threading.Lock()
+
     #################################
     # _get_session_type
     #################################
@@ -453,6 +473,27 @@ class EosTranslateSession(EosSession):
         for dst_lang in self._dst_languages:
             self._ott_handler.clone_subtitle_stream(self._src_language, dst_lang, default_lang)
 
+    #################################
+    #  start_live
+    #################################
+    def start_live(self) -> bool:
+
+        # only HLS publishes the live text fragments to listeners
+        if self._ott_protocol is not OttProtocols.HLS_PROTOCOL or TRANSLATE__PREFETCH_LIVE_FRAGMENTS.value() is False:
+            return True
+
+        if self._prefetcher is not None:
+            return True
+
+        Utils.logger_.info(str(self._session_id), "EosTranslateSession::start_live starting live fragments prefetch")
+
+        self._prefetcher = EosTranslatePrefetcher(self._session_id, self._ott_handler, self._src_language, self._dst_languages)
+        self._prefetcher.start()
+
+        self._ott_handler.register_live_parser_listener(self._dst_languages[0].code_bcp_47(), self._prefetcher)
+
+        return True
+
     #################################
     # prepare_subtitle_manifest
     # only for HLS
@@ -463,28 +504,17 @@ class EosTranslateSession(EosSession):
 
         Utils.logger_.dump(str(self._session_id), "EosTranslateSession::prepare_subtitle_manifest reference_manifest_url={}".format(reference_manifest_url))
 
-        try:
-            headers = {'User-Agent': EosHttpConfig.user_agent}
-            responses = requests.get(reference_manifest_url, headers=headers)
-
-            if responses.status_code == requests.codes.ok:
-
-                original_manifest = responses.text
-                Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_manifest original_manifest={}'.format(original_manifest))
-
-            else:
-                Utils.logger_.error(str(self._session_id), "EosTranslateSession::prepare_subtitle_manifest error getting manifest from server ({})".format(responses.status_code))
-                response = EosSessionResponse()
-                response.error = 'error'
-                return response
-
-        except requests.ConnectionError:
-            error_str = "EosTranslateSession::prepare_subtitle_manifest Error connecting to server {}".format(reference_manifest_url)
+        responses = self._manifest_request_wrapper.get(reference_manifest_url)
+        if responses is None:
+            error_str = "EosTranslateSession::prepare_subtitle_manifest error getting manifest from server {}".format(reference_manifest_url)
             Utils.logger_.error(str(self._session_id), error_str)
             response = EosSessionResponse()
             response.error = error_str
             return response
 
+        original_manifest = responses.text
+        Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_manifest original_manifest={}'.format(original_manifest))
+
         response = EosSessionResponse()
         response.response = str.encode(self._ott_handler.clone_reference_manifest(original_manifest, request.dst_lang(), reference_manifest_url))
         response.content_type = responses.headers['Content-Type']
@@ -506,56 +536,64 @@ class EosTranslateSession(EosSession):
 
         Utils.logger_.dump(str(self._session_id), "EosTranslateSession::prepare_subtitle_fragment reference_fragment_url={}".format(reference_fragment_url))
 
-        timestamp = reference_fragment_url[reference_fragment_url.rfind('=')+1:-1]
-        next_timestamp = None
-        if timestamp != "Init":
-            next_timestamp = str(int(timestamp) + 40000000)
-            reference_next_fragment_url = reference_fragment_url[:reference_fragment_url.rfind('=')+1] + next_timestamp + ")"
-            Utils.logger_.dump(str(self._session_id), "EosTranslateSession::prepare_subtitle_fragment reference_next_fragment_url={}".format(reference_next_fragment_url))
-
-        try:
-            headers = {'User-Agent': EosHttpConfig.user_agent}
-            responses = requests.get(reference_fragment_url, headers=headers)
-
-            if responses.status_code == requests.codes.ok:
-
-                original_fragment = responses.content
-                Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_fragment original_fragment={}'.format(original_fragment))
-
-            else:
-                error_str = "EosTranslateSession::prepare_subtitle_fragment error getting fragment from server ({})".format(responses.status_code)
-                Utils.logger_.error(str(self._session_id), error_str)
+        # live fragments are usually translated already by the prefetcher
+        if self._prefetcher is not None:
+            translated_fragment = self._prefetcher.get_translated_fragment(request.dst_lang(), reference_fragment_url)
+            if translated_fragment is not None:
                 response = EosSessionResponse()
-                response.error = error_str
+                response.response, response.content_type = translated_fragment
                 return response
 
-        except requests.ConnectionError:
-            error_str = "EosTranslateSession::prepare_subtitle_fragment Error connecting to server {}".format(reference_fragment_url)
+        reference_next_fragment_url = None
+        if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
+            reference_next_fragment_url = self._ott_handler.get_next_fragment_url(request.dst_lang(), request.reference_fragment_url())
+        else:
+            timestamp = reference_fragment_url[reference_fragment_url.rfind('=')+1:-1]
+            if timestamp != "Init":
+                next_timestamp = str(int(timestamp) + 40000000)
+                reference_next_fragment_url = reference_fragment_url[:reference_fragment_url.rfind('=')+1] + next_timestamp + ")"
+
+        Utils.logger_.dump(str(self._session_id), "EosTranslateSession::prepare_subtitle_fragment reference_next_fragment_url={}".format(reference_next_fragment_url))
+
+        # the next fragment is downloaded while the current one is, and kept for the next request
+        with self._source_fragments_lock:
+            current_future = self._source_fragments.get(reference_fragment_url)
+            next_future = None
+            if reference_next_fragment_url is not None:
+                next_future = self._source_fragments.get(reference_next_fragment_url)
+                if next_future is None:
+                    next_future = self._next_fragment_request_wrapper.get_fragment_async(reference_next_fragment_url, self._live)
+                    self._source_fragments[reference_next_fragment_url] = next_future
+
+        METRIC__CACHE_REQUESTS.labels('translate_source_fragment', 'hit' if current_future is not None else 'miss').inc()
+
+        responses = None
+        if current_future is not None:
+            responses = current_future.result()
+            if responses is None:
+                self.__forget_source_fragment(reference_fragment_url, current_future)
+        if responses is None:
+            responses = self._fragment_request_wrapper.get_fragment(reference_fragment_url, self._live)
+
+        if responses is None:
+            error_str = "EosTranslateSession::prepare_subtitle_fragment error getting fragment from server {}".format(reference_fragment_url)
             Utils.logger_.error(str(self._session_id), error_str)
             response = EosSessionResponse()
             response.error = error_str
             return response
 
-        next_original_fragment = None
-        if next_timestamp is not None:
-            try:
-                headers = {'User-Agent': EosHttpConfig.user_agent}
-                next_responses = requests.get(reference_next_fragment_url, headers=headers)
-
-                if next_responses.status_code == requests.codes.ok:
-
-                    next_original_fragment = next_responses.content
-                    Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_fragment next_original_fragment={}'.format(next_original_fragment))
+        original_fragment = responses.content
+        Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_fragment original_fragment={}'.format(original_fragment))
 
-                else:
-                    error_str = "EosTranslateSession::prepare_subtitle_fragment error getting next fragment from server ({})".format(next_responses.status_code)
-                    Utils.logger_.error(str(self._session_id), error_str)
-                    next_original_fragment = None
-
-            except requests.ConnectionError:
-                error_str = "EosTranslateSession::prepare_subtitle_fragment Error connecting to server {}".format(reference_fragment_url)
-                Utils.logger_.error(str(self._session_id), error_str)
-                next_original_fragment = None
+        next_original_fragment = None
+        if next_future is not None:
+            next_responses = next_future.result()
+            if next_responses is not None:
+                next_original_fragment = next_responses.content
+                Utils.logger_.dump(str(self._session_id), 'EosTranslateSession::prepare_subtitle_fragment next_original_fragment={}'.format(next_original_fragment))
+            else:
+                Utils.logger_.error(str(self._session_id), "EosTranslateSession::prepare_subtitle_fragment error getting next fragment from server {}".format(reference_next_fragment_url))
+                self.__forget_source_fragment(reference_next_fragment_url, next_future)
 
         dst_language = EosLanguages().find(request.dst_lang())
 
@@ -564,10 +602,20 @@ class EosTranslateSession(EosSession):
             response.response = original_fragment
         else:
             response.response = self._ott_handler.translate_subtitle_fragment(original_fragment, next_original_fragment, self._src_language, dst_language)
-        response.content_type = responses.headers['Content-Type']
+        response.content_type = responses.content_type
 
         return response
 
+    #################################
+    # __forget_source_fragment
+    # failed downloads are not kept, the next request fetches again
+    #################################
+    def __forget_source_fragment(self, fragment_url: str, future: concurrent.futures.Future) -> None:
+
+        with self._source_fragments_lock:
+            if self._source_fragments.get(fragment_url) is future:
+                del self._source_fragments[fragment_url]
+
     #################################
     # _get_state
     #################################
@@ -607,6 +655,9 @@ class EosTranslateSession(EosSession):
 
         Utils.logger_.info(str(self._session_id), "EosTranslateSession::close_transcribe")
 
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+
 
 ####################################################
 #
@@ -656,28 +707,17 @@ class EosTranscribeSession(EosSession):
 
             Utils.logger_.dump(str(self._session_id), "EosTranscribeSession::prepare_subtitle_manifest reference_manifest_url={}".format(reference_manifest_url))
 
-            try:
-                headers = {'User-Agent': EosHttpConfig.user_agent}
-                responses = requests.get(reference_manifest_url, headers=headers)
-
-                if responses.status_code == requests.codes.ok:
-
-                    original_manifest = responses.text
-                    Utils.logger_.dump(str(self._session_id), 'EosTranscribeSession::prepare_subtitle_manifest original_manifest={}'.format(original_manifest))
-
-                else:
-                    Utils.logger_.error(str(self._session_id), "EosTranscribeSession::prepare_subtitle_manifest error getting manifest from server ({})".format(responses.status_code))
-                    response = EosSessionResponse()
-                    response.error = 'error'
-                    return response
-
-            except requests.ConnectionError:
-                error_str = "EosTranscribeSession::prepare_subtitle_manifest Error connecting to server {}".format(reference_manifest_url)
+            responses = self._manifest_request_wrapper.get(reference_manifest_url)
+            if responses is None:
+                error_str = "EosTranscribeSession::prepare_subtitle_manifest error getting manifest from server {}".format(reference_manifest_url)
                 Utils.logger_.error(str(self._session_id), error_str)
                 response = EosSessionResponse()
                 response.error = error_str
                 return response
 
+            original_manifest = responses.text
+            Utils.logger_.dump(str(self._session_id), 'EosTranscribeSession::prepare_subtitle_manifest original_manifest={}'.format(original_manifest))
+
             response = EosSessionResponse()
             response.response = str.encode(self._ott_handler.clone_reference_manifest(original_manifest, request.dst_lang(), reference_manifest_url))
             response.content_type = responses.headers['Content-Type']
@@ -819,6 +859,8 @@ class EosTranscribeSession(EosSession):
         self._transcribe_session.close()
         self._transcribe_session = None
 
+        StageTimers().remove_session(self._session_id)
+
     #################################
     # prepare_subtitle_fragment
     #################################
@@ -829,7 +871,7 @@ class EosTranscribeSession(EosSession):
 
             Utils.logger_.dump(str(self._session_id), "EosTranscribeSession::prepare_subtitle_fragment request.reference_fragment_url()={}, start_time={}, end_time={}".format(request.reference_fragment_url(), start_time, end_time))
 
-            subs: List[Dict[str, Any]] = self._transcribe_session.get_subs(request.dst_lang())
+            subs: SubtitleSnapshot = self._transcribe_session.get_subs(request.dst_lang())
 
             #print(subs)
             #print("")
@@ -848,7 +890,7 @@ class EosTranscribeSession(EosSession):
             #print(subtitle_fragment)
 
             response = EosSessionResponse()
-            response.response = subtitle_fragment.encode('utf-8')
+            response.response = subtitle_fragment
             response.content_type = 'binary/octet-stream'
 
             return response
@@ -856,13 +898,13 @@ class EosTranscribeSession(EosSession):
         else:
             timestamp = request.dash_timestamp()
             if timestamp.find("=Init") != -1:
-                subtitle_fragment = self._ott_handler.generate_init_fragment()
+                subtitle_fragment = self._ott_handler.generate_init_fragment(EosLanguages().find(request.dst_lang()))
             else:
                 split_timestamp = timestamp.split("=")
                 start_time = int(timestamp.split("=")[1][:-1])
                 end_time = start_time + 40000000
 
-                subs: List[Dict[str, Any]] = self._transcribe_session.get_subs(request.dst_lang())
+                subs: SubtitleSnapshot = self._transcribe_session.get_subs(request.dst_lang())
 
                 #print("subs: ", subs)
                 #for sub in subs:
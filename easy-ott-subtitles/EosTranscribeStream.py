@@ -1,4 +1,3 @@
-import requests
 import subprocess
 import io
 import os
@@ -21,11 +20,13 @@ import Utils as Utils
 from GoogleCloudApi import GoogleCloudStreamingTranscribe, GoogleCloudStreamingGenerator, GoogleCloudApiListener
 from RevAiApi import RevAitreamingTranscribe
 import Transcoder as Transcoder
-from CommonTypes import EosFragmentEncodings, EosHttpConfig, EosFragment, LiveDelayListener
+from CommonTypes import EosFragmentEncodings, EosFragment, LiveDelayListener
 from Languages import EosLanguage
-from OttHandler import OttProtocols
+from OttHandler import OttProtocols, HlsHandler, DashHandler
 from DashUtils import DashFragmentDecoder
 from RequestWrapper import RequestWrapper
+from Metrics import StageTimers
+from SubtitleStore import SubtitleStore, SubtitleSnapshot
 # from EosFragment import EosFragment
 
 
@@ -40,7 +41,7 @@ APP__TMP_FILES_PATH = Utils.ConfigVariable('APP', 'TMP_FILES_PATH', type=str, de
 ####################################################
 class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
     __queue: queue.Queue
-    __subs: Dict[str, List[Dict[str, Any]]]  # language -> list of subs
+    __subs: Dict[str, SubtitleStore]  # language -> subs
     __time_in_subs: Dict[str, float]  # language -> time
     __initial_time_offset: float
     __is_live: bool
@@ -48,7 +49,7 @@ class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
     ####################################################
     #  __init__
     ####################################################
-    def __init__(self, src_language: EosLanguage, dst_languages: List[EosLanguage], is_live: bool):
+    def __init__(self, session_id: str, src_language: EosLanguage, dst_languages: List[EosLanguage], is_live: bool):
 
         self.__queue = queue.Queue()
 
@@ -60,14 +61,14 @@ class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
         self.__is_live = is_live
 
         for lang in dst_languages:
-            self.__subs[lang.code_bcp_47()] = []
+            self.__subs[lang.code_bcp_47()] = SubtitleStore()
             self.__time_in_subs[lang.code_bcp_47()] = 0
 
         if src_language.code_bcp_47() not in self.__subs.keys():
-            self.__subs[src_language.code_bcp_47] = []
+            self.__subs[src_language.code_bcp_47] = SubtitleStore()
             self.__time_in_subs[src_language.code_bcp_47] = 0
 
-        GoogleCloudApiListener.__init__(self, src_language, dst_languages)
+        GoogleCloudApiListener.__init__(self, session_id, src_language, dst_languages)
         threading.Thread.__init__(self, name='StreamingTranscribeWriter')  # start thread
 
     ####################################################
@@ -80,7 +81,7 @@ class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
 
         while True:
 
-            Utils.logger_.debug_color('StreamingTranscribeWriter', "StreamingTranscribeWriter::run loop name={}".format(self.getName()))
+            Utils.logger_.debug_color('StreamingTranscribeWriter', "StreamingTranscribeWriter::run loop name={}", self.getName())
 
             words_ = self.__queue.get()
 
@@ -105,16 +106,22 @@ class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
         time = lines[-1]['end'] - lines[0]['start']
         #print("**************************************************************** time=", time)
 
-        self.__subs[dst_language.code_bcp_47()].append({'start': lines[0]['start'], 'end': lines[-1]['end'], 'text': text})
+        # cue times are formatted and the cues rendered once here instead of on every fragment request
+        start_time_str = Utils.seconds_to_webvtt_time(lines[0]['start'])
+        end_time_str = Utils.seconds_to_webvtt_time(lines[-1]['end'])
+
+        self.__subs[dst_language.code_bcp_47()].append({'start': lines[0]['start'], 'end': lines[-1]['end'], 'text': text,
+                                                        'webvtt': HlsHandler.render_cue(start_time_str, end_time_str, text),
+                                                        'ttml': DashHandler.render_cue(start_time_str, end_time_str, text)})
 
         self.__time_in_subs[dst_language.code_bcp_47()] += time
 
         if self.__is_live:
             while self.__time_in_subs[dst_language.code_bcp_47()] > 140:
-                sub = self.__subs[dst_language.code_bcp_47()].pop(0)
+                sub = self.__subs[dst_language.code_bcp_47()].pop_first()
                 sub_time = sub['end'] - sub['start']
                 self.__time_in_subs[dst_language.code_bcp_47()] -= sub_time
-                Utils.logger_.debug('StreamingTranscribeWriter', "StreamingTranscribeWriter::_handle_text live removing sub __time_in_subs[{}]={}".format(dst_language.code_bcp_47(), self.__time_in_subs[dst_language.code_bcp_47()]))
+                Utils.logger_.debug('StreamingTranscribeWriter', "StreamingTranscribeWriter::_handle_text live removing sub __time_in_subs[{}]={}", dst_language.code_bcp_47(), self.__time_in_subs[dst_language.code_bcp_47()])
 
     #################################
     # handle_words
@@ -126,9 +133,9 @@ class StreamingTranscribeWriter(threading.Thread, GoogleCloudApiListener):
     #################################
     # get_subs
     #################################
-    def get_subs(self, dst_lang: str) -> List[Dict[str, Any]]:
+    def get_subs(self, dst_lang: str) -> SubtitleSnapshot:
 
-        return self.__subs[dst_lang]
+        return self.__subs[dst_lang].snapshot()
 
     #################################
     # set_initial_time_offset
@@ -163,6 +170,7 @@ class EosTranscribeStreamBase(threading.Thread):
     _google_streaming: GoogleCloudStreamingTranscribe
     _rev_ai_streaming: RevAitreamingTranscribe
     _delete_tmp_files: bool
+    _stage_timers: StageTimers
 
     #################################
     # __init__
@@ -187,7 +195,9 @@ class EosTranscribeStreamBase(threading.Thread):
 
         self._open = True
 
-        self._listener = StreamingTranscribeWriter(self._src_language, self._dst_languages, self._live())
+        self._stage_timers = StageTimers()
+
+        self._listener = StreamingTranscribeWriter(self._session_id, self._src_language, self._dst_languages, self._live())
         self._listener.start()
 
         self._paused = False
@@ -196,7 +206,7 @@ class EosTranscribeStreamBase(threading.Thread):
         self._pending_close = False
         self._pending_open = True
 
-        self._audio_generator = GoogleCloudStreamingGenerator(self._sample_rate)
+        self._audio_generator = GoogleCloudStreamingGenerator(self._sample_rate, self._session_id)
 
         self._ready = threading.Event()
         self._google_streaming = GoogleCloudStreamingTranscribe(self._ready, self._src_language, self._sample_rate, self._audio_generator, self._listener)
@@ -221,7 +231,7 @@ class EosTranscribeStreamBase(threading.Thread):
     #################################
     # get_subs
     #################################
-    def get_subs(self, dst_lang: str) -> List[Dict[str, Any]]:
+    def get_subs(self, dst_lang: str) -> SubtitleSnapshot:
 
         return self._listener.get_subs(dst_lang)
 
@@ -282,7 +292,7 @@ class EosTranscribeStreamBase(threading.Thread):
 
         self._reset_params()
 
-        self._audio_generator = GoogleCloudStreamingGenerator(self._sample_rate)
+        self._audio_generator = GoogleCloudStreamingGenerator(self._sample_rate, self._session_id)
 
         self._google_streaming = GoogleCloudStreamingTranscribe(self._ready, self._src_language, self._sample_rate, self._audio_generator, self._listener)
         self._google_streaming.start()
@@ -374,6 +384,7 @@ class EosTranscribeStreamBase(threading.Thread):
 #
 ####################################################
 class EosTranscribeStream(EosTranscribeStreamBase):
+    __request_wrapper: RequestWrapper
 
     #################################
     # __init__
@@ -390,6 +401,8 @@ class EosTranscribeStream(EosTranscribeStreamBase):
 
         self._fragemnts_list = fragemnts_list
 
+        self.__request_wrapper = RequestWrapper(session_id, 'EosTranscribeStream')
+
         EosTranscribeStreamBase.__init__(self, session_id, ott_protocol, src_language, dst_languages, sample_rate)
 
     ####################################################
@@ -406,45 +419,39 @@ class EosTranscribeStream(EosTranscribeStreamBase):
 
             print(fragment)
 
-            try:
-                headers = {'User-Agent': EosHttpConfig.user_agent}
-                response = requests.get(fragment.url.absolute_url, headers=headers)
-
-                if response.status_code == requests.codes.ok:
-
-                    original_fragment = response.content
-                    Utils.logger_.dump(str(self._session_id), 'EosTranscribeStream::run len(original_fragment)={}'.format(len(original_fragment)))
-
-                else:
-                    Utils.logger_.error(str(self._session_id), "EosTranscribeStream::run error getting fragment from server ({}) url={}".format(response.status_code, original_fragment_url))
-                    return
-
-            except requests.ConnectionError:
-                error_str = "EosTranscribeStream::run Error connecting to server {}".format(fragment.absolte_url)
-                Utils.logger_.error(str(self._session_id), error_str)
+            with self._stage_timers.span(self._session_id, 'download'):
+                response = self.__request_wrapper.get_fragment(fragment.url.absolute_url, False)
+            if response is None:
+                Utils.logger_.error(str(self._session_id), "EosTranscribeStream::run error getting fragment from server: {}".format(fragment.url.absolute_url))
                 return
 
+            original_fragment = response.content
+            Utils.logger_.dump(str(self._session_id), 'EosTranscribeStream::run len(original_fragment)={}', len(original_fragment))
+
             # decrypt if needed
             if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
                 if fragment.encryption_uri != '':
-                    original_fragment = self._decrypt_hls(fragment, original_fragment)
+                    with self._stage_timers.span(self._session_id, 'decrypt'):
+                        original_fragment = self._decrypt_hls(fragment, original_fragment)
 
             original_file_name = APP__TMP_FILES_PATH.value() + '/' + hashlib.md5(fragment.url.base64_urlsafe.encode('utf-8')).hexdigest()
             with open(original_file_name, 'wb') as original_file:
                 original_file.write(original_fragment)
 
             audio_file = original_file_name + '.aac'
-            if self._ott_protocol == OttProtocols.DASH_PROTOCOL:
-                dash_decoder = DashFragmentDecoder(original_file_name)
-                dash_decoder.read_aac(audio_file, fragment.sampling_rate)
+            with self._stage_timers.span(self._session_id, 'demux'):
+                if self._ott_protocol == OttProtocols.DASH_PROTOCOL:
+                    dash_decoder = DashFragmentDecoder(original_file_name)
+                    dash_decoder.read_aac(audio_file, fragment.sampling_rate)
 
-            if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
-                Transcoder.transcoder_.extract_audio(original_file_name, audio_file)
+                if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
+                    Transcoder.transcoder_.extract_audio(original_file_name, audio_file)
 
             pcm_file = original_file_name + '.pcm'
-            Transcoder.transcoder_.transcode_file(audio_file,
-                                                  pcm_file,
-                                                  self._sample_rate)
+            with self._stage_timers.span(self._session_id, 'transcode'):
+                Transcoder.transcoder_.transcode_file(audio_file,
+                                                      pcm_file,
+                                                      self._sample_rate)
 
             with open(pcm_file, 'rb') as pcm:
                 audio_data = pcm.read()
@@ -460,15 +467,20 @@ class EosTranscribeStream(EosTranscribeStreamBase):
                 index = 0
                 chunk_size = int(2 * self._sample_rate / 2)
                 print("before index={}, chunk_size={}, len(audio_data)={}".format(index, chunk_size, len(audio_data)))
+                # feed_stt times the put_fragment calls only, not the pacing sleeps
+                feed_seconds = 0.0
                 while index < len(audio_data):
                     if chunk_size > len(audio_data) - index:
                         chunk_size = len(audio_data) - index
+                    feed_start = time.monotonic()
                     self._audio_generator.put_fragment(audio_data[index:(index + chunk_size)])
+                    feed_seconds += time.monotonic() - feed_start
                     index += chunk_size
                     total_bytes += chunk_size
                     print("inside index={}, chunk_size={}, len(audio_data)={}, total_bytes={}".format(index, chunk_size, len(audio_data), total_bytes))
 
                     time.sleep(chunk_size / (2 * self._sample_rate) * 0.6)
+                self._stage_timers.record(self._session_id, 'feed_stt', feed_seconds)
 
                 print("after index={}, chunk_size={}, len(audio_data)={}, total_bytes={}".format(index, chunk_size, len(audio_data), total_bytes))
 
@@ -570,31 +582,26 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
             if self._first_fragment_read is True:
                 target_time = datetime.datetime.now()
 
-            Utils.logger_.debug_color('EosTranscribeLiveStream', "reading fragment {}".format(fragment.url.absolute_url))
+            Utils.logger_.debug_color('EosTranscribeLiveStream', "reading fragment {}", fragment.url.absolute_url)
 
-            dl_start_time = datetime.datetime.now()
+            process_start_time = time.monotonic()
 
             original_fragment = None
-            response = self.__request_wrapper.get(fragment.url.absolute_url)
+            with self._stage_timers.span(self._session_id, 'download'):
+                response = self.__request_wrapper.get_fragment(fragment.url.absolute_url, True)
             if response is None:
                 Utils.logger_.error(str(self._session_id), "EosTranscribeLiveStream::run error getting fragment from server: {}".format(fragment.url.absolute_url))
                 continue
 
             original_fragment = response.content
 
-            dl_end_time = datetime.datetime.now()
-            dl_time = dl_end_time - dl_start_time
-
-            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {}: dl_time={}".format(fragment.url.absolute_url, dl_time))
-
-            transcode_start_time = datetime.datetime.now()
-
             #print("fragment: ", fragment)
 
             # decrypt if needed
             if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
                 if fragment.encryption_uri != '':
-                    original_fragment = self._decrypt_hls(fragment, original_fragment)
+                    with self._stage_timers.span(self._session_id, 'decrypt'):
+                        original_fragment = self._decrypt_hls(fragment, original_fragment)
 
             original_file_name = APP__TMP_FILES_PATH.value() + '/' + hashlib.md5(fragment.url.base64_urlsafe.encode('utf-8')).hexdigest()
             with open(original_file_name, 'wb') as original_file:
@@ -602,8 +609,9 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
 
             first_video_pts = -1
             if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
-                first_video_pts = Transcoder.transcoder_.get_first_pts(original_file_name)
-                Utils.logger_.dump('EosTranscribeLiveStream', "first_video_pts = {}".format(first_video_pts))
+                with self._stage_timers.span(self._session_id, 'pts_probe'):
+                    first_video_pts = Transcoder.transcoder_.get_first_pts(original_file_name)
+                Utils.logger_.dump('EosTranscribeLiveStream', "first_video_pts = {}", first_video_pts)
 
                 # if self._last_hls_fragment_pts + self._last_hls_fragment_duration != first_video_pts:   
 
@@ -620,23 +628,23 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
                 Utils.logger_.info('EosTranscribeLiveStream', "self._base_pts={}".format(self._base_pts))
 
             audio_file = original_file_name + '.aac'
-            if self._ott_protocol == OttProtocols.DASH_PROTOCOL:
-                dash_decoder = DashFragmentDecoder(original_file_name)
-                dash_decoder.read_aac(audio_file, fragment.sampling_rate)
+            with self._stage_timers.span(self._session_id, 'demux'):
+                if self._ott_protocol == OttProtocols.DASH_PROTOCOL:
+                    dash_decoder = DashFragmentDecoder(original_file_name)
+                    dash_decoder.read_aac(audio_file, fragment.sampling_rate)
 
-            if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
-                Transcoder.transcoder_.extract_audio(original_file_name, audio_file)
+                if self._ott_protocol == OttProtocols.HLS_PROTOCOL:
+                    Transcoder.transcoder_.extract_audio(original_file_name, audio_file)
 
             pcm_file = original_file_name + '.pcm'
-            Transcoder.transcoder_.transcode_file(audio_file,
-                                                  pcm_file,
-                                                  self._sample_rate)
+            with self._stage_timers.span(self._session_id, 'transcode'):
+                Transcoder.transcoder_.transcode_file(audio_file,
+                                                      pcm_file,
+                                                      self._sample_rate)
 
-            transcode_end_time = datetime.datetime.now()
-            transcode_time = transcode_end_time - transcode_start_time
-            total_process_time = dl_time + transcode_time
+            total_process_time = time.monotonic() - process_start_time
 
-            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {}: transcode_time={}, total_process_time={}".format(fragment.url.absolute_url, transcode_time, total_process_time))
+            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {}: total_process_time={:.3f}", fragment.url.absolute_url, total_process_time)
 
             try:
                 pcm = open(pcm_file, 'rb')
@@ -652,7 +660,7 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
                 continue
 
             audio_data = pcm.read()
-            Utils.logger_.dump('EosTranscribeLiveStream', "len(audio_data) = {}".format(len(audio_data)))
+            Utils.logger_.dump('EosTranscribeLiveStream', "len(audio_data) = {}", len(audio_data))
 
             # ## debug ##
             # with open("in_pcm.pcm", 'ab') as _debug_in_file:
@@ -661,20 +669,24 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
 
             fragment_time = datetime.timedelta(seconds=(float(len(audio_data)) / float(2 * self._sample_rate)))
             target_time = target_time + fragment_time
-            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {}: fragment_time={}, target_time={}".format(fragment.url.absolute_url, fragment_time, target_time))
+            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {}: fragment_time={}, target_time={}", fragment.url.absolute_url, fragment_time, target_time)
 
             # cut it to 100ms chunks
             index = 0
             chunk_size = int(2 * self._sample_rate / 2)
-            Utils.logger_.dump('EosTranscribeLiveStream', "before index={}, chunk_size={}, len(audio_data)={}".format(index, chunk_size, len(audio_data)))
+            Utils.logger_.dump('EosTranscribeLiveStream', "before index={}, chunk_size={}, len(audio_data)={}", index, chunk_size, len(audio_data))
+            # feed_stt times the put_fragment calls only, not the real time pacing sleeps
+            feed_seconds = 0.0
             while index < len(audio_data):
                 if chunk_size > len(audio_data) - index:
                     chunk_size = len(audio_data) - index
                 if self._audio_generator is not None:
-                    self._audio_generator.put_fragment(audio_data[index:(index + chunk_size)])                    
+                    feed_start = time.monotonic()
+                    self._audio_generator.put_fragment(audio_data[index:(index + chunk_size)])
+                    feed_seconds += time.monotonic() - feed_start
                 index += chunk_size
                 total_bytes += chunk_size
-                Utils.logger_.dump('EosTranscribeLiveStream', "inside index={}, chunk_size={}, len(audio_data)={}, total_bytes={}".format(index, chunk_size, len(audio_data), total_bytes))
+                Utils.logger_.dump('EosTranscribeLiveStream', "inside index={}, chunk_size={}, len(audio_data)={}, total_bytes={}", index, chunk_size, len(audio_data), total_bytes)
 
                 bytes_left = len(audio_data) - index
                 if bytes_left > 0:
@@ -685,11 +697,12 @@ class EosTranscribeLiveStream(EosTranscribeStreamBase, LiveDelayListener):
                         time.sleep(rate * chunk_size)
 
                         #time.sleep(chunk_size / (2 * self._sample_rate) * 0.6)
+            self._stage_timers.record(self._session_id, 'feed_stt', feed_seconds)
 
             pcm.close()
 
-            Utils.logger_.dump('EosTranscribeLiveStream', "after index={}, chunk_size={}, len(audio_data)={}, total_bytes={}".format(index, chunk_size, len(audio_data), total_bytes))
-            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {} done".format(fragment.url.absolute_url))
+            Utils.logger_.dump('EosTranscribeLiveStream', "after index={}, chunk_size={}, len(audio_data)={}, total_bytes={}", index, chunk_size, len(audio_data), total_bytes)
+            Utils.logger_.debug_color('EosTranscribeLiveStream', "fragment {} done", fragment.url.absolute_url)
 
             if self._delete_tmp_files is True:
                 if os.path.exists(original_file_name):
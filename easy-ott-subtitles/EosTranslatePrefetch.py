@@ -0,0 +1,167 @@
+import threading
+import queue
+import traceback
+from collections import OrderedDict
+from typing import Optional, List, Set, Tuple
+
+import Utils as Utils
+from CommonTypes import EosFragment, LiveDelayListener
+from Languages import EosLanguage
+from OttHandler import OttHandler
+from RequestWrapper import RequestWrapper, METRIC__CACHE_REQUESTS
+
+
+# config variables
+TRANSLATE__PREFETCH_LIVE_FRAGMENTS = Utils.ConfigVariable('TRANSLATE', 'PREFETCH_LIVE_FRAGMENTS', type=bool, default_value=True, description='Translate live subtitle fragments as soon as they are published by the origin', mandatory=False)
+TRANSLATE__PREFETCH_CACHE_SIZE = Utils.ConfigVariable('TRANSLATE', 'PREFETCH_CACHE_SIZE', type=int, default_value=100, description='Max number of translated fragments kept per live session', mandatory=False)
+
+
+####################################################
+#
+#  EosTranslatePrefetcher
+#
+#  Listens to the live text stream of a translate session.
+#  Each new fragment is downloaded, and the previous one is translated (it needs
+#  the new one as its 'next' fragment), so when the player asks for it after the
+#  live delay it is already in the cache.
+#  Only languages players have asked for are translated.
+#
+####################################################
+class EosTranslatePrefetcher(threading.Thread, LiveDelayListener):
+    __session_id: str
+    __ott_handler: OttHandler
+    __src_language: EosLanguage
+    __dst_languages: List[EosLanguage]
+    __queue: queue.Queue
+    __request_wrapper: RequestWrapper
+    __open: bool
+    __previous_fragment: Optional[Tuple[EosFragment, bytes, str]]   # (fragment, content, content_type)
+    __translated_fragments: OrderedDict   # (dst_lang, absolute_url) -> (content, content_type)
+    __max_translated_fragments: int
+    __requested_languages: Set[str]   # dst_lang codes requested by players
+    __lock: threading.Lock
+
+    #################################
+    # __init__
+    #################################
+    def __init__(self, session_id: str, ott_handler: OttHandler, src_language: EosLanguage, dst_languages: List[EosLanguage]) -> None:
+
+        self.__session_id = session_id
+        self.__ott_handler = ott_handler
+        self.__src_language = src_language
+        self.__dst_languages = dst_languages
+
+        self.__queue = queue.Queue()
+
+        self.__request_wrapper = RequestWrapper(session_id, 'EosTranslatePrefetcher')
+
+        self.__open = True
+
+        self.__previous_fragment = None
+
+        self.__translated_fragments = OrderedDict()
+        self.__max_translated_fragments = TRANSLATE__PREFETCH_CACHE_SIZE.value()
+
+        self.__requested_languages = set()
+
+        self.__lock = threading.Lock()
+
+        threading.Thread.__init__(self, name='prefetch')
+
+    #################################
+    # close
+    #################################
+    def close(self) -> None:
+
+        Utils.logger_.info(self.__session_id, "EosTranslatePrefetcher::close")
+
+        self.__open = False
+        self.__queue.put(None)
+
+    #################################
+    # on_new_fragment
+    # derived from LiveDelayListener
+    # called from the live poller thread, must not block
+    #################################
+    def on_new_fragment(self, fragment: EosFragment, param: str) -> None:
+
+        if self.__open is True:
+            self.__queue.put(fragment)
+
+    #################################
+    # get_translated_fragment
+    #################################
+    def get_translated_fragment(self, dst_lang: str, fragment_url: str) -> Optional[Tuple[bytes, str]]:
+
+        with self.__lock:
+            self.__requested_languages.add(dst_lang)
+            translated_fragment = self.__translated_fragments.get((dst_lang, fragment_url))
+
+        METRIC__CACHE_REQUESTS.labels('translate_prefetch', 'hit' if translated_fragment is not None else 'miss').inc()
+
+        return translated_fragment
+
+    ####################################################
+    # run
+    # called from thread context when start() is called
+    ####################################################
+    def run(self) -> None:
+
+        Utils.logger_.system(self.__session_id, "EosTranslatePrefetcher::run thread started name={}".format(self.getName()))
+
+        while self.__open is True:
+
+            fragment: Optional[EosFragment] = self.__queue.get()
+            if fragment is None:
+                break
+
+            try:
+                self.__prefetch(fragment)
+            except Exception:
+                Utils.core_dump_writer_.handle_core("EosTranslatePrefetcher", self.getName(), traceback.format_exc())
+
+        Utils.logger_.system(self.__session_id, "EosTranslatePrefetcher::run thread ending name={}".format(self.getName()))
+
+    #################################
+    # __prefetch
+    #################################
+    def __prefetch(self, fragment: EosFragment) -> None:
+
+        response = self.__request_wrapper.get_fragment(fragment.url.absolute_url, True)
+        if response is None:
+            Utils.logger_.error(self.__session_id, "EosTranslatePrefetcher::__prefetch error getting fragment from server: {}".format(fragment.url.absolute_url))
+            return
+
+        current_fragment = (fragment, response.content, response.content_type)
+
+        # the previous fragment can be translated now that its next fragment is known
+        if self.__previous_fragment is not None:
+            if fragment.discontinuity is True:
+                self.__translate(self.__previous_fragment, None)
+            else:
+                self.__translate(self.__previous_fragment, current_fragment)
+
+        self.__previous_fragment = current_fragment
+
+    #################################
+    # __translate
+    #################################
+    def __translate(self, fragment: Tuple[EosFragment, bytes, str], next_fragment: Optional[Tuple[EosFragment, bytes, str]]) -> None:
+
+        next_content = None
+        if next_fragment is not None:
+            next_content = next_fragment[1]
+
+        with self.__lock:
+            dst_languages = [dst_language for dst_language in self.__dst_languages if dst_language.code_bcp_47() in self.__requested_languages]
+
+        for dst_language in dst_languages:
+
+            translated_fragment = self.__ott_handler.translate_subtitle_fragment(fragment[1], next_content, self.__src_language, dst_language)
+
+            with self.__lock:
+                self.__translated_fragments[(dst_language.code_bcp_47(), fragment[0].url.absolute_url)] = (translated_fragment, fragment[2])
+                while len(self.__translated_fragments) > self.__max_translated_fragments:
+                    self.__translated_fragments.popitem(last=False)
+
+            Utils.logger_.debug(self.__session_id, "EosTranslatePrefetcher::__translate fragment translated dst_language={}, url={}", dst_language.code_bcp_47(), fragment[0].url.absolute_url)
@@ -2,16 +2,19 @@ import os
 import threading
 import queue
 import copy
+import time
+from collections import deque
 
 from google.cloud import translate
 from google.cloud import speech
 from google.api_core import exceptions
 
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Deque, Optional, Tuple
 
 import Utils as Utils
 from CommonTypes import EosFragmentEncodings
 from Languages import EosLanguage
+from Metrics import MetricsRegistry, StageTimers
 
 STREAMING_LIMIT = 180000  # 3 minutes
 # STREAMING_LIMIT = 120000  # 2 minutes
@@ -20,6 +23,11 @@ DEBUG = False
 GOOGLE_API__PROJECT_ID = Utils.ConfigVariable('GOOGLE_API', 'PROJECT_ID', type=str, default_value='', description='Google Cloud project ID', mandatory=False)
 GOOGLE_API__SERVICE_ACCOUNT_FILE = Utils.ConfigVariable('GOOGLE_API', 'SERVICE_ACCOUNT_FILE', type=str, default_value='', description='Path to Google service acount json file', mandatory=False)
 
+# metrics
+METRIC__TRANSLATE_RPC_SECONDS = MetricsRegistry().histogram('eos_translate_rpc_duration_seconds', 'Translation requests latency', ('engine',))
+METRIC__TRANSLATE_RPC_FAILURES = MetricsRegistry().counter('eos_translate_rpc_failures_total', 'Failed translation requests', ('engine',))
+METRIC__STT_RESULT_SECONDS = MetricsRegistry().histogram('eos_stt_result_latency_seconds', 'Time from sending audio to the speech to text engine until its final result', ('engine',))
+
 
 ####################################################
 #
@@ -46,6 +54,8 @@ class GoogleCloudApi:
     ####################################################
     def translate(self, text: List[str], src_language: EosLanguage, dst_language: EosLanguage) -> List:
 
+        start_time = time.monotonic()
+
         try:
             client = translate.TranslationServiceClient()
 
@@ -60,8 +70,11 @@ class GoogleCloudApi:
         except exceptions.GoogleAPIError as err:
             error_str = "GoogleCloudApi::translate exception {}".format(err)
             Utils.logger_.error('GoogleCloudApi', error_str)
+            METRIC__TRANSLATE_RPC_FAILURES.labels('google').inc()
             return []
 
+        METRIC__TRANSLATE_RPC_SECONDS.labels('google').record(time.monotonic() - start_time)
+
         return response.translations
 
 
@@ -72,6 +85,7 @@ class GoogleCloudApi:
 ####################################################
 class GoogleCloudApiListener:
 
+    __session_id: str
     __prev_end_time: int
     __sentence: List[Any]
     __src_language: EosLanguage
@@ -82,7 +96,9 @@ class GoogleCloudApiListener:
     ####################################################
     #  __init__
     ####################################################
-    def __init__(self, src_language: EosLanguage, dst_languages: List[EosLanguage]):
+    def __init__(self, session_id: str, src_language: EosLanguage, dst_languages: List[EosLanguage]):
+
+        self.__session_id = session_id
 
         self.__prev_end_time = 0
         self.__sentence = []
@@ -204,7 +220,8 @@ class GoogleCloudApiListener:
             if dst_lang != self.__src_language:
                 self._handle_translation(self.__src_language, dst_lang, sentence)
 
-        self._break_sentence(self.__src_language, sentence)
+        with StageTimers().span(self.__session_id, 'sentence_break'):
+            self._break_sentence(self.__src_language, sentence)
 
     #################################
     # _break_sentence
@@ -296,7 +313,8 @@ class GoogleCloudApiListener:
                 self.__current_text += word.word
 
         #print("self.__current_text: ", self.__current_text)
-        translations = self.__google_api.translate([self.__current_text], self.__src_language, dst_language)
+        with StageTimers().span(self.__session_id, 'translate'):
+            translations = self.__google_api.translate([self.__current_text], self.__src_language, dst_language)
         #for translation in translations:
         #    print("translation: ", translation.translated_text[::-1])
 
@@ -322,7 +340,8 @@ class GoogleCloudApiListener:
                 new_word.end_time = self._time_to_word_time(current_time)
                 translated_sentence.append(new_word)
 
-            self._break_sentence(dst_language, translated_sentence)
+            with StageTimers().span(self.__session_id, 'sentence_break'):
+                self._break_sentence(dst_language, translated_sentence)
 
     #################################
     # _handle_text
@@ -373,15 +392,18 @@ class GoogleCloudApiListener:
 ####################################################
 class GoogleCloudStreamingGenerator:
 
+    session_id: str
     current_time: float
     start_time: float
     final_result_end_time: float
+    __sent_times: Deque[Tuple[float, float]]   # (current_time after the chunk, time.monotonic() when it was sent)
 
     #################################
     #  __init__
     #################################
-    def __init__(self, sample_rate: int):
+    def __init__(self, sample_rate: int, session_id: str):
         self.sample_rate = sample_rate
+        self.session_id = session_id
         self._queue = queue.Queue()
         self.closed = True
         self.current_time = 0.0
@@ -394,6 +416,8 @@ class GoogleCloudStreamingGenerator:
         self.__total_time_sent_to_stt_engine = float(0)
         self.__total_time_read_from_source = float(0)
 
+        self.__sent_times = deque()
+
         self.debug_in_file = "in.pcm"
         self.debug_out_file = "out"
         self.debug_out_file_index = 0
@@ -439,6 +463,20 @@ class GoogleCloudStreamingGenerator:
     def get_engine_time(self) -> float:
         return self.__total_time_sent_to_stt_engine
 
+    #################################
+    # result_latency
+    # seconds since the audio up to audio_time (ms) was sent to the engine
+    #################################
+    def result_latency(self, audio_time: float) -> Optional[float]:
+
+        while len(self.__sent_times) > 0:
+            sent_audio_time, sent_time = self.__sent_times[0]
+            if sent_audio_time >= audio_time:
+                return time.monotonic() - sent_time
+            self.__sent_times.popleft()
+
+        return None
+
     #################################
     # generator
     #################################
@@ -515,6 +553,12 @@ class GoogleCloudStreamingGenerator:
                         except queue.Empty:
                             break
 
+            self.__sent_times.append((self.current_time, time.monotonic()))
+            # results never refer to audio older than the streaming limit, drop it
+            # so a silent or stalled stream (no results) does not grow the deque
+            while self.__sent_times[0][0] < self.current_time - STREAMING_LIMIT:
+                self.__sent_times.popleft()
+
             yield b''.join(data)
 
 
@@ -699,6 +743,11 @@ class GoogleCloudStreamingTranscribe(threading.Thread):
                 stream.last_audio_input = stream.last_audio_input[int(offset):]
                 stream.final_result_end_time = new_final_result_end_time
 
+                result_latency = stream.result_latency(new_final_result_end_time)
+                if result_latency is not None:
+                    METRIC__STT_RESULT_SECONDS.labels('google').record(result_latency)
+                    StageTimers().record(stream.session_id, 'stt_result', result_latency)
+
                 Utils.logger_.debug_color('GoogleCloudStreamingTranscribe', "GoogleCloudStreamingTranscribe::_handle_responses stream.out_bytes={}, new len(stream.last_audio_input)={}, stream.final_result_end_time={}".format(stream.out_bytes, len(stream.last_audio_input), stream.final_result_end_time))
 
                 Utils.logger_.debug_color('GoogleCloudStreamingTranscribe', "GoogleCloudStreamingTranscribe::_handle_responses stream.current_time={}, stream.start_time={}".format(stream.current_time, stream.start_time))
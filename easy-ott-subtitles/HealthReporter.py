@@ -95,7 +95,7 @@ class HealthMonitor(threading.Thread, metaclass=Singleton):
 
         json_reply["threadpool_q_size"] = JobThreadPool().queue_length()
 
-        json_reply["execution_timers"] = ExecutionTimerManager().get_averages()
+        json_reply["execution_timers"] = ExecutionTimerManager().get_stats()
 
         json_reply["modules_last_heartbeat"] = {}
 
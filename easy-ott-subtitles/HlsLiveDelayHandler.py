@@ -8,6 +8,10 @@ import m3u8
 import Utils as Utils
 from CommonTypes import EosHttpConfig, EosFragment, EosUrl, LiveDelayListener
 from RequestWrapper import RequestWrapper
+from Metrics import MetricsRegistry
+
+# metrics
+METRIC__LIVE_POLLERS = MetricsRegistry().gauge('eos_live_pollers', 'Running live origin manifest pollers', ('protocol',))
 
 
 ####################################################
@@ -31,6 +35,7 @@ class HlsLiveDelayHandler(threading.Thread):
     __max_media_sequence: int
     __min_fragment_duration: float
     __listeners: List[Tuple[LiveDelayListener, str]]   # (LiveDelayListener, param)
+    __snapshot: Tuple[str, Tuple[EosFragment, ...]]   # (delayed manifest, delayed fragments), replaced by the poller
     __lock: threading.RLock
 
     ####################################################
@@ -45,7 +50,9 @@ class HlsLiveDelayHandler(threading.Thread):
         self.__live_origin_manifest_url = base64.urlsafe_b64decode(live_origin_manifest_url_base64).decode('utf-8')
         Utils.logger_.info(self.__session_id, "HlsLiveDelayHandler::__init__ live_origin_manifest_url={}".format(self.__live_origin_manifest_url))
 
-        self.__request_wrapper = RequestWrapper(self.__session_id, 'HlsLiveDelayHandler ' + self.__live_origin_manifest_url)
+        self.__request_wrapper = RequestWrapper(self.__session_id, 'HlsLiveDelayHandler ' + self.__live_origin_manifest_url, 'HlsLiveDelayHandler manifest')
+        # a failing origin keeps the last manifest, the delayed window stops moving until it recovers
+        self.__request_wrapper.fall_back_to_last_good_response()
 
         self.__m3u8 = None
 
@@ -63,6 +70,8 @@ class HlsLiveDelayHandler(threading.Thread):
 
         self.__listeners = []
 
+        self.__snapshot = ('', ())
+
         self.__lock = threading.RLock()
 
         threading.Thread.__init__(self)  # start thread
@@ -84,6 +93,8 @@ class HlsLiveDelayHandler(threading.Thread):
 
         Utils.logger_.system('HlsLiveDelayHandler', "HlsLiveDelayHandler::run thread started name={}".format(self.getName()))
 
+        METRIC__LIVE_POLLERS.labels('hls').inc()
+
         while self.__open is True:
 
             manifest = None
@@ -95,6 +106,8 @@ class HlsLiveDelayHandler(threading.Thread):
 
             manifest = response.text
 
+            new_fragments_found = False
+
             self.__lock.acquire()
 
             self.__m3u8 = m3u8.loads(manifest)
@@ -141,12 +154,15 @@ class HlsLiveDelayHandler(threading.Thread):
                     if segment_index == segments_len:
                         new_fragment.first_read = False
 
+                    # the delayed manifest always points to the origin
+                    segment.uri = new_fragment.url.absolute_url
+
                     self.__fragments.append((new_fragment, segment))
                     self.__time_in_fragments += segment.duration
                     self.__max_media_sequence = current_media_sequence
                     self.__current_time += segment.duration
                     self.__notify_listeners(new_fragment)
-                    # new_fragments_found = True
+                    new_fragments_found = True
 
             if self.__base_media_sequence == -1:
                 Utils.logger_.error(str(self.__session_id), "HlsLiveDelayHandler::run EXT-X-MEDIA-SEQUENCE not found")
@@ -157,17 +173,22 @@ class HlsLiveDelayHandler(threading.Thread):
                 self.__time_in_current_manifest = 60.0
 
             if self.__first_manifest_read is True:
-                Utils.logger_.debug_color(str(self.__session_id), "HlsLiveDelayHandler::run media_sequence={}".format(self.__base_media_sequence))
+                Utils.logger_.debug_color(str(self.__session_id), "HlsLiveDelayHandler::run media_sequence={}", self.__base_media_sequence)
                 self.__first_manifest_read = False
 
-            self.__lock.release()
-
-            Utils.logger_.debug('HlsLiveDelayHandler', "HlsLiveDelayHandler::run len(self.__fragments)={}, self.__time_in_fragments={}".format(len(self.__fragments), self.__time_in_fragments))
+            Utils.logger_.debug('HlsLiveDelayHandler', "HlsLiveDelayHandler::run len(self.__fragments)={}, self.__time_in_fragments={}", len(self.__fragments), self.__time_in_fragments)
             if self.__time_in_fragments > self.__delay_seconds + 2 * self.__time_in_current_manifest:
                 removed = self.__fragments.pop(0)
                 self.__time_in_fragments -= removed[0].duration
-                Utils.logger_.debug('HlsLiveDelayHandler', "HlsLiveDelayHandler::run removed segment media_sequence={} duration={}".format(removed[0].media_sequence, removed[0].duration))
+                new_fragments_found = True
+                Utils.logger_.debug('HlsLiveDelayHandler', "HlsLiveDelayHandler::run removed segment media_sequence={} duration={}", removed[0].media_sequence, removed[0].duration)
+
+            # the delayed window only moves when fragments are added or removed,
+            # so render it here once instead of on every player request
+            if new_fragments_found is True:
+                self.__snapshot = self.__render_delayed_manifest()
 
+            self.__lock.release()
 
             #if new_fragments_found is True:
             #    time.sleep(self.__min_fragment_duration * 0.8)
@@ -175,21 +196,37 @@ class HlsLiveDelayHandler(threading.Thread):
             #    time.sleep(self.__min_fragment_duration * 0.2)
             time.sleep(1)
 
+        METRIC__LIVE_POLLERS.labels('hls').dec()
+
         Utils.logger_.system('HlsLiveDelayHandler', "HlsLiveDelayHandler::run thread ending name={}".format(self.getName()))
 
+    ####################################################
+    #  retention_seconds
+    #  seconds of fragments the delayed window may still use
+    ####################################################
+    def retention_seconds(self) -> float:
+
+        return self.__delay_seconds + 2 * self.__time_in_current_manifest
+
     ####################################################
     #  delay
+    #  returns the last snapshot rendered by the poller
     ####################################################
-    def delay(self) -> Tuple[str, List[EosFragment]]:
+    def delay(self) -> Tuple[str, Tuple[EosFragment, ...]]:
+
+        return self.__snapshot
+
+    ####################################################
+    #  __render_delayed_manifest
+    #  called from the poller with the lock taken
+    ####################################################
+    def __render_delayed_manifest(self) -> Tuple[str, Tuple[EosFragment, ...]]:
 
         if self.__m3u8 is None:
-            return '', []
+            return '', ()
 
-        manifest = ''
         fragment_list: List[EosFragment] = []
 
-        self.__lock.acquire()
-
         start_index = 0
         end_index = -1
         if self.__time_in_fragments >= self.__delay_seconds + self.__time_in_current_manifest:
@@ -219,10 +256,6 @@ class HlsLiveDelayHandler(threading.Thread):
                 else:
                     break
 
-            #for i in range(start_index):
-            #    self.__fragments.pop(0)
-            #    self.__time_in_fragments -= fragment.duration
-
         if len(self.__fragments) > start_index:
             self.__m3u8.sequence_number = str(self.__fragments[start_index][0].media_sequence)
         else:
@@ -233,15 +266,10 @@ class HlsLiveDelayHandler(threading.Thread):
         if end_index > -1:
             for fragment in self.__fragments[start_index - 1:end_index]:
 
-                fragment[1].uri = fragment[0].url.absolute_url
                 self.__m3u8.segments.append(fragment[1])
                 fragment_list.append(fragment[0])
 
-        manifest = self.__m3u8.dumps()
-
-        self.__lock.release()
-
-        return manifest, fragment_list
+        return self.__m3u8.dumps(), tuple(fragment_list)
 
     ####################################################
     #  register_live_parser_listener
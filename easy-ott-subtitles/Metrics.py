@@ -0,0 +1,369 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from Singleton import Singleton
+from CommonTypes import LatencyHistogram
+
+
+####################################################
+#
+#  Counter
+#
+####################################################
+class Counter:
+    __value: float
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+        self.__value = 0.0
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  inc
+    ####################################################
+    def inc(self, amount: float = 1) -> None:
+        with self.__lock:
+            self.__value += amount
+
+    ####################################################
+    #  value
+    ####################################################
+    def value(self) -> float:
+        return self.__value
+
+
+####################################################
+#
+#  Gauge
+#
+####################################################
+class Gauge:
+    __value: float
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+        self.__value = 0.0
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  inc
+    ####################################################
+    def inc(self, amount: float = 1) -> None:
+        with self.__lock:
+            self.__value += amount
+
+    ####################################################
+    #  dec
+    ####################################################
+    def dec(self, amount: float = 1) -> None:
+        with self.__lock:
+            self.__value -= amount
+
+    ####################################################
+    #  set
+    ####################################################
+    def set(self, value: float) -> None:
+        self.__value = value
+
+    ####################################################
+    #  value
+    ####################################################
+    def value(self) -> float:
+        return self.__value
+
+
+####################################################
+#
+#  MetricFamily
+#
+#  One metric name with a child per label values tuple.
+#  Histogram children are LatencyHistograms, they are exported with
+#  one bucket per power of 2.
+#
+####################################################
+class MetricFamily:
+    name: str
+    help: str
+    type: str   # counter / gauge / histogram
+    label_names: Tuple[str, ...]
+    __children: Dict[Tuple[str, ...], Any]
+    __child_class: Callable
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, name: str, help: str, type: str, label_names: Tuple[str, ...], child_class: Callable) -> None:
+
+        self.name = name
+        self.help = help
+        self.type = type
+        self.label_names = label_names
+
+        self.__children = {}
+        self.__child_class = child_class
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  labels
+    ####################################################
+    def labels(self, *label_values: str) -> Any:
+
+        child = self.__children.get(label_values)
+        if child is None:
+            with self.__lock:
+                child = self.__children.setdefault(label_values, self.__child_class())
+
+        return child
+
+    ####################################################
+    #  children
+    ####################################################
+    def children(self) -> List[Tuple[Tuple[str, ...], Any]]:
+
+        with self.__lock:
+            return list(self.__children.items())
+
+
+####################################################
+#
+#  MetricsRegistry
+#
+#  Process wide metrics in the Prometheus text format (version 0.0.4).
+#  Values owned by other modules (queue lengths, session counts...) are
+#  registered as callbacks and read only when the metrics are scraped.
+#
+####################################################
+class MetricsRegistry(metaclass=Singleton):
+    __families: Dict[str, MetricFamily]
+    __callbacks: Dict[str, Tuple[str, str, Tuple[str, ...], Callable]]   # name -> (help, type, label_names, callback)
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__families = {}
+        self.__callbacks = {}
+
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  __family
+    ####################################################
+    def __family(self, name: str, help: str, type: str, label_names: Tuple[str, ...], child_class: Callable) -> MetricFamily:
+
+        with self.__lock:
+            if name not in self.__families:
+                self.__families[name] = MetricFamily(name, help, type, label_names, child_class)
+
+            return self.__families[name]
+
+    ####################################################
+    #  counter
+    ####################################################
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> MetricFamily:
+        return self.__family(name, help, 'counter', label_names, Counter)
+
+    ####################################################
+    #  gauge
+    ####################################################
+    def gauge(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> MetricFamily:
+        return self.__family(name, help, 'gauge', label_names, Gauge)
+
+    ####################################################
+    #  histogram
+    ####################################################
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> MetricFamily:
+        return self.__family(name, help, 'histogram', label_names, LatencyHistogram)
+
+    ####################################################
+    #  gauge_callback
+    #  callback returns a value, or { label values tuple: value }
+    ####################################################
+    def gauge_callback(self, name: str, help: str, callback: Callable[[], Union[float, Dict[Tuple[str, ...], float]]], label_names: Tuple[str, ...] = ()) -> None:
+
+        with self.__lock:
+            self.__callbacks[name] = (help, 'gauge', label_names, callback)
+
+    ####################################################
+    #  __labels_str
+    ####################################################
+    @staticmethod
+    def __labels_str(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+
+        labels = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                  for name, value in zip(label_names, label_values)]
+        if extra != '':
+            labels.append(extra)
+
+        if len(labels) == 0:
+            return ''
+
+        return '{' + ','.join(labels) + '}'
+
+    ####################################################
+    #  render
+    ####################################################
+    def render(self) -> str:
+
+        with self.__lock:
+            families = sorted(self.__families.values(), key=lambda family: family.name)
+            callbacks = sorted(self.__callbacks.items())
+
+        lines: List[str] = []
+
+        for family in families:
+
+            lines.append('# HELP {} {}'.format(family.name, family.help))
+            lines.append('# TYPE {} {}'.format(family.name, family.type))
+
+            for label_values, child in family.children():
+
+                if family.type != 'histogram':
+                    lines.append('{}{} {}'.format(family.name, self.__labels_str(family.label_names, label_values), child.value()))
+                    continue
+
+                counts, total = child.snapshot()
+                cumulative = 0
+                for index, count in enumerate(counts):
+                    cumulative += count
+                    if index % LatencyHistogram.BUCKETS_PER_OCTAVE == 0:
+                        le = 'le="{:.6g}"'.format(LatencyHistogram.bucket_upper_bound(index))
+                        lines.append('{}_bucket{} {}'.format(family.name, self.__labels_str(family.label_names, label_values, le), cumulative))
+                lines.append('{}_bucket{} {}'.format(family.name, self.__labels_str(family.label_names, label_values, 'le="+Inf"'), cumulative))
+                lines.append('{}_sum{} {}'.format(family.name, self.__labels_str(family.label_names, label_values), total))
+                lines.append('{}_count{} {}'.format(family.name, self.__labels_str(family.label_names, label_values), cumulative))
+
+        for name, (help, type, label_names, callback) in callbacks:
+
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, type))
+
+            values = callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+
+            for label_values, value in values.items():
+                lines.append('{}{} {}'.format(name, self.__labels_str(label_names, label_values), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+####################################################
+#
+#  StageSpan
+#
+#  Measures the wall clock duration of one pipeline stage, including time
+#  spent in subprocesses and on the network.
+#
+####################################################
+class StageSpan:
+    __stage_timers: 'StageTimers'
+    __session_id: str
+    __stage: str
+    __start_time: float
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, stage_timers: 'StageTimers', session_id: str, stage: str) -> None:
+
+        self.__stage_timers = stage_timers
+        self.__session_id = session_id
+        self.__stage = stage
+        self.__start_time = 0.0
+
+    ####################################################
+    #  __enter__
+    ####################################################
+    def __enter__(self) -> 'StageSpan':
+
+        self.__start_time = time.monotonic()
+        return self
+
+    ####################################################
+    #  __exit__
+    ####################################################
+    def __exit__(self, type, value, traceback) -> None:
+
+        self.__stage_timers.record(self.__session_id, self.__stage, time.monotonic() - self.__start_time)
+
+
+####################################################
+#
+#  StageTimers
+#
+#  Wall clock durations of the transcribe pipeline stages, aggregated
+#  globally (exported as a histogram) and per session.
+#
+####################################################
+class StageTimers(metaclass=Singleton):
+    __global: MetricFamily
+    __sessions: Dict[str, Dict[str, LatencyHistogram]]   # session id -> stage -> histogram
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__global = MetricsRegistry().histogram('eos_transcribe_stage_duration_seconds', 'Wall clock duration of the transcribe pipeline stages', ('stage',))
+        self.__sessions = {}
+
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  span
+    ####################################################
+    def span(self, session_id: str, stage: str) -> StageSpan:
+        return StageSpan(self, session_id, stage)
+
+    ####################################################
+    #  record
+    ####################################################
+    def record(self, session_id: str, stage: str, seconds: float) -> None:
+
+        self.__global.labels(stage).record(seconds)
+
+        with self.__lock:
+            stages = self.__sessions.setdefault(session_id, {})
+            histogram = stages.get(stage)
+            if histogram is None:
+                histogram = stages[stage] = LatencyHistogram()
+
+        histogram.record(seconds)
+
+    ####################################################
+    #  remove_session
+    ####################################################
+    def remove_session(self, session_id: str) -> None:
+
+        with self.__lock:
+            self.__sessions.pop(session_id, None)
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self.__lock:
+            sessions = {session_id: list(stages.items()) for session_id, stages in self.__sessions.items()}
+
+        stats: Dict[str, Any] = {'global': {}, 'sessions': {}}
+
+        for (stage,), histogram in self.__global.children():
+            stats['global'][stage] = histogram.get_stats()
+
+        for session_id, stages in sessions.items():
+            stats['sessions'][session_id] = {stage: histogram.get_stats() for stage, histogram in stages}
+
+        return stats
@@ -10,7 +10,7 @@ from typing import List, Optional, Dict, Any, Tuple
 import mpegdash.parser
 import m3u8
 #import webvtt
-from pycaption import WebVTTReader, WebVTTWriter, DFXPReader, DFXPWriter, CaptionSet, CaptionReadNoCaptions
+from pycaption import CaptionSet
 
 import Utils as Utils
 from GoogleCloudApi import GoogleCloudApi
@@ -18,7 +18,15 @@ from CommonTypes import EosNames, EosManifest, EosFragment, EosUrl, LiveDelayLis
 from HlsLiveDelayHandler import HlsLiveDelayHandler
 from DashLiveDelayHandler import DashLiveDelayHandler
 from Languages import EosLanguage
-from DashUtils import DashFragmentEncoder, DashFragmentParser
+from DashUtils import DashFragmentEncoder
+from ProcessPool import ProcessPool
+from WebVtt import WebVttNoCues
+from SubtitleStore import SubtitleSnapshot
+from Ttml import TtmlNoCues
+import SubtitleWorker as SubtitleWorker
+
+# config variables
+LIVE__REFERENCE_RETENTION_SECONDS = Utils.ConfigVariable('LIVE', 'REFERENCE_RETENTION_SECONDS', type=int, default_value=600, description='Min seconds of fragments kept in live reference manifests, at least the delay plus twice the manifest window is kept', mandatory=False)
 
 
 ####################################################
@@ -53,6 +61,9 @@ class OttProtocols(Enum):
 class OttHandler:
     _session_id: str
     _live: bool
+    _prev_captions_maps: Dict[str, Dict[str, str]]   # dst language -> source caption -> translation sent last time
+    _translate_locks: Dict[str, threading.Lock]      # dst language -> lock
+    _translate_locks_lock: threading.Lock
 
     #################################
     # __init__
@@ -61,8 +72,9 @@ class OttHandler:
 
         self._session_id = session_id
         self._live = live
-        self._prev_dst_language = None
-        self._prev_captions_map = {}
+        self._prev_captions_maps = {}
+        self._translate_locks = {}
+        self._translate_locks_lock = threading.Lock()
 
     #################################
     # close
@@ -124,10 +136,10 @@ class OttHandler:
     # generate_subtitle_fragment
     #################################
     def generate_subtitle_fragment(self, start_time: Optional[float], end_time: Optional[float],
-                                   subs: List[Dict[str, Any]],
-                                   first_pts: Optional[int], first_start_time: Optional[int]) -> str:
+                                   subs: SubtitleSnapshot,
+                                   first_pts: Optional[int], first_start_time: Optional[int]) -> bytes:
         Utils.logger_.error(self._session_id, "OttHandler::generate_subtitle_fragment virtual function called")
-        return ''
+        return b''
 
     #################################
     # register_live_parser_listener
@@ -138,9 +150,23 @@ class OttHandler:
 
     #################################
     # _translate_caption_set
+    # called from request threads and the prefetcher, translations to the
+    # same language are serialized as each one uses the captions map of the
+    # previous one
     #################################
     def _translate_caption_set(self, caption_set: CaptionSet, next_caption_set: CaptionSet, src_language: EosLanguage, dst_language: EosLanguage):
 
+        with self._translate_locks_lock:
+            translate_lock = self._translate_locks.setdefault(dst_language.code_bcp_47(), threading.Lock())
+
+        with translate_lock:
+            return self.__translate_caption_set(caption_set, next_caption_set, src_language, dst_language)
+
+    #################################
+    # __translate_caption_set
+    #################################
+    def __translate_caption_set(self, caption_set: CaptionSet, next_caption_set: CaptionSet, src_language: EosLanguage, dst_language: EosLanguage):
+
         languages = caption_set.get_languages()
         captions = caption_set.get_captions(languages[0])
 
@@ -155,8 +181,8 @@ class OttHandler:
 
         print("\n **************************")
 
-        prev_captions_map = copy.deepcopy(self._prev_captions_map)
-        self._prev_captions_map = {}
+        prev_captions_map = self._prev_captions_maps.get(dst_language.code_bcp_47())
+        captions_map = {}
         src_captions = copy.deepcopy(captions)
         src_next_captions = copy.deepcopy(next_captions)
 
@@ -292,7 +318,7 @@ class OttHandler:
 
                 print("translation: ", new_part_words)
 
-        if self._prev_dst_language == dst_language:
+        if prev_captions_map is not None:
             print("prev_captions_map: ", prev_captions_map)
             
             caption_index = 0
@@ -309,7 +335,7 @@ class OttHandler:
                                 print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$ fixed")
                                 captions[caption_index].nodes[src_caption_node_index].content = prev_captions_map[src_caption_node.content]
 
-                        self._prev_captions_map[src_caption_node.content] = captions[caption_index].nodes[src_caption_node_index].content
+                        captions_map[src_caption_node.content] = captions[caption_index].nodes[src_caption_node_index].content
                         print("insert 1: ", src_caption_node.content, ": ", captions[caption_index].nodes[src_caption_node_index].content)
 
                     src_caption_node_index += 1
@@ -325,14 +351,14 @@ class OttHandler:
                             if next_captions[caption_index].nodes[src_caption_node_index].content is None or next_captions[caption_index].nodes[src_caption_node_index].content == src_caption_node.content:
                                 continue
 
-                            self._prev_captions_map[src_caption_node.content] = next_captions[caption_index].nodes[src_caption_node_index].content
+                            captions_map[src_caption_node.content] = next_captions[caption_index].nodes[src_caption_node_index].content
                             print("insert 2: ", src_caption_node.content, ": ", next_captions[caption_index].nodes[src_caption_node_index].content)
                             
                         src_caption_node_index += 1
                     caption_index += 1
 
-        self._prev_dst_language = dst_language
-        
+        self._prev_captions_maps[dst_language.code_bcp_47()] = captions_map
+
         return caption_set
 
 
@@ -348,6 +374,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
     _audio_variants: List[EosManifest]
     _text_variants: List[EosManifest]
     _reference_manifests: Dict[str, EosManifest]   # dst_lang -> reference manifest
+    _reference_manifests_by_url: Dict[str, EosManifest]   # manifest.url.base64_urlsafe -> reference manifest
     _live_streams: Dict[str, HlsLiveDelayHandler]   # manifest.url.base64_urlsafe -> hls delay handler
 
     #################################
@@ -363,6 +390,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
         self._audio_variants = []
         self._text_variants = []
         self._reference_manifests = {}
+        self._reference_manifests_by_url = {}
         self._live_streams = {}
 
     #################################
@@ -648,6 +676,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
             new_text.manifest_params['URI'] = '\"{}/{}/{}/{}\"'.format(self.get_manifest_service_name(), dst_language.code_bcp_47(), matched_audio.url.base64_urlsafe, "index.m3u8")
 
             self._reference_manifests[dst_language.code_bcp_47()] = matched_audio
+            self._reference_manifests_by_url[matched_audio.url.base64_urlsafe] = matched_audio
 
             if self._live is True:
                 self._live_streams[matched_audio.url.base64_urlsafe].register_live_parser_listener(self, matched_audio.url.base64_urlsafe)
@@ -658,6 +687,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
             new_text.manifest_params['URI'] = '\"{}/{}/{}/{}\"'.format(self.get_manifest_service_name(), dst_language.code_bcp_47(), matched_video.url.base64_urlsafe, "index.m3u8")
 
             self._reference_manifests[dst_language.code_bcp_47()] = matched_video
+            self._reference_manifests_by_url[matched_video.url.base64_urlsafe] = matched_video
 
             if self._live is True:
                 self._live_streams[matched_video.url.base64_urlsafe].register_live_parser_listener(self, matched_video.url.base64_urlsafe)
@@ -700,7 +730,12 @@ class HlsHandler(OttHandler, LiveDelayListener):
 
         self._text_variants.append(new_text)
 
+        # the text stream's fragments are added to its reference manifest, once for all the languages cloned from it
+        if self._live is True and matched_text.url.base64_urlsafe not in self._reference_manifests_by_url:
+            self._live_streams[matched_text.url.base64_urlsafe].register_live_parser_listener(self, matched_text.url.base64_urlsafe)
+
         self._reference_manifests[dst_language.code_bcp_47()] = matched_text
+        self._reference_manifests_by_url[matched_text.url.base64_urlsafe] = matched_text
 
         Utils.logger_.info_y(self._session_id, "HlsHandler::clone_subtitle_stream matched_text={}".format(matched_text))
 
@@ -766,6 +801,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
         parsed_manifest = m3u8.loads(reference_manifest)
 
         start_time: float = 0.0
+        media_sequence: int = parsed_manifest.media_sequence if parsed_manifest.media_sequence is not None else 0
 
         for segment in parsed_manifest.segments:
             #print("segment:", segment)
@@ -774,7 +810,9 @@ class HlsHandler(OttHandler, LiveDelayListener):
             fragment.url.set_url(segment.uri, reference_manifest_url)
             fragment.duration = segment.duration
             fragment.start_time = start_time
+            fragment.media_sequence = media_sequence
             start_time += segment.duration
+            media_sequence += 1
 
             if segment.key is not None:
                 new_url = EosUrl()
@@ -788,7 +826,7 @@ class HlsHandler(OttHandler, LiveDelayListener):
             segment.uri = '{}/{}'.format(self.get_fragment_service_name(), fragment.url.base64_urlsafe)
 
             if self._live is False:
-                self._reference_manifests[dst_language].fragments.append(fragment)
+                self._reference_manifests[dst_language].add_fragment(fragment)
 
         cloned_manifest = parsed_manifest.dumps()
 
@@ -825,15 +863,17 @@ class HlsHandler(OttHandler, LiveDelayListener):
     #################################
     def on_new_fragment(self, fragment: EosFragment, param: str) -> None:
         # Utils.logger_.debug(self._session_id, "HlsHandler::on_new_fragment fragment={}".format(fragment))
-        for manifest in self._reference_manifests:
-            if self._reference_manifests[manifest].url.base64_urlsafe == param:
-                self._reference_manifests[manifest].fragments.append(fragment)
-                break
+        if param in self._reference_manifests_by_url:
+            reference_manifest = self._reference_manifests_by_url[param]
+            reference_manifest.add_fragment(fragment)
+            # the live delay is per language, keep every fragment the delayed window can still reach
+            retention_seconds = max(LIVE__REFERENCE_RETENTION_SECONDS.value(), self._live_streams[param].retention_seconds())
+            reference_manifest.trim(retention_seconds)
 
     #################################
     # get_live_manifest
     #################################
-    def get_live_manifest(self, live_origin_manifest_url_base64: str) -> Tuple[str, List[EosFragment]]:
+    def get_live_manifest(self, live_origin_manifest_url_base64: str) -> Tuple[str, Tuple[EosFragment, ...]]:
 
         # print(self._live_streams)
 
@@ -858,71 +898,57 @@ class HlsHandler(OttHandler, LiveDelayListener):
     #################################
     def get_start_stop_times(self, dst_lang: str, fragment_base64_uri: str):  # -> Optional[float], Optional[float]
 
-        for fragment in self._reference_manifests[dst_lang].fragments:
-
-            # print("get_start_stop_times fragment.url.base64_urlsafe={}, uri={}".format(fragment.url.base64_urlsafe, fragment_base64_uri))
+        fragment = self._reference_manifests[dst_lang].find_fragment(fragment_base64_uri)
+        if fragment is None:
+            return None, None
 
-            if fragment.url.base64_urlsafe == fragment_base64_uri:
-                start_time = fragment.start_time
-                end_time = fragment.start_time + fragment.duration
-                return start_time, end_time
-
-        return None, None
+        return fragment.start_time, fragment.start_time + fragment.duration
 
     #################################
     # generate_subtitle_fragment
     #################################
     def generate_subtitle_fragment(self, start_time: Optional[float], end_time: Optional[float],
-                                   subs: List[Dict[str, Any]],
-                                   first_pts: Optional[int], first_start_time: Optional[int]) -> str:
-
-        # TODO: use webvtt-py and pycaption
+                                   subs: SubtitleSnapshot,
+                                   first_pts: Optional[int], first_start_time: Optional[int]) -> bytes:
 
-        webvtt_fragment = ''
-        webvtt_fragment += 'WEBVTT\n'
+        header = b'WEBVTT\n'
 
         if self._live is True:
 
-            webvtt_fragment += 'X-TIMESTAMP-MAP=MPEGTS:' + str(first_pts) + ',LOCAL:' + Utils.seconds_to_webvtt_time(first_start_time) + '\n'
-            # webvtt_fragment += 'X-TIMESTAMP-MAP=MPEGTS:0,LOCAL:00:00:00.000\n'
+            header += ('X-TIMESTAMP-MAP=MPEGTS:' + str(first_pts) + ',LOCAL:' + Utils.seconds_to_webvtt_time(first_start_time) + '\n').encode('utf-8')
+            # header += b'X-TIMESTAMP-MAP=MPEGTS:0,LOCAL:00:00:00.000\n'
 
+        cues = []
         if start_time is not None and end_time is not None:
-            for sub in subs:
-                if (start_time >= sub['start'] and start_time < sub['end']) or \
-                   (end_time > sub['start'] and end_time <= sub['end']) or \
-                   (start_time <= sub['start'] and end_time >= sub['end']):
-
-                    webvtt_fragment += ('\n' + Utils.seconds_to_webvtt_time(sub['start']) + ' --> ' + Utils.seconds_to_webvtt_time(sub['end']) + '\n')
-                    webvtt_fragment += sub['text'] + '\n'
+            cues = [sub['webvtt'] for sub in subs.find(start_time, end_time)]
 
-        webvtt_fragment += '\n'
-
-        return webvtt_fragment
+        return b''.join((header, *cues, b'\n'))
 
     #################################
-    # get_next_fragment_uri
+    # render_cue
+    # WebVTT cue of a sub, rendered once when the sub is stored
     #################################
-    def get_next_fragment_uri(self, fragment_uri: str) -> Optional[str]:
-
-        # print("fragment_uri: ", fragment_uri)
+    @staticmethod
+    def render_cue(start_time_str: str, end_time_str: str, text: str) -> bytes:
 
-        next_fragment_uri = None
-        use_next_fragment = False
-        offset = -1
+        return ('\n' + start_time_str + ' --> ' + end_time_str + '\n' + text + '\n').encode('utf-8')
 
-        for fragment in self._fragments:
+    #################################
+    # get_next_fragment_url
+    #################################
+    def get_next_fragment_url(self, dst_lang: str, fragment_base64_uri: str) -> Optional[str]:
 
-            # print("fragment['URI']: ", fragment['URI'])
+        reference_manifest = self._reference_manifests[dst_lang]
 
-            if use_next_fragment is True:
-                next_fragment_uri = fragment_uri[:offset] + fragment['URI']
-                break
+        fragment = reference_manifest.find_fragment(fragment_base64_uri)
+        if fragment is None:
+            return None
 
-            offset = fragment_uri.find(fragment['URI'])
-            if offset != -1:
-                use_next_fragment = True
+        next_fragment = reference_manifest.fragments_by_media_sequence.get(fragment.media_sequence + 1)
+        if next_fragment is None or next_fragment.discontinuity is True:
+            return None
 
-        return next_fragment_uri
+        return next_fragment.url.absolute_url
 
     #################################
     # translate_subtitle_fragment
@@ -932,20 +958,18 @@ class HlsHandler(OttHandler, LiveDelayListener):
         # print("type(src_fragment): ", type(src_fragment))
         # print("src_fragment: ", src_fragment.decode('utf-8'))
 
-        # TODO: pycaption parse X-TIMESTAMP-MAP
-
         try:
-            caption_set = WebVTTReader().read(src_fragment.decode('utf-8'))
-        except CaptionReadNoCaptions:
-            Utils.logger_.error(self._session_id, "DashHandler::translate_subtitle_fragment error CaptionReadNoCaptions")
+            caption_set, next_caption_set = ProcessPool().run('webvtt_read', SubtitleWorker.read_webvtt_fragments, src_fragment, src_next_fragment)
+        except WebVttNoCues:
+            Utils.logger_.error(self._session_id, "HlsHandler::translate_subtitle_fragment error WebVttNoCues")
             return src_fragment
 
-        caption_set = self._translate_caption_set(caption_set, src_language, dst_language)
+        caption_set = self._translate_caption_set(caption_set, next_caption_set, src_language, dst_language)
 
-        modified_fragment = WebVTTWriter().write(caption_set)
+        modified_fragment = ProcessPool().run('webvtt_write', SubtitleWorker.write_webvtt, caption_set)
         # print("modified_fragment: ", modified_fragment)
 
-        return modified_fragment.encode('utf-8')
+        return modified_fragment
 
 
 ####################################################
@@ -954,6 +978,24 @@ class HlsHandler(OttHandler, LiveDelayListener):
 #
 ####################################################
 class DashHandler(OttHandler):
+
+    # static part of the generated TTML: head with styling and single region layout, body and div
+    __TTML_HEAD = ("<?xml version=\"1.0\" encoding=\"utf-8\"?>\r\n"
+                   "<tt xml:lang=\"\" xmlns=\"http://www.w3.org/ns/ttml\" xmlns:tt=\"http://www.w3.org/ns/ttml\" xmlns:tts=\"http://www.w3.org/ns/ttml#styling\">\r\n"
+                   "  <head>\r\n"
+                   "    <styling>\r\n"
+                   "      <style xml:id=\"s0\" tts:backgroundColor=\"rgba(0,0,0,192)\" tts:color=\"rgba(255,255,255,255)\" tts:fontSize=\"0.80c\" tts:fontFamily=\"proportionalSansSerif\" tts:textAlign=\"center\" tts:displayAlign=\"center\"/>\r\n"
+                   "    </styling>\r\n"
+                   "    <layout>\r\n"
+                   "      <region xml:id=\"r0\" tts:origin=\"2.84% 84.00%\" tts:extent=\"94.32% 16%\" />\r\n"
+                   "    </layout>\r\n"
+                   "  </head>\r\n"
+                   "  <body>\r\n"
+                   "    <div>\r\n").encode('utf-8')
+    __TTML_TAIL = ("    </div>\r\n"
+                   "  </body>\r\n"
+                   "</tt>").encode('utf-8')
+
     __variant_manifest_url: str
     __mpd: Optional[Any]
     #__mpd: Optional[ET.Element]
@@ -1245,7 +1287,7 @@ class DashHandler(OttHandler):
 
                         #print("new_fragment: ", new_fragment)
                         if self._live is False:
-                            ref_manifest.fragments.append(new_fragment)
+                            ref_manifest.add_fragment(new_fragment)
 
                         current_timestamp += int(duration)
                 break
@@ -1370,22 +1412,30 @@ class DashHandler(OttHandler):
 
         else:
 
-            live_manifest, fragemnt_list = self._live_stream.delay()
-            return live_manifest
+            return self.build_live_manifest().decode('utf-8')
+
+    #################################
+    # build_live_manifest
+    # returns the pre-serialized delayed mpd
+    #################################
+    def build_live_manifest(self) -> bytes:
+
+        live_manifest, fragemnt_list = self._live_stream.delay()
+        return live_manifest
 
     #################################
     # generate_init_fragment
     #################################
-    def generate_init_fragment(self) -> bytes:
+    def generate_init_fragment(self, dst_lang: Optional[EosLanguage]) -> bytes:
 
         dash_encoder = DashFragmentEncoder()
-        init_fragment = dash_encoder.build_subtitles_initialization(10000000)
+        init_fragment = dash_encoder.build_subtitles_initialization(10000000, dst_lang.code_639_2() if dst_lang is not None else 'und')
         return init_fragment
 
     #################################
     # pack_subtitle_fragment
     #################################
-    def pack_subtitle_fragment(self, start_time, end_time, subtitle_ttml) -> bytes:
+    def pack_subtitle_fragment(self, start_time, end_time, subtitle_ttml: bytes) -> bytes:
 
         dash_encoder = DashFragmentEncoder()
         subtitle_fragment = dash_encoder.build_subtitles_fragment(10000000, start_time, end_time, subtitle_ttml)
@@ -1395,77 +1445,40 @@ class DashHandler(OttHandler):
     # generate_subtitle_fragment
     #################################
     def generate_subtitle_fragment(self, start_time: Optional[float], end_time: Optional[float],
-                                   subs: List[Dict[str, Any]]) -> str:
-
-        # TODO: use pycaption
-
-        ttml_fragment = ''
-
-        ttml_fragment += "<?xml version=\"1.0\" encoding=\"utf-8\"?>\r\n"
-        ttml_fragment += "<tt xml:lang=\"\" xmlns=\"http://www.w3.org/ns/ttml\" xmlns:tt=\"http://www.w3.org/ns/ttml\" xmlns:tts=\"http://www.w3.org/ns/ttml#styling\">\r\n"
-
-        # head
-        ttml_fragment += "  <head>\r\n"
-
-        # styling
-        ttml_fragment += "    <styling>\r\n"
-        ttml_fragment += "      <style xml:id=\"s0\" tts:backgroundColor=\"rgba(0,0,0,192)\" tts:color=\"rgba(255,255,255,255)\" tts:fontSize=\"0.80c\" tts:fontFamily=\"proportionalSansSerif\" tts:textAlign=\"center\" tts:displayAlign=\"center\"/>\r\n"
-        ttml_fragment += "    </styling>\r\n"
-
-        # layout - single region
-        ttml_fragment += "    <layout>\r\n"
-        ttml_fragment += "      <region xml:id=\"r0\" tts:origin=\"2.84% 84.00%\" tts:extent=\"94.32% 16%\" />\r\n"
-        ttml_fragment += "    </layout>\r\n"
-
-        ttml_fragment += "  </head>\r\n"
+                                   subs: SubtitleSnapshot) -> bytes:
 
-        # body
-        ttml_fragment += "  <body>\r\n"
-        ttml_fragment += "    <div>\r\n"
+        cues = []
 
         if start_time is not None and end_time is not None:
 
             presentation_time_offset_sec = 0#self._live_stream.get_presentation_time_offset()
             presentation_time_offset = presentation_time_offset_sec * 10000000
-            Utils.logger_.debug(self._session_id, "DashHandler::generate_subtitle_fragment presentation_time_offset={}".format(presentation_time_offset))
+            Utils.logger_.debug(self._session_id, "DashHandler::generate_subtitle_fragment presentation_time_offset={}", presentation_time_offset)
 
             actual_start_time = int((start_time - presentation_time_offset) / 10000000)
             actual_end_time = int((end_time - presentation_time_offset) / 10000000)
 
-            Utils.logger_.info(self._session_id, "DashHandler::generate_subtitle_fragment actual_start_time={}, actual_end_time={}".format(actual_start_time, actual_end_time))
+            Utils.logger_.info(self._session_id, "DashHandler::generate_subtitle_fragment actual_start_time={}, actual_end_time={}", actual_start_time, actual_end_time)
 
-            for sub in subs:
-                if (actual_start_time >= sub['start'] and actual_start_time < sub['end']) or \
-                   (actual_end_time > sub['start'] and actual_end_time <= sub['end']) or \
-                   (actual_start_time <= sub['start'] and actual_end_time >= sub['end']):
+            # presentation_time_offset_sec is 0, the cues rendered by the writer are used as is
+            cues = [sub['ttml'] for sub in subs.find(actual_start_time, actual_end_time)]
 
-                    #print(Utils.seconds_to_webvtt_time(presentation_time_offset_sec + sub['start']))
-                    #print(Utils.seconds_to_webvtt_time(presentation_time_offset_sec + sub['end']))
-                    #print(sub['text'])
-                    #webvtt_fragment += ('\n' + Utils.seconds_to_webvtt_time(sub['start']) + ' --> ' + Utils.seconds_to_webvtt_time(sub['end']) + '\n')
-                    #webvtt_fragment += sub['text'] + '\n'
+        return b''.join((self.__TTML_HEAD, *cues, self.__TTML_TAIL))
 
-                    start_time_str = Utils.seconds_to_webvtt_time(presentation_time_offset_sec + sub['start'])
-                    end_time_str = Utils.seconds_to_webvtt_time(presentation_time_offset_sec + sub['end'])
-
-                    ttml_fragment += "      <p  region=\"r0\" style=\"s0\" begin=\"" + start_time_str + "\" end=\"" + end_time_str + "\" >"  #<span>"
-
-                    ttml_string = sub['text']
-                    ttml_string = ttml_string.replace('<', '')
-                    ttml_string = ttml_string.replace('>', '')
-                    ttml_string = ttml_string.replace('\n', '<br/>')
-
-                    ttml_fragment += ttml_string
-
-                    #</span>
-                    ttml_fragment += "</p>\r\n"
+    #################################
+    # render_cue
+    # TTML <p> of a sub, rendered once when the sub is stored
+    #################################
+    @staticmethod
+    def render_cue(start_time_str: str, end_time_str: str, text: str) -> bytes:
 
-        # closing tags
-        ttml_fragment += "    </div>\r\n"  # /div
-        ttml_fragment += "  </body>\r\n"  # /body
-        ttml_fragment += "</tt>"  # /tt
+        ttml_string = text
+        ttml_string = ttml_string.replace('&', '&amp;')
+        ttml_string = ttml_string.replace('<', '')
+        ttml_string = ttml_string.replace('>', '')
+        ttml_string = ttml_string.replace('\n', '<br/>')
 
-        return ttml_fragment
+        return ("      <p  region=\"r0\" style=\"s0\" begin=\"" + start_time_str + "\" end=\"" + end_time_str + "\" >" + ttml_string + "</p>\r\n").encode('utf-8')
 
     #################################
     # get_reference_manifest_url
@@ -1487,37 +1500,16 @@ class DashHandler(OttHandler):
         # print("type(src_fragment): ", type(src_fragment))
         # print("src_fragment: ", src_fragment.decode('utf-8'))
 
-        dash_parser = DashFragmentParser(src_fragment)
-        ttml = dash_parser.read_ttml()
-
-        next_ttml = None
-        if src_next_fragment is not None:
-            next_dash_parser = DashFragmentParser(src_next_fragment)
-            next_ttml = next_dash_parser.read_ttml()
-
-        # print("ttml: ", ttml.decode('utf-8'))
-
         try:
-            caption_set = DFXPReader().read(ttml.decode('utf-8'))
-        except CaptionReadNoCaptions:
-            Utils.logger_.error(self._session_id, "DashHandler::translate_subtitle_fragment error CaptionReadNoCaptions")
+            caption_set, next_caption_set = ProcessPool().run('dash_read', SubtitleWorker.read_dash_fragments, src_fragment, src_next_fragment)
+        except TtmlNoCues:
+            Utils.logger_.error(self._session_id, "DashHandler::translate_subtitle_fragment error TtmlNoCues")
             return src_fragment
-        
-        next_caption_set = None
-        if next_ttml is not None:
-            try:
-                next_caption_set = DFXPReader().read(next_ttml.decode('utf-8'))
-            except CaptionReadNoCaptions:
-                Utils.logger_.error(self._session_id, "DashHandler::translate_subtitle_fragment error CaptionReadNoCaptions")
-                next_caption_set = None
-
-        Utils.logger_.debug_color(self._session_id, "DashHandler::translate_subtitle_fragment original caption_set={}".format(caption_set._captions))
+
+        Utils.logger_.debug_color(self._session_id, "DashHandler::translate_subtitle_fragment original caption_set={}", caption_set)
         caption_set = self._translate_caption_set(caption_set, next_caption_set, src_language, dst_language)
-        Utils.logger_.debug_color(self._session_id, "DashHandler::translate_subtitle_fragment translated caption_set={}".format(caption_set._captions))
+        Utils.logger_.debug_color(self._session_id, "DashHandler::translate_subtitle_fragment translated caption_set={}", caption_set)
         
-        modified_ttml = DFXPWriter().write(caption_set)
-        # print("modified_ttml: ", modified_ttml)
-
-        modified_fragment = dash_parser.update_ttml(modified_ttml.encode('utf-8'))
+        modified_fragment = ProcessPool().run('dash_write', SubtitleWorker.write_dash_fragment, src_fragment, caption_set)
 
         return modified_fragment
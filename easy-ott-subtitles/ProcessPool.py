@@ -0,0 +1,63 @@
+import time
+import multiprocessing
+import concurrent.futures
+from typing import Any, Callable, Optional
+
+import Utils as Utils
+from Singleton import Singleton
+from Metrics import MetricsRegistry
+
+# config variables
+PROCESS_POOL__NUMBER_OF_PROCESSES = Utils.ConfigVariable('PROCESS_POOL', 'NUMBER_OF_PROCESSES', type=int, default_value=0, description='Number of worker processes for CPU bound subtitle work, 0 runs it on the calling thread', mandatory=False)
+
+# metrics
+METRIC__TASK_SECONDS = MetricsRegistry().histogram('eos_process_pool_task_duration_seconds', 'Time spent waiting for CPU bound subtitle tasks', ('task', 'where'))
+
+
+####################################################
+#
+#  ProcessPool
+#
+#  Runs CPU bound functions (see SubtitleWorker) on worker processes, so
+#  they don't hold the GIL of the request threads.
+#  Workers are started from a forkserver, forking the threaded server
+#  process itself is not safe.
+#
+####################################################
+class ProcessPool(metaclass=Singleton):
+    __executor: Optional[concurrent.futures.ProcessPoolExecutor]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__executor = None
+
+        number_of_processes = PROCESS_POOL__NUMBER_OF_PROCESSES.value()
+        if number_of_processes > 0:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['SubtitleWorker'])
+            self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=number_of_processes, mp_context=context)
+
+        Utils.logger_.system('ProcessPool', "ProcessPool::__init__ number_of_processes={}", number_of_processes)
+
+    ####################################################
+    #  run
+    #  the calling thread only waits on the result, exceptions of function are raised here
+    ####################################################
+    def run(self, task_name: str, function: Callable, *args: Any) -> Any:
+
+        start_time = time.monotonic()
+
+        if self.__executor is None:
+            try:
+                return function(*args)
+            finally:
+                METRIC__TASK_SECONDS.labels(task_name, 'thread').record(time.monotonic() - start_time)
+
+        try:
+            return self.__executor.submit(function, *args).result()
+        finally:
+            METRIC__TASK_SECONDS.labels(task_name, 'process').record(time.monotonic() - start_time)
+
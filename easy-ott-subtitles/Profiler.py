@@ -0,0 +1,373 @@
+import os
+import sys
+import time
+import threading
+import traceback
+import linecache
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+import Utils as Utils
+from Singleton import Singleton
+
+# config variables
+ADMIN__TOKEN = Utils.ConfigVariable('ADMIN', 'TOKEN', type=str, default_value='', description='Token of the admin routes, admin routes are disabled when empty', mandatory=False)
+ADMIN__PROFILE_MAX_SECONDS = Utils.ConfigVariable('ADMIN', 'PROFILE_MAX_SECONDS', type=int, default_value=300, description='Max duration of a profiling session', mandatory=False)
+ADMIN__TRACEMALLOC_FRAMES = Utils.ConfigVariable('ADMIN', 'TRACEMALLOC_FRAMES', type=int, default_value=10, description='Number of frames stored in tracemalloc tracebacks', mandatory=False)
+APP__TMP_FILES_PATH = Utils.ConfigVariable('APP', 'TMP_FILES_PATH', type=str, default_value='temp', description='Path to temporary files directory', mandatory=True)
+
+
+####################################################
+#
+#  SamplingProfiler
+#
+#  Samples the stacks of all threads every interval seconds. Unlike
+#  cProfile it sees every thread of the process and its overhead does not
+#  depend on the number of function calls, so it can run on a live node.
+#
+####################################################
+class SamplingProfiler(threading.Thread):
+
+    MIN_INTERVAL: float = 0.001
+
+    __seconds: float
+    __interval: float
+    __stop_event: threading.Event
+    __stacks: Counter   # (thread name, frame, frame...) root first -> samples
+    __num_samples: int
+    __stacks_lock: threading.Lock
+    __start_time: float
+    __end_time: float
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, seconds: float, interval: float) -> None:
+
+        self.__seconds = seconds
+        self.__interval = interval
+        self.__stop_event = threading.Event()
+        self.__stacks = Counter()
+        self.__num_samples = 0
+        self.__stacks_lock = threading.Lock()
+        self.__start_time = 0.0
+        self.__end_time = 0.0
+
+        threading.Thread.__init__(self, name='SamplingProfiler', daemon=True)
+
+    ####################################################
+    #  run
+    #  called from thread context when start() is called
+    ####################################################
+    def run(self) -> None:
+
+        Utils.logger_.system('SamplingProfiler', "SamplingProfiler::run started seconds={}, interval={}".format(self.__seconds, self.__interval))
+
+        self.__start_time = time.monotonic()
+        end_time = self.__start_time + self.__seconds
+
+        while self.__stop_event.wait(self.__interval) is False and time.monotonic() < end_time:
+            self.__sample()
+
+        self.__end_time = time.monotonic()
+
+        Utils.logger_.system('SamplingProfiler', "SamplingProfiler::run ended samples={}".format(self.__num_samples))
+
+    ####################################################
+    #  __sample
+    ####################################################
+    def __sample(self) -> None:
+
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+
+            if thread_id == self.ident:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+
+            stacks.append(tuple(reversed(stack)))
+
+        with self.__stacks_lock:
+            self.__stacks.update(stacks)
+            self.__num_samples += 1
+
+    ####################################################
+    #  stop
+    ####################################################
+    def stop(self) -> None:
+        self.__stop_event.set()
+
+    ####################################################
+    #  __copy_stacks
+    #  reports read a copy, the sampler keeps adding to __stacks
+    ####################################################
+    def __copy_stacks(self):  # -> Counter, int
+
+        with self.__stacks_lock:
+            return Counter(self.__stacks), self.__num_samples
+
+    ####################################################
+    #  get_status
+    ####################################################
+    def get_status(self) -> Dict[str, Any]:
+
+        end_time = self.__end_time if self.__end_time > 0 else time.monotonic()
+
+        return {'running': self.is_alive(),
+                'seconds': round(end_time - self.__start_time, 3) if self.__start_time > 0 else 0.0,
+                'samples': self.__num_samples}
+
+    ####################################################
+    #  collapsed
+    #  one "frame;frame;frame count" line per stack, the input of flamegraph.pl / speedscope
+    ####################################################
+    def collapsed(self) -> str:
+
+        stacks, _ = self.__copy_stacks()
+
+        return ''.join('{} {}\n'.format(';'.join(stack), count) for stack, count in stacks.most_common())
+
+    ####################################################
+    #  top
+    #  functions by own (self) and total (cumulative) samples
+    ####################################################
+    def top(self, limit: int) -> str:
+
+        stacks, num_samples = self.__copy_stacks()
+
+        self_samples = Counter()
+        total_samples = Counter()
+
+        for stack, count in stacks.items():
+            frames = stack[1:]
+            if len(frames) == 0:
+                continue
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+
+        lines = ['{} samples every {}s, {} stacks'.format(num_samples, self.__interval, len(stacks)),
+                 '',
+                 '{:>8} {:>8} {:>8} {:>8}  {}'.format('self', 'self%', 'total', 'total%', 'function')]
+
+        num_samples = max(num_samples, 1)
+        for frame, count in total_samples.most_common(limit):
+            lines.append('{:>8} {:>7.1f}% {:>8} {:>7.1f}%  {}'.format(self_samples[frame], 100.0 * self_samples[frame] / num_samples,
+                                                                     count, 100.0 * count / num_samples, frame))
+
+        return '\n'.join(lines) + '\n'
+
+
+####################################################
+#
+#  Profiler
+#
+#  Backs the admin routes: sampling profiles, tracemalloc snapshots and
+#  thread stacks of a running process. Reports are returned as text and
+#  written to TMP_FILES_PATH.
+#
+####################################################
+class Profiler(metaclass=Singleton):
+    __lock: threading.Lock
+    __sampling_profiler: Optional[SamplingProfiler]
+    __prev_snapshot: Optional[tracemalloc.Snapshot]
+    __current_snapshot: Optional[tracemalloc.Snapshot]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__lock = threading.Lock()
+
+        self.__sampling_profiler = None
+
+        self.__prev_snapshot = None
+        self.__current_snapshot = None
+
+    ####################################################
+    #  __write_report
+    ####################################################
+    @staticmethod
+    def __write_report(name: str, report: str) -> None:
+
+        file_name = APP__TMP_FILES_PATH.value() + '/eos-{}-{}-{}'.format(os.getpid(), time.strftime('%Y%m%d-%H%M%S'), name)
+
+        try:
+            with open(file_name, 'w') as report_file:
+                report_file.write(report)
+        except OSError:
+            Utils.logger_.error('Profiler', "Profiler::__write_report error writing {}".format(file_name))
+            return
+
+        Utils.logger_.info('Profiler', "Profiler::__write_report report written to {}".format(file_name))
+
+    ####################################################
+    #  start_profile
+    ####################################################
+    def start_profile(self, seconds: float, interval: float) -> Tuple[bool, Dict[str, Any]]:
+
+        seconds = min(seconds, ADMIN__PROFILE_MAX_SECONDS.value())
+        interval = max(interval, SamplingProfiler.MIN_INTERVAL)
+
+        with self.__lock:
+            if self.__sampling_profiler is not None and self.__sampling_profiler.is_alive():
+                return False, self.__sampling_profiler.get_status()
+
+            self.__sampling_profiler = SamplingProfiler(seconds, interval)
+            self.__sampling_profiler.start()
+
+            return True, self.__sampling_profiler.get_status()
+
+    ####################################################
+    #  stop_profile
+    ####################################################
+    def stop_profile(self) -> Optional[Dict[str, Any]]:
+
+        with self.__lock:
+            sampling_profiler = self.__sampling_profiler
+
+        if sampling_profiler is None:
+            return None
+
+        sampling_profiler.stop()
+        sampling_profiler.join()
+
+        return sampling_profiler.get_status()
+
+    ####################################################
+    #  get_profile
+    #  format: 'top' or 'collapsed'
+    ####################################################
+    def get_profile(self, format: str, limit: int) -> Optional[str]:
+
+        with self.__lock:
+            sampling_profiler = self.__sampling_profiler
+
+        if sampling_profiler is None:
+            return None
+
+        if format == 'collapsed':
+            report = sampling_profiler.collapsed()
+        else:
+            report = sampling_profiler.top(limit)
+
+        if sampling_profiler.is_alive() is False:
+            self.__write_report('profile-{}.txt'.format(format), report)
+
+        return report
+
+    ####################################################
+    #  get_profile_status
+    ####################################################
+    def get_profile_status(self) -> Optional[Dict[str, Any]]:
+
+        with self.__lock:
+            if self.__sampling_profiler is None:
+                return None
+            return self.__sampling_profiler.get_status()
+
+    ####################################################
+    #  take_snapshot
+    #  starts tracing on the first call
+    ####################################################
+    def take_snapshot(self, limit: int) -> str:
+
+        with self.__lock:
+            if tracemalloc.is_tracing() is False:
+                tracemalloc.start(ADMIN__TRACEMALLOC_FRAMES.value())
+                Utils.logger_.info('Profiler', "Profiler::take_snapshot tracemalloc started")
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                                                  tracemalloc.Filter(False, "<unknown>"),
+                                                                  tracemalloc.Filter(False, tracemalloc.__file__)))
+
+            self.__prev_snapshot = self.__current_snapshot
+            self.__current_snapshot = snapshot
+
+        top_stats = snapshot.statistics('lineno')
+
+        trace_size, trace_peak = tracemalloc.get_traced_memory()
+        lines = ['traced size={:.1f} KiB, peak={:.1f} KiB'.format(trace_size / 1024, trace_peak / 1024),
+                 '',
+                 'Top {} lines'.format(limit)]
+
+        for index, stat in enumerate(top_stats[:limit], 1):
+            frame = stat.traceback[0]
+            lines.append('#{}: {}:{}: {:.1f} KiB'.format(index, frame.filename, frame.lineno, stat.size / 1024))
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            if line:
+                lines.append('    {}'.format(line))
+
+        other = top_stats[limit:]
+        if other:
+            lines.append('{} other: {:.1f} KiB'.format(len(other), sum(stat.size for stat in other) / 1024))
+        lines.append('Total allocated size: {:.1f} KiB'.format(sum(stat.size for stat in top_stats) / 1024))
+
+        report = '\n'.join(lines) + '\n'
+        self.__write_report('tracemalloc-snapshot.txt', report)
+
+        return report
+
+    ####################################################
+    #  diff_snapshots
+    #  difference between the last two snapshots
+    ####################################################
+    def diff_snapshots(self, limit: int) -> Optional[str]:
+
+        with self.__lock:
+            prev_snapshot = self.__prev_snapshot
+            current_snapshot = self.__current_snapshot
+
+        if prev_snapshot is None or current_snapshot is None:
+            return None
+
+        top_stats = current_snapshot.compare_to(prev_snapshot, 'traceback')
+
+        lines = ['[ Top {} differences ]'.format(limit)]
+        for stat in top_stats[:limit]:
+            lines.append(str(stat))
+            lines.extend('    ' + line for line in stat.traceback.format())
+
+        report = '\n'.join(lines) + '\n'
+        self.__write_report('tracemalloc-diff.txt', report)
+
+        return report
+
+    ####################################################
+    #  stop_tracing
+    ####################################################
+    def stop_tracing(self) -> None:
+
+        with self.__lock:
+            tracemalloc.stop()
+            self.__prev_snapshot = None
+            self.__current_snapshot = None
+
+        Utils.logger_.info('Profiler', "Profiler::stop_tracing tracemalloc stopped")
+
+    ####################################################
+    #  dump_threads
+    ####################################################
+    @staticmethod
+    def dump_threads() -> str:
+
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+
+        lines = []
+        for thread_id, frame in sys._current_frames().items():
+            thread = threads.get(thread_id)
+            lines.append('Thread {} ({}{}):'.format(thread.name if thread is not None else '?', thread_id, ', daemon' if thread is not None and thread.daemon else ''))
+            lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+            lines.append('')
+
+        return '\n'.join(lines) + '\n'
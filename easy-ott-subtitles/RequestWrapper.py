@@ -1,11 +1,362 @@
 import requests
 import datetime
+import time
 import threading
-from typing import Dict, Any
+import concurrent.futures
+from enum import Enum
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Callable, Optional, Tuple
+
+import cachetools
 
 import Utils as Utils
 from Singleton import Singleton
 from CommonTypes import EosHttpConfig
+from Metrics import MetricsRegistry
+
+# config variables
+HTTP_CLIENT__MAX_CONNECTIONS_PER_HOST = Utils.ConfigVariable('HTTP_CLIENT', 'MAX_CONNECTIONS_PER_HOST', type=int, default_value=10, description='Max number of open connections to each origin host', mandatory=False)
+HTTP_CLIENT__MAX_HOSTS = Utils.ConfigVariable('HTTP_CLIENT', 'MAX_HOSTS', type=int, default_value=50, description='Max number of origin hosts with pooled connections', mandatory=False)
+HTTP_CLIENT__MAX_RETRIES = Utils.ConfigVariable('HTTP_CLIENT', 'MAX_RETRIES', type=int, default_value=3, description='Max number of connection retries for origin requests', mandatory=False)
+HTTP_CLIENT__MIN_TIMEOUT = Utils.ConfigVariable('HTTP_CLIENT', 'MIN_TIMEOUT', type=float, default_value=1.0, description='Min seconds to wait for an origin host', mandatory=False)
+HTTP_CLIENT__MAX_TIMEOUT = Utils.ConfigVariable('HTTP_CLIENT', 'MAX_TIMEOUT', type=float, default_value=3.05, description='Max seconds to wait for an origin host', mandatory=False)
+HTTP_CLIENT__CIRCUIT_FAILURES = Utils.ConfigVariable('HTTP_CLIENT', 'CIRCUIT_FAILURES', type=int, default_value=5, description='Consecutive failures before requests to an origin host fail fast', mandatory=False)
+HTTP_CLIENT__CIRCUIT_OPEN_SECONDS = Utils.ConfigVariable('HTTP_CLIENT', 'CIRCUIT_OPEN_SECONDS', type=float, default_value=10.0, description='Seconds to fail fast before probing an origin host again', mandatory=False)
+FRAGMENT_CACHE__MAX_SIZE_MB = Utils.ConfigVariable('FRAGMENT_CACHE', 'MAX_SIZE_MB', type=int, default_value=256, description='Max size of origin fragments kept in memory (0 to disable the cache)', mandatory=False)
+FRAGMENT_CACHE__LIVE_TTL = Utils.ConfigVariable('FRAGMENT_CACHE', 'LIVE_TTL', type=int, default_value=60, description='Seconds to keep a live origin fragment', mandatory=False)
+FRAGMENT_CACHE__VOD_TTL = Utils.ConfigVariable('FRAGMENT_CACHE', 'VOD_TTL', type=int, default_value=3600, description='Seconds to keep a VoD origin fragment', mandatory=False)
+HTTP_CLIENT__MAX_ASYNC_REQUESTS = Utils.ConfigVariable('HTTP_CLIENT', 'MAX_ASYNC_REQUESTS', type=int, default_value=16, description='Max number of origin requests running in the background at once', mandatory=False)
+
+# metrics
+METRIC__ORIGIN_REQUEST_SECONDS = MetricsRegistry().histogram('eos_origin_request_duration_seconds', 'Successful origin requests latency', ('host', 'type'))
+METRIC__ORIGIN_REQUEST_FAILURES = MetricsRegistry().counter('eos_origin_request_failures_total', 'Failed origin requests', ('type', 'failure'))
+METRIC__CACHE_REQUESTS = MetricsRegistry().counter('eos_cache_requests_total', 'Cache lookups', ('cache', 'result'))
+
+
+####################################################
+#
+#  HttpClient
+#
+#  One keep-alive connection pool for all origin requests.
+#  Connections are reused per host, and each host keeps up to
+#  HTTP_CLIENT__MAX_CONNECTIONS_PER_HOST sockets open. When they are all busy
+#  an extra connection is opened and closed after use, so callers never wait
+#  for the pool (requests passes no pool timeout, a blocking pool waits forever).
+#  Only failed connections are retried, a read timeout is reported at once
+#  so the origin host health sees it.
+#  Background requests run on a small shared executor.
+#
+####################################################
+class HttpClient(metaclass=Singleton):
+
+    __request_session: requests.Session
+    __executor: concurrent.futures.ThreadPoolExecutor
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__request_session = requests.Session()
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_CLIENT__MAX_HOSTS.value(),
+                                                pool_maxsize=HTTP_CLIENT__MAX_CONNECTIONS_PER_HOST.value(),
+                                                max_retries=Retry(total=HTTP_CLIENT__MAX_RETRIES.value(), read=0))
+        self.__request_session.mount("https://", adapter)
+        self.__request_session.mount("http://", adapter)
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_CLIENT__MAX_ASYNC_REQUESTS.value(), thread_name_prefix='http')
+
+    ####################################################
+    #  get
+    ####################################################
+    def get(self, url: str, headers: Dict[str, str], timeout: float) -> requests.Response:
+        return self.__request_session.get(url, timeout=timeout, headers=headers)
+
+    ####################################################
+    #  submit
+    ####################################################
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        return self.__executor.submit(fn, *args)
+
+
+####################################################
+#
+#  CircuitStates
+#
+####################################################
+class CircuitStates(Enum):
+    CLOSED = 1     # requests go to the origin host
+    OPEN = 2       # requests fail fast
+    HALF_OPEN = 3  # one probe request goes to the origin host
+
+
+####################################################
+#
+#  OriginHostHealth
+#
+#  Smoothed latency (EWMA) and circuit breaker of one origin host.
+#  The timeout follows the latency like TCP RTO: srtt + 4 * rttvar.
+#
+####################################################
+class OriginHostHealth:
+
+    __host: str
+    __min_timeout: float
+    __max_timeout: float
+    __max_failures: int
+    __open_seconds: float
+    __srtt: Optional[float]
+    __rttvar: float
+    __consecutive_failures: int
+    __state: CircuitStates
+    __opened_time: float
+    __probe_in_flight: bool
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, host: str) -> None:
+
+        self.__host = host
+
+        self.__min_timeout = HTTP_CLIENT__MIN_TIMEOUT.value()
+        self.__max_timeout = HTTP_CLIENT__MAX_TIMEOUT.value()
+        self.__max_failures = HTTP_CLIENT__CIRCUIT_FAILURES.value()
+        self.__open_seconds = HTTP_CLIENT__CIRCUIT_OPEN_SECONDS.value()
+
+        self.__srtt = None
+        self.__rttvar = 0.0
+
+        self.__consecutive_failures = 0
+        self.__state = CircuitStates.CLOSED
+        self.__opened_time = 0.0
+        self.__probe_in_flight = False
+
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  timeout
+    ####################################################
+    def timeout(self) -> float:
+
+        with self.__lock:
+            if self.__srtt is None:
+                return self.__max_timeout
+
+            return min(max(self.__srtt + 4 * self.__rttvar, self.__min_timeout), self.__max_timeout)
+
+    ####################################################
+    #  allow_request
+    ####################################################
+    def allow_request(self) -> bool:
+
+        with self.__lock:
+            if self.__state is CircuitStates.CLOSED:
+                return True
+
+            if self.__state is CircuitStates.OPEN:
+                if time.monotonic() - self.__opened_time < self.__open_seconds:
+                    return False
+                self.__state = CircuitStates.HALF_OPEN
+                self.__probe_in_flight = False
+
+            # half open, only one request probes the origin host
+            if self.__probe_in_flight is True:
+                return False
+
+            self.__probe_in_flight = True
+            return True
+
+    ####################################################
+    #  on_success
+    ####################################################
+    def on_success(self, latency: float) -> None:
+
+        with self.__lock:
+            if self.__srtt is None:
+                self.__srtt = latency
+                self.__rttvar = latency / 2
+            else:
+                self.__rttvar = 0.75 * self.__rttvar + 0.25 * abs(self.__srtt - latency)
+                self.__srtt = 0.875 * self.__srtt + 0.125 * latency
+
+            if self.__state is not CircuitStates.CLOSED:
+                Utils.logger_.info('OriginHostHealth', "OriginHostHealth::on_success host={} circuit closed".format(self.__host))
+
+            self.__consecutive_failures = 0
+            self.__state = CircuitStates.CLOSED
+            self.__probe_in_flight = False
+
+    ####################################################
+    #  on_failure
+    ####################################################
+    def on_failure(self) -> None:
+
+        with self.__lock:
+            self.__consecutive_failures += 1
+            self.__probe_in_flight = False
+
+            if self.__state is CircuitStates.HALF_OPEN or self.__consecutive_failures >= self.__max_failures:
+                if self.__state is not CircuitStates.OPEN:
+                    Utils.logger_.warning('OriginHostHealth', "OriginHostHealth::on_failure host={} circuit opened after {} failures".format(self.__host, self.__consecutive_failures))
+                self.__state = CircuitStates.OPEN
+                self.__opened_time = time.monotonic()
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self.__lock:
+            return {'state': self.__state.name,
+                    'srtt': self.__srtt,
+                    'rttvar': self.__rttvar,
+                    'consecutive_failures': self.__consecutive_failures}
+
+
+####################################################
+#
+#  OriginHostsHealth
+#
+####################################################
+class OriginHostsHealth(metaclass=Singleton):
+
+    __hosts: Dict[str, OriginHostHealth]
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__hosts = {}
+
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  get
+    ####################################################
+    def get(self, host: str) -> OriginHostHealth:
+
+        with self.__lock:
+            if host not in self.__hosts:
+                self.__hosts[host] = OriginHostHealth(host)
+
+            return self.__hosts[host]
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+
+        with self.__lock:
+            hosts = list(self.__hosts.items())
+
+        return {host: health.get_stats() for host, health in hosts}
+
+
+####################################################
+#
+#  FragmentResponse
+#
+####################################################
+class FragmentResponse:
+    content: bytes
+    content_type: str
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, content: bytes, content_type: str) -> None:
+        self.content = content
+        self.content_type = content_type
+
+
+####################################################
+#
+#  FragmentCache
+#
+#  Origin fragment bytes by absolute url, shared by all sessions.
+#  Evicts least recently used fragments above FRAGMENT_CACHE__MAX_SIZE_MB,
+#  and expires live fragments sooner than VoD ones.
+#
+####################################################
+class FragmentCache(metaclass=Singleton):
+
+    __cache: Optional[cachetools.TLRUCache]   # url -> (FragmentResponse, ttl)
+    __hits: int
+    __misses: int
+    __lock: threading.Lock
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        max_size = FRAGMENT_CACHE__MAX_SIZE_MB.value() * 1024 * 1024
+
+        self.__cache = None
+        if max_size > 0:
+            self.__cache = cachetools.TLRUCache(maxsize=max_size,
+                                                ttu=lambda _key, value, now: now + value[1],
+                                                getsizeof=lambda value: len(value[0].content))
+
+        self.__hits = 0
+        self.__misses = 0
+
+        self.__lock = threading.Lock()
+
+    ####################################################
+    #  get
+    ####################################################
+    def get(self, url: str) -> Optional[FragmentResponse]:
+
+        if self.__cache is None:
+            return None
+
+        with self.__lock:
+            value: Optional[Tuple[FragmentResponse, int]] = self.__cache.get(url)
+            if value is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+
+        if value is None:
+            METRIC__CACHE_REQUESTS.labels('origin_fragment', 'miss').inc()
+            return None
+
+        METRIC__CACHE_REQUESTS.labels('origin_fragment', 'hit').inc()
+        return value[0]
+
+    ####################################################
+    #  put
+    ####################################################
+    def put(self, url: str, fragment: FragmentResponse, live: bool) -> None:
+
+        if self.__cache is None or len(fragment.content) > self.__cache.maxsize:
+            return
+
+        ttl = FRAGMENT_CACHE__LIVE_TTL.value() if live is True else FRAGMENT_CACHE__VOD_TTL.value()
+
+        with self.__lock:
+            self.__cache[url] = (fragment, ttl)
+
+    ####################################################
+    #  get_stats
+    ####################################################
+    def get_stats(self) -> Dict[str, Any]:
+
+        if self.__cache is None:
+            return {}
+
+        with self.__lock:
+            return {'hits': self.__hits,
+                    'misses': self.__misses,
+                    'fragments': len(self.__cache),
+                    'size': self.__cache.currsize}
 
 
 ####################################################
@@ -80,15 +431,32 @@ class RequestsStats(metaclass=Singleton):
         self.__lock.release()
 
     ####################################################
-    #  add_request_failed
+    #  add_latency
+    ####################################################
+    def add_latency(self, host: str, request_type: str, get_time: datetime.timedelta) -> None:
+        METRIC__ORIGIN_REQUEST_SECONDS.labels(host, request_type).record(get_time.total_seconds())
+
+    ####################################################
+    #  get_stats
     ####################################################
     def get_stats(self) -> Dict:
 
-        self.__lock.acquire()
+        with self.__lock:
+            stats = {session_id: {request_name: dict(request_stats, failures=dict(request_stats['failures']))
+                                  for request_name, request_stats in session_requests.items()}
+                     for session_id, session_requests in self.__requests.items()}
 
-        stats = self.__requests.copy()
+        return stats
 
-        self.__lock.release()
+    ####################################################
+    #  get_latency_stats
+    #  { origin host: { request type: { count, average, p50, p90, p99, p999 } } }
+    ####################################################
+    def get_latency_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+
+        stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (host, request_type), histogram in METRIC__ORIGIN_REQUEST_SECONDS.children():
+            stats.setdefault(host, {})[request_type] = histogram.get_stats()
 
         return stats
 
@@ -101,44 +469,59 @@ class RequestsStats(metaclass=Singleton):
 class RequestWrapper():
     __session_id: str
     __request_name: str
+    __request_type: str
     __text: bool
-    __request_session: requests.Session
     __headers: Dict[str, str]
-    __timeout: float
-    __max_retries: int
 
     __use_last_response: bool
-    __last_url: str
-    __last_response: requests.Response
+    __last_response: Optional[Tuple[str, requests.Response]]  # (url, response), replaced as one
+    __fall_back_to_last_good_response: bool
+    __last_good_response: Optional[Tuple[str, requests.Response]]  # (url, response), replaced as one
 
     ####################################################
     #  __init__
     ####################################################
-    def __init__(self, session_id: str, request_name: str) -> None:
+    def __init__(self, session_id: str, request_name: str, request_type: str = '') -> None:
 
         self.__session_id = session_id
         self.__request_name = request_name
-        self.__max_retries = 3
-        self.__timeout = 3.05
+
+        # latency histograms are kept per request type, request_name may hold a url
+        self.__request_type = request_type if request_type != '' else request_name
 
         self.__use_last_response = False
-        self.__last_url = ''
         self.__last_response = None
+        self.__fall_back_to_last_good_response = False
+        self.__last_good_response = None
 
         self.__headers = {'User-Agent': EosHttpConfig.user_agent}
 
-        self.__request_session = requests.Session()
-
-        adapter = requests.adapters.HTTPAdapter(max_retries=self.__max_retries)
-        self.__request_session.mount("https://", adapter)
-        self.__request_session.mount("http://", adapter)
-
     ####################################################
     #  use_last_response
     ####################################################
     def use_last_response(self) -> None:
         self.__use_last_response = True
 
+    ####################################################
+    #  fall_back_to_last_good_response
+    #  when the circuit is open or the request fails, get() returns the
+    #  last good response of the same url instead of None
+    ####################################################
+    def fall_back_to_last_good_response(self) -> None:
+        self.__fall_back_to_last_good_response = True
+
+    ####################################################
+    #  __last_good_response_of
+    ####################################################
+    def __last_good_response_of(self, url: str, reason: str) -> Optional[requests.Response]:
+
+        last_good_response = self.__last_good_response if self.__fall_back_to_last_good_response is True else None
+        if last_good_response is None or url != last_good_response[0]:
+            return None
+
+        Utils.logger_.warning(self.__session_id, "RequestWrapper::get {}, using last good response for {}", reason, url)
+        return last_good_response[1]
+
     ####################################################
     #  get
     ####################################################
@@ -146,46 +529,108 @@ class RequestWrapper():
 
         rc = None
 
-        if self.__use_last_response is True and url == self.__last_url and self.__last_response is not None:
-            return self.__last_response
+        last_response = self.__last_response if self.__use_last_response is True else None
+        if last_response is not None and url == last_response[0]:
+            return last_response[1]
+
+        host = urlparse(url).netloc
+        host_health = OriginHostsHealth().get(host)
+
+        # the origin host is failing, don't wait for it
+        if host_health.allow_request() is False:
+            RequestsStats().add_request_failed(self.__session_id, self.__request_name, 'CircuitOpen')
+            METRIC__ORIGIN_REQUEST_FAILURES.labels(self.__request_type, 'CircuitOpen').inc()
+            Utils.logger_.error(self.__session_id, "RequestWrapper::get circuit open for {}".format(url))
+            return self.__last_good_response_of(url, 'circuit open')
 
         start_time = datetime.datetime.now()
 
         try:
-            response = self.__request_session.get(url, timeout=self.__timeout, headers=self.__headers)
+            response = HttpClient().get(url, headers=self.__headers, timeout=host_health.timeout())
+
+            end_time = datetime.datetime.now()
+            get_time = end_time - start_time
+
+            # client errors still mean the origin host is alive
+            if response.status_code < 500:
+                host_health.on_success(get_time.total_seconds())
+            else:
+                host_health.on_failure()
 
             if response.status_code == requests.codes.ok:
                 rc = response
-                end_time = datetime.datetime.now()
-                get_time = end_time - start_time
-                Utils.logger_.dump(self.__session_id, "RequestWrapper::get url={}, time={}".format(url, get_time))
+                Utils.logger_.dump(self.__session_id, "RequestWrapper::get url={}, time={}", url, get_time)
                 RequestsStats().add_request_success(self.__session_id, self.__request_name, get_time)
+                RequestsStats().add_latency(host, self.__request_type, get_time)
             else:
+                Utils.logger_.error(self.__session_id, "RequestWrapper::get error getting {} from server ({})".format(url, response.status_code))
                 RequestsStats().add_request_failed(self.__session_id, self.__request_name, 'StatusCode ' + str(response.status_code))
+                METRIC__ORIGIN_REQUEST_FAILURES.labels(self.__request_type, 'StatusCode ' + str(response.status_code)).inc()
 
         except requests.ConnectionError:
-            error_str = "HlsLiveDelayHandler::run Error connecting to server {}".format(url)
+            host_health.on_failure()
+            error_str = "RequestWrapper::get Error connecting to server {}".format(url)
             Utils.logger_.error(self.__session_id, error_str)
             RequestsStats().add_request_failed(self.__session_id, self.__request_name, 'ConnectionError')
+            METRIC__ORIGIN_REQUEST_FAILURES.labels(self.__request_type, 'ConnectionError').inc()
             rc = None
-            return rc
 
         except requests.exceptions.Timeout:
-            error_str = "HlsLiveDelayHandler::run Timeout connecting to server {}".format(url)
+            host_health.on_failure()
+            error_str = "RequestWrapper::get Timeout connecting to server {}".format(url)
             Utils.logger_.error(self.__session_id, error_str)
             RequestsStats().add_request_failed(self.__session_id, self.__request_name, 'Timeout')
+            METRIC__ORIGIN_REQUEST_FAILURES.labels(self.__request_type, 'Timeout').inc()
             rc = None
-            return rc
 
         except requests.exceptions.RequestException:
-            error_str = "HlsLiveDelayHandler::run Catastrofic error connecting to server {}".format(url)
+            host_health.on_failure()
+            error_str = "RequestWrapper::get Catastrofic error connecting to server {}".format(url)
             Utils.logger_.error(self.__session_id, error_str)
             RequestsStats().add_request_failed(self.__session_id, self.__request_name, 'RequestException')
+            METRIC__ORIGIN_REQUEST_FAILURES.labels(self.__request_type, 'RequestException').inc()
             rc = None
-            return rc
 
-        if rc is not None:
-            self.__last_url = url
-            self.__last_response = rc
+        if rc is None:
+            return self.__last_good_response_of(url, 'request failed')
+
+        if self.__use_last_response is True:
+            self.__last_response = (url, rc)
+        if self.__fall_back_to_last_good_response is True:
+            self.__last_good_response = (url, rc)
 
         return rc
+
+    ####################################################
+    #  get_async
+    #  the future result is the same as get()
+    ####################################################
+    def get_async(self, url: str) -> concurrent.futures.Future:
+        return HttpClient().submit(self.get, url)
+
+    ####################################################
+    #  get_fragment
+    #  origin fragments are looked up in the shared FragmentCache first
+    ####################################################
+    def get_fragment(self, url: str, live: bool) -> Optional[FragmentResponse]:
+
+        fragment = FragmentCache().get(url)
+        if fragment is not None:
+            Utils.logger_.dump(self.__session_id, "RequestWrapper::get_fragment cache hit url={}", url)
+            return fragment
+
+        response = self.get(url)
+        if response is None:
+            return None
+
+        fragment = FragmentResponse(response.content, response.headers.get('Content-Type', ''))
+        FragmentCache().put(url, fragment, live)
+
+        return fragment
+
+    ####################################################
+    #  get_fragment_async
+    #  the future result is the same as get_fragment()
+    ####################################################
+    def get_fragment_async(self, url: str, live: bool) -> concurrent.futures.Future:
+        return HttpClient().submit(self.get_fragment, url, live)
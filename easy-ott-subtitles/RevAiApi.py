@@ -13,7 +13,8 @@ from typing import List, Any, Dict
 import Utils as Utils
 from CommonTypes import EosFragmentEncodings
 from Languages import EosLanguage
-from GoogleCloudApi import GoogleCloudStreamingGenerator, GoogleCloudApiListener
+from GoogleCloudApi import GoogleCloudStreamingGenerator, GoogleCloudApiListener, METRIC__STT_RESULT_SECONDS
+from Metrics import StageTimers
 
 STREAMING_LIMIT = 240000  # 4 minutes
 # STREAMING_LIMIT = 120000  # 2 minutes
@@ -163,6 +164,11 @@ class RevAitreamingTranscribe(threading.Thread):
                 transcript_to_use = transcript[::-1]
 
             if len(words) > 0:
+                result_latency = stream.result_latency(stream.start_time + elements[-1].get('end_ts', 0) * 1000)
+                if result_latency is not None:
+                    METRIC__STT_RESULT_SECONDS.labels('revai').record(result_latency)
+                    StageTimers().record(stream.session_id, 'stt_result', result_latency)
+
                 Utils.logger_.debug_color('RevAitreamingTranscribe', "RevAitreamingTranscribe::_handle_response {}".format(transcript_to_use))
                 print("&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
                 print("words={}".format(words))
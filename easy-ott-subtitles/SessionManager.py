@@ -3,6 +3,7 @@ from typing import Dict, List, Optional
 
 import Utils as Utils
 from Singleton import Singleton
+from Metrics import MetricsRegistry
 from EosSession import EosSession, EosTranslateSession, EosTranscribeSession
 from OttHandler import OttProtocols
 
@@ -27,6 +28,8 @@ class SessionManager(metaclass=Singleton):
 
         self.__lock = threading.Lock()
 
+        MetricsRegistry().gauge_callback('eos_sessions', 'Number of open sessions', self.get_session_counts, ('type', 'streaming'))
+
     ####################################################
     #  session_exists
     ####################################################
@@ -111,6 +114,19 @@ class SessionManager(metaclass=Singleton):
 
         del self.__session_ids[session_id]
 
+    ####################################################
+    #  get_session_counts
+    #  { (session type, vod/live): count }
+    ####################################################
+    def get_session_counts(self) -> Dict:
+
+        counts: Dict = {}
+        for session in list(self.__session_ids.values()):
+            key = (session.get_session_type(), 'live' if session.is_live() is True else 'vod')
+            counts[key] = counts.get(key, 0) + 1
+
+        return counts
+
     ####################################################
     #  get_session_by_id
     ####################################################
@@ -1,3 +1,4 @@
+import threading
 
 
 ####################################################
@@ -7,8 +8,11 @@
 ####################################################
 class Singleton(type):
     _instance = None
+    _lock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
         if not cls._instance:
-            cls._instance = super(Singleton, cls).__call__(*args, **kwargs)
+            with Singleton._lock:
+                if not cls._instance:
+                    cls._instance = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instance
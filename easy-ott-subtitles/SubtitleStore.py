@@ -0,0 +1,169 @@
+import bisect
+import threading
+from typing import Any, Dict, List
+
+
+####################################################
+#
+#  SubtitleSnapshot
+#
+#  Immutable view of a SubtitleStore: the subs in [first, last) of arrays
+#  the store never modifies in that range. Readers use it without locks.
+#  find() bisects the starts, so its cost depends on the subs in the window
+#  and not on the length of the transcript.
+#
+####################################################
+class SubtitleSnapshot:
+    __starts: List[float]
+    __subs: List[Dict[str, Any]]
+    __first: int
+    __last: int
+    __max_duration: float
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, starts: List[float], subs: List[Dict[str, Any]], first: int, last: int, max_duration: float) -> None:
+
+        self.__starts = starts
+        self.__subs = subs
+        self.__first = first
+        self.__last = last
+        self.__max_duration = max_duration
+
+    ####################################################
+    #  __len__
+    ####################################################
+    def __len__(self) -> int:
+        return self.__last - self.__first
+
+    ####################################################
+    #  __iter__
+    ####################################################
+    def __iter__(self):
+        return iter(self.__subs[self.__first:self.__last])
+
+    ####################################################
+    #  find
+    #  subs overlapping [start_time, end_time], in start order
+    ####################################################
+    def find(self, start_time: float, end_time: float) -> List[Dict[str, Any]]:
+
+        # a sub starting before start_time - max_duration ends before start_time
+        first = bisect.bisect_left(self.__starts, start_time - self.__max_duration, self.__first, self.__last)
+        last = bisect.bisect_right(self.__starts, end_time, first, self.__last)
+
+        subs = []
+        for sub in self.__subs[first:last]:
+            if (start_time >= sub['start'] and start_time < sub['end']) or \
+               (end_time > sub['start'] and end_time <= sub['end']) or \
+               (start_time <= sub['start'] and end_time >= sub['end']):
+                subs.append(sub)
+
+        return subs
+
+
+####################################################
+#
+#  SubtitleStore
+#
+#  Subs of one language ordered by start time.
+#  Writers are serialized by a lock and publish a new SubtitleSnapshot after
+#  every change. In order subs are appended past the end of the published
+#  snapshots and the live window is trimmed by moving the first index, both
+#  in O(1); out of order inserts and compactions copy the arrays, so the
+#  arrays of published snapshots are never changed.
+#
+####################################################
+class SubtitleStore:
+    __COMPACT_MIN_TRIMMED = 256
+
+    __lock: threading.Lock
+    __starts: List[float]
+    __subs: List[Dict[str, Any]]
+    __first: int
+    __max_duration: float
+    __snapshot: SubtitleSnapshot
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self) -> None:
+
+        self.__lock = threading.Lock()
+
+        self.__starts = []
+        self.__subs = []
+        self.__first = 0
+        self.__max_duration = 0.0
+
+        self.__publish()
+
+    ####################################################
+    #  __len__
+    ####################################################
+    def __len__(self) -> int:
+        return len(self.__snapshot)
+
+    ####################################################
+    #  __publish
+    #  called with the lock held (or from __init__)
+    ####################################################
+    def __publish(self) -> None:
+        self.__snapshot = SubtitleSnapshot(self.__starts, self.__subs, self.__first, len(self.__subs), self.__max_duration)
+
+    ####################################################
+    #  append
+    ####################################################
+    def append(self, sub: Dict[str, Any]) -> None:
+
+        start = sub['start']
+
+        with self.__lock:
+
+            if len(self.__subs) == self.__first or start >= self.__starts[-1]:
+                self.__starts.append(start)
+                self.__subs.append(sub)
+            else:
+                starts = self.__starts[self.__first:]
+                subs = self.__subs[self.__first:]
+                index = bisect.bisect_right(starts, start)
+                starts.insert(index, start)
+                subs.insert(index, sub)
+                self.__starts = starts
+                self.__subs = subs
+                self.__first = 0
+
+            self.__max_duration = max(self.__max_duration, sub['end'] - start)
+
+            self.__publish()
+
+    ####################################################
+    #  pop_first
+    #  raises IndexError if the store is empty
+    ####################################################
+    def pop_first(self) -> Dict[str, Any]:
+
+        with self.__lock:
+
+            if self.__first == len(self.__subs):
+                raise IndexError('pop from empty SubtitleStore')
+
+            sub = self.__subs[self.__first]
+            self.__first += 1
+
+            # drop the trimmed subs once they are the larger part of the arrays
+            if self.__first >= self.__COMPACT_MIN_TRIMMED and self.__first * 2 >= len(self.__subs):
+                self.__starts = self.__starts[self.__first:]
+                self.__subs = self.__subs[self.__first:]
+                self.__first = 0
+
+            self.__publish()
+
+        return sub
+
+    ####################################################
+    #  snapshot
+    ####################################################
+    def snapshot(self) -> SubtitleSnapshot:
+        return self.__snapshot
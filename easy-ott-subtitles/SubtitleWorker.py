@@ -0,0 +1,66 @@
+from typing import Optional, Tuple
+
+from DashUtils import DashFragmentParser
+from WebVtt import WebVttReader, WebVttWriter, WebVttDocument, WebVttNoCues
+from Ttml import TtmlReader, TtmlWriter, TtmlDocument, TtmlNoCues
+
+####################################################
+#
+#  SubtitleWorker
+#
+#  CPU bound subtitle stages, run on the ProcessPool.
+#  Functions take and return picklable values only and keep no state.
+#
+####################################################
+
+
+####################################################
+#  read_webvtt_fragments
+#  raises WebVttNoCues if src_fragment has no cues
+####################################################
+def read_webvtt_fragments(src_fragment: bytes, src_next_fragment: Optional[bytes]) -> Tuple[WebVttDocument, Optional[WebVttDocument]]:
+
+    caption_set = WebVttReader().read(src_fragment)
+
+    next_caption_set = None
+    if src_next_fragment is not None:
+        try:
+            next_caption_set = WebVttReader().read(src_next_fragment)
+        except WebVttNoCues:
+            next_caption_set = None
+
+    return caption_set, next_caption_set
+
+
+####################################################
+#  write_webvtt
+####################################################
+def write_webvtt(caption_set: WebVttDocument) -> bytes:
+    return WebVttWriter().write(caption_set)
+
+
+####################################################
+#  read_dash_fragments
+#  raises TtmlNoCues if src_fragment has no cues
+####################################################
+def read_dash_fragments(src_fragment: bytes, src_next_fragment: Optional[bytes]) -> Tuple[TtmlDocument, Optional[TtmlDocument]]:
+
+    caption_set = TtmlReader().read(DashFragmentParser(src_fragment).read_ttml())
+
+    next_caption_set = None
+    if src_next_fragment is not None:
+        try:
+            next_caption_set = TtmlReader().read(DashFragmentParser(src_next_fragment).read_ttml())
+        except TtmlNoCues:
+            next_caption_set = None
+
+    return caption_set, next_caption_set
+
+
+####################################################
+#  write_dash_fragment
+#  src_fragment with its ttml replaced by caption_set
+####################################################
+def write_dash_fragment(src_fragment: bytes, caption_set: TtmlDocument) -> bytes:
+    return DashFragmentParser(src_fragment).update_ttml(TtmlWriter().write(caption_set))
+
@@ -1,14 +1,14 @@
 import os
 import threading
-import queue
-import time
 import traceback
-from typing import Dict, List, Optional, Any, Callable, Iterable
+from collections import deque
+from typing import Deque, Dict, List, Optional, Any, Callable, Iterable
 
 import Utils as Utils
 from CommonTypes import Context
 from Singleton import Singleton
 from HealthReporter import ModuleBase
+from Metrics import MetricsRegistry
 
 Debug_ThreadPool = False
 
@@ -39,6 +39,24 @@ ThreadPoolTags = {'free_tag': -1,
 ####################################################
 TagThreadAffinityMap = {ThreadPoolTags['classifier_tag']: 1}
 
+####################################################
+#
+#  ThreadPoolLanes { lane: weight }
+#  player facing jobs are scheduled 8 times as often as background jobs
+#
+####################################################
+ThreadPoolLanes = {'player': 8,
+                   'default': 4,
+                   'background': 1}
+
+# config variables
+THREADPOOL__PLAYER_LANE_MAX_JOBS = Utils.ConfigVariable('THREADPOOL', 'PLAYER_LANE_MAX_JOBS', type=int, default_value=0, description='Max pending jobs in the player lane, 0 for no limit', mandatory=False)
+THREADPOOL__DEFAULT_LANE_MAX_JOBS = Utils.ConfigVariable('THREADPOOL', 'DEFAULT_LANE_MAX_JOBS', type=int, default_value=0, description='Max pending jobs in the default lane, 0 for no limit', mandatory=False)
+THREADPOOL__BACKGROUND_LANE_MAX_JOBS = Utils.ConfigVariable('THREADPOOL', 'BACKGROUND_LANE_MAX_JOBS', type=int, default_value=1000, description='Max pending jobs in the background lane, 0 for no limit', mandatory=False)
+
+# metrics
+METRIC__REJECTED_JOBS = MetricsRegistry().counter('eos_threadpool_rejected_jobs_total', 'Jobs rejected because their lane was full', ('lane',))
+
 
 ####################################################
 #
@@ -50,20 +68,33 @@ class ThreadPool(Context):
     Threadpool class which can manage multiple threads.
     It guarentees mutually exclusion for each 'tag', so each tag is handled
     only by one thread at a time. Hence no need for locks in the flow of the jobs.
-    There is one 'public' queue for all pending jobs, and a 'private' queue per thread.
+    There are 'public' queues (lanes) for all pending jobs, and a 'private' queue per thread.
+    Lanes are served by smooth weighted round robin according to ThreadPoolLanes.
+    While a tag has jobs pending in a lane, its new jobs are queued in the same lane,
+    so jobs of a tag are always started in the order they were posted.
     If a thread is dequeing a job from the 'public' queue, and its tag is currently
     being handled by another thread, it will put the job in the other thread's 'private' queue,
     and will deque another job from the 'publiv' queue.
     This way we can ensure maximum efficency of all the threads, while maintaining the order of jobs per tag.
+    Idle threads block on their own condition and are woken when a job is posted or
+    handed to their private queue.
     Make sure no blocking jobs are performed on this context (threadpool).
     For blocking operations you need to switch to another conext/thread, and use the FutureResult class to return
     to this context after blocking job is completed.
     """
+    IDLE_WAKEUP_SECONDS = 2.0  # idle threads still wake up to send health beats
+
     __number_of_threads: int  # number of threads
     __threads: List['ThreadPoolThread']  # data structure to hold the thread instances
     __threads_working_tag: Dict[int, int]  # map of each thread and its current tag in work. [index->tag]
-    __queue: queue.Queue  # main queue for incoming jobs
-    __private_queues: Dict[int, queue.Queue]  # private queues for each thread
+    __tags_working_thread: Dict[int, int]  # reverse map of __threads_working_tag. [tag->index]
+    __lanes: Dict[str, Deque[Dict[str, Any]]]  # main queues for incoming jobs
+    __lanes_max_jobs: Dict[str, int]
+    __lanes_current_weight: Dict[str, int]
+    __tags_pending_lane: Dict[int, List[Any]]  # tag -> [lane, pending jobs]
+    __private_queues: Dict[int, Deque[Dict[str, Any]]]  # private queues for each thread
+    __conditions: Dict[int, threading.Condition]  # per thread, all share __lock
+    __idle_threads: List[int]  # threads waiting for a job
     __lock: threading.Lock
     __message_count: Dict[str, int]  # func_name, count
 
@@ -78,17 +109,27 @@ class ThreadPool(Context):
 
         if self.__number_of_threads < 0:
             Utils.logger_.error('ThreadPool', "ThreadPool::__init__ number of threads must be > 0 ({})".format(self.__number_of_threads))
+            Utils.logger_.stop()
             os._exit(0)
 
         self.__threads = []
 
         self.__threads_working_tag = {}  # dict is faster than list in lookup
-
-        self.__queue = queue.Queue()
+        self.__tags_working_thread = {}
+
+        self.__lanes = {lane: deque() for lane in ThreadPoolLanes}
+        self.__lanes_max_jobs = {'player': THREADPOOL__PLAYER_LANE_MAX_JOBS.value(),
+                                 'default': THREADPOOL__DEFAULT_LANE_MAX_JOBS.value(),
+                                 'background': THREADPOOL__BACKGROUND_LANE_MAX_JOBS.value()}
+        self.__lanes_current_weight = {lane: 0 for lane in ThreadPoolLanes}
+        self.__tags_pending_lane = {}
         self.__private_queues = {}  # dict is faster than list in lookup
 
         self.__lock = threading.Lock()
 
+        self.__conditions = {}
+        self.__idle_threads = []
+
         self.__message_count = {}
 
         start_barrier = threading.Barrier(number_of_threads)  # barrier for starting the threads
@@ -99,94 +140,112 @@ class ThreadPool(Context):
             thread = ThreadPoolThread(thread_name, i + 1, self, start_barrier)
             self.__threads.append(thread)
             self.__threads_working_tag[i + 1] = ThreadPoolTags['free_tag']
-            self.__private_queues[i + 1] = queue.Queue()
+            self.__private_queues[i + 1] = deque()
+            self.__conditions[i + 1] = threading.Condition(self.__lock)
 
         # start the threads
         for thread in self.__threads:
             thread.start()
 
     ####################################################
-    #  get_next_job
+    #  __hand_off
+    #  called with __lock held
     ####################################################
-    def get_next_job(self, thread_index: int) -> Optional[Dict[str, Any]]:
-        """ this function is used by the threads get next job from the threadpool.
-            it must not dispatch two jobs with the same tag to more than one thread at any goven time.
-            thread_index is the index of the calling thread """
+    def __hand_off(self, thread_index: int, msg: Dict[str, Any]) -> None:
 
-        # first check private queue of this thread. if not empty, return job
-        # if self.__private_queues[thread_index].empty() is False:
-        try:
-            msg = self.__private_queues[thread_index].get(block=False, timeout=0)
+        self.__private_queues[thread_index].append(msg)
 
-            # self.__threads_working_tag[thread_index] = msg['tag']
-            if self.__threads_working_tag[thread_index] != msg['tag']:
-                print(bcolors.FAIL + "thread {}, __threads_working_tag {}, msg['tag'] {}".format(thread_index, self.__threads_working_tag[thread_index], msg['tag']) + bcolors.ENDC)
-            if Debug_ThreadPool is True:
-                print(bcolors.OKGREEN + "thread {} starting job tag {} from queue {}".format(thread_index, msg['tag'], 'private') + bcolors.ENDC)
-            return msg
+        if thread_index in self.__idle_threads:
+            self.__idle_threads.remove(thread_index)
+            self.__conditions[thread_index].notify()
 
-        except queue.Empty:
-            pass
+    ####################################################
+    #  __pop_lane_job
+    #  smooth weighted round robin over the non empty lanes, called with __lock held
+    ####################################################
+    def __pop_lane_job(self) -> Optional[Dict[str, Any]]:
 
-        msg = None
+        selected_lane = None
+        total_weight = 0
 
-        # take lock, python is running one thread at a time but the context can switch in the middle of this function
-        with self.__lock:
+        for lane, weight in ThreadPoolLanes.items():
+            if len(self.__lanes[lane]) == 0:
+                continue
+            self.__lanes_current_weight[lane] += weight
+            total_weight += weight
+            if selected_lane is None or self.__lanes_current_weight[lane] > self.__lanes_current_weight[selected_lane]:
+                selected_lane = lane
 
-            # release tag
-            self.__threads_working_tag[thread_index] = ThreadPoolTags['free_tag']
+        if selected_lane is None:
+            return None
 
-            # check main queue
-            try:
-                # queue.get is thread-safe
-                msg = self.__queue.get(block=False, timeout=0)
-            except queue.Empty as err:
-                if Debug_ThreadPool is True:
-                    print("thread {} got Empty {}".format(thread_index, err))
+        self.__lanes_current_weight[selected_lane] -= total_weight
 
-            # if no message, return none
-            if msg is None:
-                return None
+        msg = self.__lanes[selected_lane].popleft()
 
-            # check if tag affinity is set on this tag
-            if msg['tag'] in TagThreadAffinityMap:
+        tag_pending_lane = self.__tags_pending_lane[msg['tag']]
+        tag_pending_lane[1] -= 1
+        if tag_pending_lane[1] == 0:
+            del self.__tags_pending_lane[msg['tag']]
 
-                # what is the thread index this tag is attahced to?
-                thread_affinty_index = TagThreadAffinityMap[msg['tag']]
+        return msg
 
-                # is this (by chance) the thread we need? if yes, return job
-                if thread_index == thread_affinty_index:
-                    self.__threads_working_tag[thread_index] = msg['tag']
-                    return msg
-                else:
-                    # put this job in the desired thread's private queue
-                    self.__private_queues[thread_affinty_index].put(msg)
-                    # return empty msg to thread will retry queue immediatly
-                    msg = {'type': 'RETRY', 'tag': None, 'func': None, 'args': None, 'callback': None, 'object': None}
-                    return msg
+    ####################################################
+    #  get_next_job
+    ####################################################
+    def get_next_job(self, thread_index: int, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """ this function is used by the threads get next job from the threadpool.
+            it must not dispatch two jobs with the same tag to more than one thread at any goven time.
+            thread_index is the index of the calling thread.
+            blocks until a job is available, returns None if timeout passed without a job """
 
-            # check if the tag of the message is in work in another thread
-            # if yes, put the message in the private queue of the other thread
-            tag_free = True
-            for i in range(0, self.__number_of_threads):
-                # if Debug_ThreadPool is True: print("thread {} is doing tag {}".format(index, self.__threads_working_tag[i+1][0]))
-                if msg['tag'] == self.__threads_working_tag[i + 1]:
-                    self.__private_queues[i + 1].put(msg)
-                    tag_free = False
-                    break
-
-            # tag is free, mark it and return it to requesting thread
-            if tag_free is True:
-                self.__threads_working_tag[thread_index] = msg['tag']
-                if Debug_ThreadPool is True:
-                    print(bcolors.OKGREEN + "thread {} starting job tag {} from queue {}".format(thread_index, msg['tag'], 'main') + bcolors.ENDC)
-                return msg
-            else:
-                # return empty msg to thread will retry queue immediatly
-                msg = {'type': 'RETRY', 'tag': None, 'func': None, 'args': None, 'callback': None, 'object': None}
-                return msg
+        with self.__lock:
 
-        return msg
+            while True:
+
+                # first check private queue of this thread. if not empty, return job
+                private_queue = self.__private_queues[thread_index]
+                if len(private_queue) > 0:
+                    msg = private_queue.popleft()
+                    if Debug_ThreadPool is True:
+                        print(bcolors.OKGREEN + "thread {} starting job tag {} from queue {}".format(thread_index, msg['tag'], 'private') + bcolors.ENDC)
+                    return msg
+
+                # release tag
+                working_tag = self.__threads_working_tag[thread_index]
+                if working_tag != ThreadPoolTags['free_tag']:
+                    self.__threads_working_tag[thread_index] = ThreadPoolTags['free_tag']
+                    del self.__tags_working_thread[working_tag]
+
+                # check main queue, jobs of busy tags are handed to the thread working on the tag
+                while True:
+                    msg = self.__pop_lane_job()
+                    if msg is None:
+                        break
+
+                    # check if tag affinity is set on this tag
+                    owner_index = TagThreadAffinityMap.get(msg['tag'])
+                    if owner_index is None:
+                        # check if the tag of the message is in work in another thread
+                        owner_index = self.__tags_working_thread.get(msg['tag'])
+
+                    if owner_index is None or owner_index == thread_index:
+                        self.__threads_working_tag[thread_index] = msg['tag']
+                        self.__tags_working_thread[msg['tag']] = thread_index
+                        if Debug_ThreadPool is True:
+                            print(bcolors.OKGREEN + "thread {} starting job tag {} from queue {}".format(thread_index, msg['tag'], 'main') + bcolors.ENDC)
+                        return msg
+
+                    self.__hand_off(owner_index, msg)
+
+                # no job, wait for one
+                self.__idle_threads.append(thread_index)
+                notified = self.__conditions[thread_index].wait(timeout)
+                if notified is False:
+                    if thread_index in self.__idle_threads:
+                        self.__idle_threads.remove(thread_index)
+                    if len(self.__private_queues[thread_index]) == 0 and self.queue_length() == 0:
+                        return None
 
     ####################################################
     #  put_job
@@ -195,21 +254,21 @@ class ThreadPool(Context):
                 tag: int,
                 class_instance,
                 function: Callable,
-                args: Iterable) -> None:
+                args: Iterable,
+                lane: str = 'default',
+                may_reject: bool = True) -> bool:
         """ use this function to switch contexts, from one thread/threadpool to another.
             tag is the unique identifier of a session/channel/anything tou want to run only in one thread at any time.
             class_instance is the class instance which the function should be called on.
             function is the dunction to be called, usually 'Class.Func' format.
-            args are arguments passed to the function. """
+            args are arguments passed to the function.
+            lane is one of ThreadPoolLanes: 'player' for manifest and fragment requests,
+            'background' for pre-rendering and post-processing.
+            may_reject is False for jobs that must run, like FutureResult continuations.
+            returns False if the job was rejected because the lane is full. """
 
         msg = {'type': 'JOB', 'tag': tag, 'class_instance': class_instance, 'function': function, 'args': args}
 
-        with self.__lock:
-            if function.__qualname__ in self.__message_count:
-                self.__message_count[function.__qualname__] += 1
-            else:
-                self.__message_count[function.__qualname__] = 1
-
         if Debug_ThreadPool is True:
             print("put_job type={} tag={} class_instance={} function={} args={}".format(msg['type'],
                                                                                         msg['tag'],
@@ -217,21 +276,61 @@ class ThreadPool(Context):
                                                                                         msg['function'],
                                                                                         msg['args']))
 
-        self.__queue.put(msg)
+        with self.__lock:
+
+            # keep the order of the tag's jobs, follow its pending jobs.
+            # the limit is of the lane the job asked for, a player job following
+            # background jobs of its tag is not rejected by the background limit
+            max_jobs = self.__lanes_max_jobs[lane] if may_reject is True else 0
+            tag_pending_lane = self.__tags_pending_lane.get(tag)
+            if tag_pending_lane is not None:
+                if tag_pending_lane[0] != lane:
+                    max_jobs = 0
+                lane = tag_pending_lane[0]
+
+            if max_jobs > 0 and len(self.__lanes[lane]) >= max_jobs:
+                METRIC__REJECTED_JOBS.labels(lane).inc()
+                Utils.logger_.warning('ThreadPool', "ThreadPool::put_job lane {} is full ({} jobs), job {} rejected", lane, max_jobs, function.__qualname__)
+                return False
+
+            if function.__qualname__ in self.__message_count:
+                self.__message_count[function.__qualname__] += 1
+            else:
+                self.__message_count[function.__qualname__] = 1
+
+            self.__lanes[lane].append(msg)
+
+            if tag_pending_lane is None:
+                self.__tags_pending_lane[tag] = [lane, 1]
+            else:
+                tag_pending_lane[1] += 1
+
+            # wake one idle thread, busy threads check the main queue when they are done
+            if len(self.__idle_threads) > 0:
+                self.__conditions[self.__idle_threads.pop()].notify()
+
+        return True
 
     ####################################################
     #  queue_length
     ####################################################
     def queue_length(self) -> int:
 
-        return self.__queue.qsize()
+        return sum(len(lane_queue) for lane_queue in self.__lanes.values())
+
+    ####################################################
+    #  lanes_length
+    ####################################################
+    def lanes_length(self) -> Dict[str, int]:
+
+        return {lane: len(lane_queue) for lane, lane_queue in self.__lanes.items()}
 
     ####################################################
     #  private_queue_length
     ####################################################
     def private_queue_length(self, thread_index: int) -> int:
 
-        return self.__private_queues[thread_index].qsize()
+        return len(self.__private_queues[thread_index])
 
     ####################################################
     #  private_queues_length
@@ -240,7 +339,7 @@ class ThreadPool(Context):
 
         sum = 0
         for i in range(0, self.__number_of_threads):
-            sum += self.__private_queues[i + 1].qsize()
+            sum += len(self.__private_queues[i + 1])
         return sum
 
     ####################################################
@@ -304,15 +403,12 @@ class ThreadPoolThread(threading.Thread, ModuleBase):
 
             try:
 
-                # get next job from the threadpool
-                msg = self.__thread_pool.get_next_job(self.__thread_index)
+                # wait for the next job from the threadpool
+                msg = self.__thread_pool.get_next_job(self.__thread_index, ThreadPool.IDLE_WAKEUP_SECONDS)
 
                 if msg is not None:
                     # handle message
                     self.__handle_queue_msg(msg)
-                else:
-                    # wait 100 msec
-                    time.sleep(0.1)
 
                 # send health beat
                 if self.health_beat_needed():
@@ -334,8 +430,6 @@ class ThreadPoolThread(threading.Thread, ModuleBase):
             # if Debug_ThreadPool is True: print("function= ", msg['function'])
             # if Debug_ThreadPool is True: print("args= ", msg['args'])
             msg['function'](msg['class_instance'], *(msg['args']))
-        elif msg['type'] == 'RETRY':
-            pass
 
 
 ####################################################
@@ -356,3 +450,7 @@ class JobThreadPool(ThreadPool, metaclass=Singleton):
     ####################################################
     def __init__(self, number_of_threads: int = 0) -> None:
         ThreadPool.__init__(self, 'job', number_of_threads)
+
+        MetricsRegistry().gauge_callback('eos_threadpool_queue_depth', 'Jobs waiting in the job thread pool',
+                                         lambda: {**{(lane,): length for lane, length in self.lanes_length().items()}, ('private',): self.private_queues_length()},
+                                         ('queue',))
@@ -0,0 +1,267 @@
+import re
+import html
+from typing import List, Optional, Tuple, Union
+
+
+####################################################
+#
+#  TtmlNoCues
+#
+####################################################
+class TtmlNoCues(Exception):
+    pass
+
+
+####################################################
+#
+#  TtmlNode
+#
+#  Same type_ values as pycaption's CaptionNode.
+#  span is the position of the (whitespace trimmed) text in the document,
+#  the writer replaces it with the escaped content.
+#
+####################################################
+class TtmlNode:
+    TEXT = 1
+    BREAK = 3
+
+    __slots__ = ('type_', 'content', 'span')
+
+    type_: int
+    content: Optional[str]
+    span: Optional[Tuple[int, int]]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, type_: int, content: Optional[str] = None, span: Optional[Tuple[int, int]] = None) -> None:
+        self.type_ = type_
+        self.content = content
+        self.span = span
+
+    ####################################################
+    #  __repr__
+    ####################################################
+    def __repr__(self) -> str:
+        return "TtmlNode: [type_:{}, content:{}]".format(self.type_, self.content)
+
+
+####################################################
+#
+#  TtmlCue
+#
+#  One <p> element, start and end in microseconds.
+#
+####################################################
+class TtmlCue:
+
+    __slots__ = ('start', 'end', 'nodes')
+
+    start: int
+    end: int
+    nodes: List[TtmlNode]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, start: int, end: int, nodes: List[TtmlNode]) -> None:
+        self.start = start
+        self.end = end
+        self.nodes = nodes
+
+    ####################################################
+    #  __repr__
+    ####################################################
+    def __repr__(self) -> str:
+        return "TtmlCue: [start:{}, end:{}, nodes:{}]".format(self.start, self.end, self.nodes)
+
+
+####################################################
+#
+#  TtmlDocument
+#
+#  The document text as read and the <p> cues found in it.
+#  get_languages / get_captions follow pycaption's CaptionSet.
+#
+####################################################
+class TtmlDocument:
+    text: str
+    language: str
+    cues: List[TtmlCue]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, text: str, language: str, cues: List[TtmlCue]) -> None:
+        self.text = text
+        self.language = language
+        self.cues = cues
+
+    ####################################################
+    #  __repr__
+    ####################################################
+    def __repr__(self) -> str:
+        return "TtmlDocument: [language:{}, cues:{}]".format(self.language, self.cues)
+
+    ####################################################
+    #  get_languages
+    ####################################################
+    def get_languages(self) -> List[str]:
+        return [self.language]
+
+    ####################################################
+    #  get_captions
+    ####################################################
+    def get_captions(self, lang: str) -> List[TtmlCue]:
+        return self.cues
+
+
+####################################################
+#
+#  TtmlReader
+#
+#  Tokenizes the <p> elements of a TTML document with regular expressions
+#  instead of building a DOM; everything outside the text of the <p>
+#  elements (head, styling, layout, span attributes) is left untouched.
+#
+####################################################
+class TtmlReader:
+
+    __TT_TAG = re.compile(r'<(?:\w+:)?tt\b[^>]*>')
+    __LANG_ATTR = re.compile(r'\bxml:lang\s*=\s*["\']([^"\']*)["\']')
+    __TICK_RATE_ATTR = re.compile(r'\bttp:tickRate\s*=\s*["\']([^"\']*)["\']')
+    __P_ELEMENT = re.compile(r'<((?:\w+:)?p)\b([^>]*)(?<!/)>(.*?)</\1\s*>', re.S)
+    __BEGIN_ATTR = re.compile(r'\bbegin\s*=\s*["\']([^"\']*)["\']')
+    __END_ATTR = re.compile(r'\bend\s*=\s*["\']([^"\']*)["\']')
+    __TAG = re.compile(r'<[^>]*>')
+    __BR_TAG = re.compile(r'<(?:\w+:)?br\b')
+    __OFFSET_TIME = re.compile(r'^([\d.]+)(h|ms|m|s|t)$')
+
+    ####################################################
+    #  __parse_time
+    #  clock time (hh:mm:ss[.fraction], frames are ignored) or offset time
+    #  (3.5s, 200ms, 1500t...) to microseconds
+    ####################################################
+    @classmethod
+    def __parse_time(cls, time_expression: Optional[str], tick_rate: int) -> int:
+
+        if time_expression is None:
+            return 0
+
+        time_expression = time_expression.strip()
+
+        if ':' in time_expression:
+            parts = time_expression.split(':')
+            seconds = int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
+            return int(round(seconds * 1000000))
+
+        match = cls.__OFFSET_TIME.match(time_expression)
+        if match is None:
+            return 0
+
+        value = float(match.group(1))
+        unit = match.group(2)
+        if unit == 'h':
+            value *= 3600
+        elif unit == 'm':
+            value *= 60
+        elif unit == 'ms':
+            value /= 1000
+        elif unit == 't':
+            value /= tick_rate
+
+        return int(round(value * 1000000))
+
+    ####################################################
+    #  read
+    #  raises TtmlNoCues if there are no <p> elements
+    ####################################################
+    def read(self, content: Union[bytes, str]) -> TtmlDocument:
+
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+
+        language = 'und'
+        tick_rate = 1
+        tt_tag = self.__TT_TAG.search(content)
+        if tt_tag is not None:
+            lang_attr = self.__LANG_ATTR.search(tt_tag.group(0))
+            if lang_attr is not None and lang_attr.group(1) != '':
+                language = lang_attr.group(1)
+            tick_rate_attr = self.__TICK_RATE_ATTR.search(tt_tag.group(0))
+            if tick_rate_attr is not None:
+                tick_rate = int(tick_rate_attr.group(1)) or 1
+
+        cues: List[TtmlCue] = []
+
+        for p_element in self.__P_ELEMENT.finditer(content):
+
+            attributes = p_element.group(2)
+            begin_attr = self.__BEGIN_ATTR.search(attributes)
+            end_attr = self.__END_ATTR.search(attributes)
+
+            nodes: List[TtmlNode] = []
+
+            position = p_element.start(3)
+            end_position = p_element.end(3)
+            while position < end_position:
+
+                tag = self.__TAG.search(content, position, end_position)
+                text_end = tag.start() if tag is not None else end_position
+
+                if text_end > position:
+                    text = content[position:text_end]
+                    stripped_text = text.strip()
+                    if stripped_text != '':
+                        lead = len(text) - len(text.lstrip())
+                        trail = len(text) - len(text.rstrip())
+                        nodes.append(TtmlNode(TtmlNode.TEXT,
+                                              ' '.join(html.unescape(stripped_text).split()),
+                                              (position + lead, text_end - trail)))
+
+                if tag is None:
+                    break
+
+                if self.__BR_TAG.match(tag.group(0)) is not None:
+                    nodes.append(TtmlNode(TtmlNode.BREAK))
+
+                position = tag.end()
+
+            cues.append(TtmlCue(self.__parse_time(begin_attr.group(1) if begin_attr is not None else None, tick_rate),
+                                self.__parse_time(end_attr.group(1) if end_attr is not None else None, tick_rate),
+                                nodes))
+
+        if len(cues) == 0:
+            raise TtmlNoCues('no cues in TTML document')
+
+        return TtmlDocument(content, language, cues)
+
+
+####################################################
+#
+#  TtmlWriter
+#
+####################################################
+class TtmlWriter:
+
+    ####################################################
+    #  write
+    #  the document as read, with the text of the nodes replaced by their content
+    ####################################################
+    def write(self, document: TtmlDocument) -> bytes:
+
+        text = document.text
+        parts = []
+        position = 0
+
+        for cue in document.cues:
+            for node in cue.nodes:
+                if node.span is None:
+                    continue
+                parts.append(text[position:node.span[0]])
+                parts.append(html.escape(node.content or '', quote=False))
+                position = node.span[1]
+
+        parts.append(text[position:])
+
+        return ''.join(parts).encode('utf-8')
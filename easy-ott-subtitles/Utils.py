@@ -1,9 +1,11 @@
 import logging
 from datetime import datetime, timedelta
 import time
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from logging import StreamHandler
 import threading
+import queue
+import atexit
 import configparser
 import os
 import signal
@@ -181,6 +183,7 @@ class ConfigParser_:
                 log_str = "ConfigParser_:get_config ERROR {} {} not found, mandatory parameter".format(section_name, option_name)
                 if use_logger is True:
                     logger_.error(self.__get_id_str(), log_str)
+                    logger_.stop()
                 # print("\033[91m",log_str,"\033[0m")
                 os._exit(0)
 
@@ -222,6 +225,7 @@ class ConfigParser_:
                 log_str = "ConfigParser_:get_config ERROR {} {} not found, mandatory parameter".format(section_name, option_name)
                 if use_logger is True:
                     logger_.error(self.__get_id_str(), log_str)
+                    logger_.stop()
                 # print("\033[91m",log_str,"\033[0m")
                 os._exit(0)
 
@@ -434,10 +438,33 @@ APP__CORE_FILE_LOCATION = ConfigVariable('APP', 'CORE_FILE_LOCATION', type=str,
 APP__CORE_FILE_MAX_SIZE = ConfigVariable('APP', 'CORE_FILE_MAX_SIZE', type=int, default_value=10000000, description='Max core file size in bytes', mandatory=False, use_logger=False)
 
 
+####################################################
+#
+#  LogQueueHandler
+#
+#  Logger_ messages are already formatted strings without arguments, so
+#  the record is queued as is and the Formatter runs on the listener thread.
+#
+####################################################
+class LogQueueHandler(QueueHandler):
+
+    ####################################################
+    #  prepare
+    ####################################################
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
 ####################################################
 #
 #  Logger_
 #
+#  Levels are checked before a message is formatted, messages may be
+#  passed as a format string and arguments:
+#      logger_.dump(_id, "url={}, time={}", url, time)
+#  Records are written by a QueueListener thread, callers never block on
+#  the file or stdout.
+#
 ####################################################
 class Logger_:
     __log_level: str
@@ -445,6 +472,11 @@ class Logger_:
     __colors: Dict[str, str]
     __log_to_file: bool
     __log_to_stdout: bool
+    __min_level_value: int
+    __queue: queue.SimpleQueue
+    __listener: QueueListener
+    __stopped: bool
+    __stop_lock: threading.Lock
 
     ####################################################
     #  __init__
@@ -505,7 +537,17 @@ class Logger_:
             stdout_handler.setLevel(self.__stdout_log_level_value)
             log_handlers.append(stdout_handler)
 
-        logging.basicConfig(format=log_format, level=self.__log_level_value, handlers=log_handlers)
+        # records below the level of every handler are dropped before formatting
+        self.__min_level_value = min([handler.level for handler in log_handlers], default=logging.CRITICAL + 1)
+
+        self.__queue = queue.SimpleQueue()
+        self.__listener = QueueListener(self.__queue, *log_handlers, respect_handler_level=True)
+        self.__listener.start()
+        self.__stopped = False
+        self.__stop_lock = threading.Lock()
+        atexit.register(self.stop)
+
+        logging.basicConfig(format=log_format, level=self.__min_level_value, handlers=[LogQueueHandler(self.__queue)])
 
         logging.addLevelName(logging.DEBUG - 1, 'DUMP')
 
@@ -514,6 +556,17 @@ class Logger_:
 
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+    ####################################################
+    #  stop
+    #  writes the queued records and stops the listener thread
+    ####################################################
+    def stop(self) -> None:
+
+        with self.__stop_lock:
+            if self.__stopped is False:
+                self.__stopped = True
+                self.__listener.stop()
+
     ####################################################
     #  __log_level_from_string
     ####################################################
@@ -550,82 +603,94 @@ class Logger_:
     #        return
 
     ####################################################
-    #  debug
+    #  __log
     ####################################################
-    def debug(self, _id: str, log_str: str) -> None:
+    def __log(self, level: int, color: str, _id: str, log_str: str, args) -> None:
+
+        if len(args) > 0:
+            log_str = log_str.format(*args)
+
         log_str = _id + ' ' + log_str
-        logging.debug(log_str)
+        if color != '':
+            log_str = color + log_str + self.__colors['ENDC']
+
+        logging.log(level, log_str)
+
+    ####################################################
+    #  is_enabled
+    ####################################################
+    def is_enabled(self, level: int) -> bool:
+        return level >= self.__min_level_value
+
+    ####################################################
+    #  debug
+    ####################################################
+    def debug(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.DEBUG >= self.__min_level_value:
+            self.__log(logging.DEBUG, '', _id, log_str, args)
 
     ####################################################
     #  debug_color
     ####################################################
-    def debug_color(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['yellow'] + log_str + self.__colors['ENDC']
-        logging.debug(log_str)
+    def debug_color(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.DEBUG >= self.__min_level_value:
+            self.__log(logging.DEBUG, self.__colors['yellow'], _id, log_str, args)
 
     ####################################################
     #  dump
     ####################################################
-    def dump(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        logging.log(logging.DEBUG - 1, log_str)
+    def dump(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.DEBUG - 1 >= self.__min_level_value:
+            self.__log(logging.DEBUG - 1, '', _id, log_str, args)
 
     ####################################################
     #  system
     ####################################################
-    def system(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['blue'] + log_str + self.__colors['ENDC']
-        logging.info(log_str)
+    def system(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.INFO >= self.__min_level_value:
+            self.__log(logging.INFO, self.__colors['blue'], _id, log_str, args)
 
     ####################################################
     #  info
     ####################################################
-    def info(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['green'] + log_str + self.__colors['ENDC']
-        logging.info(log_str)
+    def info(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.INFO >= self.__min_level_value:
+            self.__log(logging.INFO, self.__colors['green'], _id, log_str, args)
 
     ####################################################
     #  info_w
     ####################################################
-    def info_w(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        # log_str = self.__colors['green'] + log_str + self.__colors['ENDC']
-        logging.info(log_str)
+    def info_w(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.INFO >= self.__min_level_value:
+            self.__log(logging.INFO, '', _id, log_str, args)
 
     ####################################################
     #  info_y
     ####################################################
-    def info_y(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['yellow'] + log_str + self.__colors['ENDC']
-        logging.info(log_str)
+    def info_y(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.INFO >= self.__min_level_value:
+            self.__log(logging.INFO, self.__colors['yellow'], _id, log_str, args)
 
     ####################################################
     #  warning
     ####################################################
-    def warning(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['pink'] + log_str + self.__colors['ENDC']
-        logging.warning(log_str)
+    def warning(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.WARNING >= self.__min_level_value:
+            self.__log(logging.WARNING, self.__colors['pink'], _id, log_str, args)
 
     ####################################################
     #  error
     ####################################################
-    def error(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['red'] + log_str + self.__colors['ENDC']
-        logging.error(log_str)
+    def error(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.ERROR >= self.__min_level_value:
+            self.__log(logging.ERROR, self.__colors['red'], _id, log_str, args)
 
     ####################################################
     #  critical
     ####################################################
-    def critical(self, _id: str, log_str: str) -> None:
-        log_str = _id + ' ' + log_str
-        log_str = self.__colors['red'] + self.__colors['bold'] + log_str + self.__colors['ENDC']
-        logging.critical(log_str)
+    def critical(self, _id: str, log_str: str, *args: Any) -> None:
+        if logging.CRITICAL >= self.__min_level_value:
+            self.__log(logging.CRITICAL, self.__colors['red'] + self.__colors['bold'], _id, log_str, args)
 
 
 ####################################################
@@ -943,36 +1008,9 @@ def now_to_epoch() -> int:
 #################################
 def seconds_to_srt_time(time: float) -> str:
 
-    time_millisec_, seconds_ = math.modf(time)
-
-    time_millisec = round(time_millisec_ * 1000)
-    seconds = int(seconds_)
-
-    time_hours = int(seconds / 3600)
-    time_minutes = int((seconds - time_hours * 3600) / 60)
-    time_seconds = (seconds - time_hours * 3600 - time_minutes * 60)
+    millisec = int(time * 1000 + 0.5)
 
-    hours_str = str(time_hours)
-    if time_hours < 10:
-        hours_str = '0' + str(time_hours)
-
-    minutes_str = str(time_minutes)
-    if time_minutes < 10:
-        minutes_str = '0' + str(time_minutes)
-
-    seconds_str = str(time_seconds)
-    if time_seconds < 10:
-        seconds_str = '0' + str(time_seconds)
-
-    millisec_str = str(time_millisec)
-    if time_millisec < 10:
-        millisec_str = '00' + str(time_millisec)
-    elif time_millisec < 100:
-        millisec_str = '0' + str(time_millisec)
-
-    srt_time = hours_str + ':' + minutes_str + ':' + seconds_str + ',' + millisec_str
-
-    return srt_time
+    return '%02d:%02d:%02d,%03d' % (millisec // 3600000, millisec // 60000 % 60, millisec // 1000 % 60, millisec % 1000)
 
 
 #################################
@@ -1001,36 +1039,9 @@ def parse_hls_params(line: str) -> Dict[str, str]:
 #################################
 def seconds_to_webvtt_time(time: float) -> str:
 
-    time_millisec_, seconds_ = math.modf(time)
-
-    time_millisec = round(time_millisec_ * 1000)
-    seconds = int(seconds_)
-
-    time_hours = int(seconds / 3600)
-    time_minutes = int((seconds - time_hours * 3600) / 60)
-    time_seconds = (seconds - time_hours * 3600 - time_minutes * 60)
-
-    hours_str = str(time_hours)
-    if time_hours < 10:
-        hours_str = '0' + str(time_hours)
-
-    minutes_str = str(time_minutes)
-    if time_minutes < 10:
-        minutes_str = '0' + str(time_minutes)
-
-    seconds_str = str(time_seconds)
-    if time_seconds < 10:
-        seconds_str = '0' + str(time_seconds)
-
-    millisec_str = str(time_millisec)
-    if time_millisec < 10:
-        millisec_str = '00' + str(time_millisec)
-    elif time_millisec < 100:
-        millisec_str = '0' + str(time_millisec)
-
-    webvtt_time = hours_str + ':' + minutes_str + ':' + seconds_str + '.' + millisec_str
+    millisec = int(time * 1000 + 0.5)
 
-    return webvtt_time
+    return '%02d:%02d:%02d.%03d' % (millisec // 3600000, millisec // 60000 % 60, millisec // 1000 % 60, millisec % 1000)
 
 
 ####################################################
@@ -0,0 +1,252 @@
+import re
+import html
+from typing import List, Optional, Union
+
+
+####################################################
+#
+#  WebVttNoCues
+#
+####################################################
+class WebVttNoCues(Exception):
+    pass
+
+
+####################################################
+#
+#  WebVttNode
+#
+#  Same type_ values as pycaption's CaptionNode, so code walking caption
+#  nodes works on both.
+#  content is the text of the payload line without markup and entities,
+#  line is the payload line as read and line_content its text: the writer
+#  keeps the line while content is unchanged, and escapes a new content.
+#
+####################################################
+class WebVttNode:
+    TEXT = 1
+    BREAK = 3
+
+    __slots__ = ('type_', 'content', 'line', 'line_content')
+
+    type_: int
+    content: Optional[str]
+    line: Optional[str]
+    line_content: Optional[str]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, type_: int, content: Optional[str] = None, line: Optional[str] = None) -> None:
+        self.type_ = type_
+        self.content = content
+        self.line = line
+        self.line_content = content
+
+    ####################################################
+    #  __repr__
+    ####################################################
+    def __repr__(self) -> str:
+        return "WebVttNode: [type_:{}, content:{}]".format(self.type_, self.content)
+
+
+####################################################
+#
+#  WebVttCue
+#
+#  The timing line is kept as read (timestamps and cue settings), only the
+#  payload is rewritten.
+#
+####################################################
+class WebVttCue:
+
+    __slots__ = ('identifier', 'timing', 'start', 'end', 'nodes')
+
+    identifier: Optional[str]
+    timing: str
+    start: int   # microseconds
+    end: int     # microseconds
+    nodes: List[WebVttNode]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, identifier: Optional[str], timing: str, start: int, end: int, nodes: List[WebVttNode]) -> None:
+        self.identifier = identifier
+        self.timing = timing
+        self.start = start
+        self.end = end
+        self.nodes = nodes
+
+    ####################################################
+    #  __repr__
+    ####################################################
+    def __repr__(self) -> str:
+        return "WebVttCue: [timing:{}, nodes:{}]".format(self.timing, self.nodes)
+
+
+####################################################
+#
+#  WebVttDocument
+#
+#  header is the WEBVTT block as read (X-TIMESTAMP-MAP and other header
+#  lines included), blocks are the cues and the NOTE/STYLE/REGION blocks
+#  in their original order.
+#  get_languages / get_captions follow pycaption's CaptionSet.
+#
+####################################################
+class WebVttDocument:
+    header: str
+    blocks: List[Union[str, WebVttCue]]
+    cues: List[WebVttCue]
+
+    ####################################################
+    #  __init__
+    ####################################################
+    def __init__(self, header: str, blocks: List[Union[str, WebVttCue]], cues: List[WebVttCue]) -> None:
+        self.header = header
+        self.blocks = blocks
+        self.cues = cues
+
+    ####################################################
+    #  get_languages
+    ####################################################
+    def get_languages(self) -> List[str]:
+        return ['und']
+
+    ####################################################
+    #  get_captions
+    ####################################################
+    def get_captions(self, lang: str) -> List[WebVttCue]:
+        return self.cues
+
+
+####################################################
+#
+#  WebVttReader
+#
+####################################################
+class WebVttReader:
+
+    __TAG = re.compile(r'<[^>]*>')
+
+    ####################################################
+    #  __parse_timestamp
+    #  [hh:]mm:ss.ttt to microseconds
+    ####################################################
+    @staticmethod
+    def __parse_timestamp(timestamp: str) -> int:
+
+        seconds, _, fraction = timestamp.partition('.')
+        parts = seconds.split(':')
+
+        total_seconds = 0
+        for part in parts:
+            total_seconds = total_seconds * 60 + int(part)
+
+        return total_seconds * 1000000 + int(fraction.ljust(3, '0')[:3]) * 1000
+
+    ####################################################
+    #  read
+    #  raises WebVttNoCues if there are no cues
+    ####################################################
+    def read(self, content: Union[bytes, str]) -> WebVttDocument:
+
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+        elif content.startswith('\ufeff'):
+            content = content[1:]
+
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+        raw_blocks = content.split('\n\n')
+
+        header = raw_blocks[0].strip('\n')
+        if header.startswith('WEBVTT') is False:
+            raise ValueError('not a WebVTT document')
+
+        blocks: List[Union[str, WebVttCue]] = []
+        cues: List[WebVttCue] = []
+
+        for raw_block in raw_blocks[1:]:
+
+            raw_block = raw_block.strip('\n')
+            if raw_block == '':
+                continue
+
+            lines = raw_block.split('\n')
+
+            timing_index = 0
+            if '-->' not in lines[0]:
+                timing_index = 1
+                if len(lines) < 2 or '-->' not in lines[1] or lines[0].startswith('NOTE'):
+                    # NOTE / STYLE / REGION block
+                    blocks.append(raw_block)
+                    continue
+
+            timing = lines[timing_index]
+            start, _, rest = timing.partition('-->')
+            end = rest.split(None, 1)[0]
+
+            nodes: List[WebVttNode] = []
+            for line in lines[timing_index + 1:]:
+                if len(nodes) > 0:
+                    nodes.append(WebVttNode(WebVttNode.BREAK))
+                nodes.append(WebVttNode(WebVttNode.TEXT, ' '.join(html.unescape(self.__TAG.sub('', line)).split()), line))
+
+            cue = WebVttCue(lines[0] if timing_index == 1 else None,
+                            timing,
+                            self.__parse_timestamp(start.strip()),
+                            self.__parse_timestamp(end),
+                            nodes)
+            blocks.append(cue)
+            cues.append(cue)
+
+        if len(cues) == 0:
+            raise WebVttNoCues('no cues in WebVTT document')
+
+        return WebVttDocument(header, blocks, cues)
+
+
+####################################################
+#
+#  WebVttWriter
+#
+####################################################
+class WebVttWriter:
+
+    ####################################################
+    #  write
+    ####################################################
+    def write(self, document: WebVttDocument) -> bytes:
+
+        parts = [document.header, '\n\n']
+
+        for block in document.blocks:
+
+            if isinstance(block, str):
+                parts.append(block)
+                parts.append('\n\n')
+                continue
+
+            if block.identifier is not None:
+                parts.append(block.identifier)
+                parts.append('\n')
+            parts.append(block.timing)
+
+            # an empty line would end the cue
+            for node in block.nodes:
+                if node.type_ != WebVttNode.TEXT:
+                    continue
+                if node.line is not None and node.content == node.line_content:
+                    parts.append('\n')
+                    parts.append(node.line)
+                elif node.content:
+                    parts.append('\n')
+                    parts.append(html.escape(node.content, quote=False))
+
+            parts.append('\n\n')
+
+        return ''.join(parts).encode('utf-8')
+
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of easy-ott-subtitles import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'easy-ott-subtitles'))
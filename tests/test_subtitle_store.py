@@ -0,0 +1,62 @@
+import pytest
+
+from SubtitleStore import SubtitleStore
+
+
+def make_sub(start, end):
+    return {'start': start, 'end': end, 'text': '{}-{}'.format(start, end)}
+
+
+def test_find_overlapping():
+
+    store = SubtitleStore()
+    for start in range(0, 20, 2):
+        store.append(make_sub(start, start + 2))
+
+    assert [sub['start'] for sub in store.snapshot().find(3, 7)] == [2, 4, 6]
+    assert [sub['start'] for sub in store.snapshot().find(4, 6)] == [4]
+    assert store.snapshot().find(30, 40) == []
+
+
+def test_long_sub_is_found():
+
+    store = SubtitleStore()
+    store.append(make_sub(0, 30))
+    for start in range(10, 20):
+        store.append(make_sub(start, start + 1))
+
+    assert [sub['start'] for sub in store.snapshot().find(25, 26)] == [0]
+
+
+def test_out_of_order_append():
+
+    store = SubtitleStore()
+    store.append(make_sub(0, 1))
+    store.append(make_sub(4, 5))
+    snapshot = store.snapshot()
+    store.append(make_sub(2, 3))
+
+    assert [sub['start'] for sub in store.snapshot()] == [0, 2, 4]
+    # published snapshots do not change
+    assert [sub['start'] for sub in snapshot] == [0, 4]
+
+
+def test_pop_first():
+
+    store = SubtitleStore()
+    for start in range(1000):
+        store.append(make_sub(start, start + 1))
+    snapshot = store.snapshot()
+
+    for start in range(600):
+        assert store.pop_first()['start'] == start
+
+    assert len(store) == 400
+    assert [sub['start'] for sub in store.snapshot().find(0, 601)] == [600]
+    assert len(snapshot) == 1000
+
+
+def test_pop_first_empty():
+
+    with pytest.raises(IndexError):
+        SubtitleStore().pop_first()
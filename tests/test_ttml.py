@@ -0,0 +1,78 @@
+import pytest
+
+from Ttml import TtmlReader, TtmlWriter, TtmlNode, TtmlNoCues
+
+
+DOCUMENT = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling" '
+            'xmlns:ttp="http://www.w3.org/ns/ttml#parameter" xml:lang="en" ttp:tickRate="10000000">\n'
+            '<head><styling><style xml:id="s1" tts:color="white"/></styling></head>\n'
+            '<body><div>\n'
+            '<p begin="10000000t" end="25000000t" style="s1">Tom &amp; Jerry<br/>\n'
+            '  <span tts:fontStyle="italic">again</span></p>\n'
+            '<p begin="00:00:03.500" end="00:00:04.250">1 &lt; 2</p>\n'
+            '<p begin="5s" end="5500ms">offset times</p>\n'
+            '</div></body>\n'
+            '</tt>\n')
+
+
+def test_read_cues():
+
+    document = TtmlReader().read(DOCUMENT.encode('utf-8'))
+
+    assert document.get_languages() == ['en']
+    assert len(document.cues) == 3
+
+    cue = document.cues[0]
+    assert cue.start == 1000000
+    assert cue.end == 2500000
+    assert [node.type_ for node in cue.nodes] == [TtmlNode.TEXT, TtmlNode.BREAK, TtmlNode.TEXT]
+    assert cue.nodes[0].content == 'Tom & Jerry'
+    assert cue.nodes[2].content == 'again'
+
+    assert (document.cues[1].start, document.cues[1].end) == (3500000, 4250000)
+    assert document.cues[1].nodes[0].content == '1 < 2'
+    assert (document.cues[2].start, document.cues[2].end) == (5000000, 5500000)
+
+
+def test_default_tick_rate():
+
+    document = TtmlReader().read('<tt><body><p begin="30t" end="45t">ticks</p></body></tt>')
+
+    assert document.get_languages() == ['und']
+    assert (document.cues[0].start, document.cues[0].end) == (30000000, 45000000)
+
+
+def test_round_trip():
+
+    assert TtmlWriter().write(TtmlReader().read(DOCUMENT)) == DOCUMENT.encode('utf-8')
+
+
+def test_write_escapes_translated_text():
+
+    document = TtmlReader().read(DOCUMENT)
+    document.cues[0].nodes[0].content = 'Tom & Jerry <3'
+    document.cues[0].nodes[2].content = 'encore'
+
+    output = TtmlWriter().write(document).decode('utf-8')
+
+    assert '<p begin="10000000t" end="25000000t" style="s1">Tom &amp; Jerry &lt;3<br/>\n' \
+           '  <span tts:fontStyle="italic">encore</span></p>' in output
+    # head and the other cues are unchanged
+    assert '<head><styling><style xml:id="s1" tts:color="white"/></styling></head>' in output
+    assert '<p begin="00:00:03.500" end="00:00:04.250">1 &lt; 2</p>' in output
+
+
+def test_prefixed_elements():
+
+    document = TtmlReader().read('<tt:tt xmlns:tt="http://www.w3.org/ns/ttml" xml:lang="de">'
+                                 '<tt:body><tt:p begin="1s" end="2s">eins<tt:br />zwei</tt:p></tt:body></tt:tt>')
+
+    assert document.get_languages() == ['de']
+    assert [node.content for node in document.cues[0].nodes] == ['eins', None, 'zwei']
+
+
+def test_no_cues():
+
+    with pytest.raises(TtmlNoCues):
+        TtmlReader().read('<tt xml:lang="en"><body><div/></body></tt>')
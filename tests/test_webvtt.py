@@ -0,0 +1,119 @@
+import pytest
+
+from WebVtt import WebVttReader, WebVttWriter, WebVttNode, WebVttNoCues
+
+
+SEGMENT = ('WEBVTT\n'
+           'X-TIMESTAMP-MAP=MPEGTS:900000,LOCAL:00:00:00.000\n'
+           '\n'
+           'NOTE translated by eos\n'
+           'a second line --> with an arrow\n'
+           '\n'
+           'STYLE\n'
+           '::cue { color: yellow }\n'
+           '\n'
+           'cue-1\n'
+           '00:10:00.000 --> 00:10:01.800 line:85% align:center\n'
+           'Tom &amp; Jerry\n'
+           '<i>again</i>\n'
+           '\n'
+           '01:00:02.5 --> 01:00:03.900\n'
+           'no identifier\n'
+           '\n')
+
+
+def test_read_cues():
+
+    document = WebVttReader().read(SEGMENT.encode('utf-8'))
+
+    assert document.header == 'WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:900000,LOCAL:00:00:00.000'
+    assert len(document.cues) == 2
+
+    cue = document.cues[0]
+    assert cue.identifier == 'cue-1'
+    assert cue.timing == '00:10:00.000 --> 00:10:01.800 line:85% align:center'
+    assert cue.start == 600000000
+    assert cue.end == 601800000
+    assert [node.type_ for node in cue.nodes] == [WebVttNode.TEXT, WebVttNode.BREAK, WebVttNode.TEXT]
+    assert cue.nodes[0].content == 'Tom & Jerry'
+    assert cue.nodes[0].line == 'Tom &amp; Jerry'
+    assert cue.nodes[2].content == 'again'
+    assert cue.nodes[2].line == '<i>again</i>'
+
+    cue = document.cues[1]
+    assert cue.identifier is None
+    assert cue.start == 3602500000
+    assert cue.end == 3603900000
+
+
+def test_note_and_style_blocks_are_kept():
+
+    document = WebVttReader().read(SEGMENT)
+
+    assert document.blocks[0] == 'NOTE translated by eos\na second line --> with an arrow'
+    assert document.blocks[1] == 'STYLE\n::cue { color: yellow }'
+    assert document.blocks[2] is document.cues[0]
+
+
+def test_round_trip():
+
+    assert WebVttWriter().write(WebVttReader().read(SEGMENT)) == SEGMENT.encode('utf-8')
+
+
+def test_round_trip_bom_and_crlf():
+
+    content = '\ufeff' + SEGMENT.replace('\n', '\r\n')
+
+    assert WebVttWriter().write(WebVttReader().read(content.encode('utf-8'))) == SEGMENT.encode('utf-8')
+    assert WebVttWriter().write(WebVttReader().read(content)) == SEGMENT.encode('utf-8')
+
+
+def test_write_translated_nodes():
+
+    document = WebVttReader().read(SEGMENT)
+    document.cues[0].nodes = [WebVttNode(WebVttNode.TEXT, 'Tom et Jerry'),
+                              WebVttNode(WebVttNode.BREAK),
+                              WebVttNode(WebVttNode.TEXT, ''),
+                              WebVttNode(WebVttNode.TEXT, 'encore')]
+
+    output = WebVttWriter().write(document).decode('utf-8')
+
+    # empty lines would end the cue, they are dropped
+    assert 'cue-1\n00:10:00.000 --> 00:10:01.800 line:85% align:center\nTom et Jerry\nencore\n\n' in output
+
+
+def test_translate_cue_with_markup():
+
+    document = WebVttReader().read('WEBVTT\n\n'
+                                   '00:00:01.000 --> 00:00:02.000\n'
+                                   '<v Bob>Hello <b>world</b> &amp; you\n'
+                                   '<i>Fish &lt;&gt; chips</i>\n'
+                                   '\n'
+                                   '00:00:03.000 --> 00:00:04.000\n'
+                                   '<v Bob>Not <b>translated</b> &amp; kept\n'
+                                   '\n')
+
+    # the translator gets the text without markup and entities
+    nodes = document.cues[0].nodes
+    assert nodes[0].content == 'Hello world & you'
+    assert nodes[2].content == 'Fish <> chips'
+
+    nodes[0].content = 'Bonjour le monde & toi'
+    nodes[2].content = 'Poisson <> frites'
+
+    output = WebVttWriter().write(document).decode('utf-8')
+
+    assert '00:00:01.000 --> 00:00:02.000\nBonjour le monde &amp; toi\nPoisson &lt;&gt; frites\n\n' in output
+    assert '00:00:03.000 --> 00:00:04.000\n<v Bob>Not <b>translated</b> &amp; kept\n\n' in output
+
+
+def test_no_cues():
+
+    with pytest.raises(WebVttNoCues):
+        WebVttReader().read('WEBVTT\n\nNOTE only a note\n')
+
+
+def test_not_webvtt():
+
+    with pytest.raises(ValueError):
+        WebVttReader().read('1\n00:00:01,000 --> 00:00:02,000\nSRT\n')